@@ -12,6 +12,8 @@ from langgraph.graph import StateGraph, START, END
 from langgraph.graph import StateGraph
 from typing import TypedDict, List, Literal
 import json
+import asyncio
+import time
 from pydantic import BaseModel, Field
 from langchain_core.runnables import RunnableConfig
 from langchain_core.messages import SystemMessage, HumanMessage
@@ -19,10 +21,13 @@ from mooseagent.utils import load_chat_model, combine_code_with_description
 import random
 from langgraph.checkpoint.memory import MemorySaver
 from mooseagent.configuration import Configuration
+from mooseagent.corpus import append_record
+from mooseagent.hit import object_types
 
-COMMENT_PATH = "E:/vscode/python/Agent/langgraph_learning/mooseagent/src/database/comment.json"
+COMMENT_PATH = "E:/vscode/python/Agent/langgraph_learning/mooseagent/src/database/comment.jsonl"
 input_card_path = "E:/vscode/python/Agent/langgraph_learning/mooseagent/src/database/case_name_uncommented.txt"
 dp_json_path = "E:/vscode/python/Agent/langgraph_learning/mooseagent/src/database/dp.json"
+done_path = input_card_path.replace(".txt", "_done.txt")  # work queue of batch mode
 save_every = 3
 
 
@@ -35,6 +40,7 @@ class InputCardWorkflowState(TypedDict):
     input_card_path: list[str]  # 输入卡路径列表
     dp_json: dict[str, str]  # 文档字典
     input_card_name: str  # 输入卡名称
+    source_path: str  # 输入卡的原始路径
     inpcard: str  # 输入卡内容
     annotated_input_card: str  # 注释后的输入卡内容
     num_commented: int  # 已注释数量
@@ -112,12 +118,18 @@ def input_card_selector(state: InputCardWorkflowState, config: RunnableConfig):
             inpcard_content = file.read()
             if len(inpcard_content.splitlines()) > 10:
                 break
+    source_path = selected_input_card
     selected_input_card = adjust_path(selected_input_card)
     if state.get("num_commented") is None:
         num_commented = 0
     else:
         num_commented = state["num_commented"] + 1
-    return {"input_card_name": selected_input_card, "inpcard": inpcard_content, "num_commented": num_commented}
+    return {
+        "input_card_name": selected_input_card,
+        "source_path": source_path,
+        "inpcard": inpcard_content,
+        "num_commented": num_commented,
+    }
 
 
 def rag(state: InputCardWorkflowState, config: RunnableConfig):
@@ -136,14 +148,7 @@ def rag(state: InputCardWorkflowState, config: RunnableConfig):
 
     else:
         ### use code to extract the app used in the input card
-        app_list = []
-        lines = state["inpcard"].splitlines()
-        for line in lines:
-            line = line.replace(" type=", " type =")
-            if " type =" in line:
-                # 提取app名称，假设格式为 type = <appname>
-                app_name = line.split(" type =")[-1].strip().split()[0]
-                app_list.append(app_name)
+        app_list = object_types(state["inpcard"])
     # find the documentation of the app used in the input card
     rag_info = ""
     for app in app_list:
@@ -178,46 +183,48 @@ def writer(state: InputCardWorkflowState, config: RunnableConfig):
     return {"overall_description": response.overall_description, "annotated_input_card": response.annotated_input_card}
 
 
-def save_to_json(state: InputCardWorkflowState):
+def write_comment(input_card_name: str, overall_description: str, annotated_input_card: str, source_path: str = ""):
     """
-    该函数用于将输入卡的注释和整体描述保存到JSON文件中。
-    通过检查文件是否存在，如果存在则读取现有数据，否则创建新的输出数据。
-    该函数返回一个包含输入卡名称、整体描述和注释输入卡的字典。
+    将一个输入卡的注释和整体描述追加到JSONL文件中，并另存一份txt文件。
+    每个输入卡只追加一行，不会重写已有的数据。
 
     Args:
-        state (InputCardWorkflowState): 输入卡工作流状态，包含输入卡路径、名称、内容和注释数量。
-
-    Returns:
-        dict: 包含输入卡名称、整体描述和注释输入卡的字典。
+        input_card_name (str): 调整后的输入卡名称。
+        overall_description (str): 整体描述。
+        annotated_input_card (str): 注释后的输入卡内容。
+        source_path (str): 输入卡的原始路径，建立索引时从中得到 MOOSE 模块。
     """
-
-    # 检查文件是否存在，如果存在则读取现有数据
-    if os.path.exists(COMMENT_PATH):
-        with open(COMMENT_PATH, "r", encoding="utf-8") as f:
-            existing_data = json.load(f)
-    else:
-        existing_data = []
-
-    # 创建新的输出数据
     new_data = {
-        "input_card_name": state["input_card_name"],
-        "overall_description": state["overall_description"],
-        "annotated_input_card": state["annotated_input_card"],
+        "input_card_name": input_card_name,
+        "overall_description": overall_description,
+        "annotated_input_card": annotated_input_card,
     }
-
-    # 将新数据添加到现有数据中
-    existing_data.append(new_data)
-
-    # 将更新后的数据写回文件
-    with open(COMMENT_PATH, "w", encoding="utf-8") as f:
-        json.dump(existing_data, f, ensure_ascii=False, indent=4)
+    if source_path:
+        new_data["source_path"] = source_path
+    append_record(COMMENT_PATH, new_data)
 
     # 也保存到txt文件
-    text = combine_code_with_description(state["overall_description"], state["annotated_input_card"])
-    text_path = COMMENT_PATH.replace(".json", "/" + state["input_card_name"])
+    text = combine_code_with_description(overall_description, annotated_input_card)
+    text_path = os.path.join(os.path.splitext(COMMENT_PATH)[0], input_card_name)
     with open(text_path, "w", encoding="utf-8") as f:
         f.write(text)
     print(f"Input card data added to {text_path}")
+
+
+def save_to_json(state: InputCardWorkflowState):
+    """
+    该函数用于将输入卡的注释和整体描述保存到JSONL文件中。
+    每注释save_every个输入卡，重写一次未注释输入卡的路径列表。
+
+    Args:
+        state (InputCardWorkflowState): 输入卡工作流状态，包含输入卡路径、名称、内容和注释数量。
+    """
+    write_comment(
+        state["input_card_name"],
+        state["overall_description"],
+        state["annotated_input_card"],
+        state.get("source_path", ""),
+    )
     # input_card_path = state["input_card_path"].remove(state["input_card_name"])
     if state["num_commented"] % save_every == 0:
         uncommented_input_card_path = ""
@@ -253,14 +260,102 @@ workflow.add_edge("rag", "writer")
 workflow.add_edge("writer", "save_to_json")
 workflow.add_edge("save_to_json", "input_card_selector")
 
+
+class WorkQueue:
+    """
+    批量注释模式的持久化工作队列。
+    已完成的输入卡路径逐行追加到done文件中，未完成的路径 = 全部路径 - 已完成路径，
+    因此中断后重新运行会从停止的地方继续，无需重写case_name_uncommented.txt。
+    """
+
+    def __init__(self, input_card_list: list[str], done_file: str):
+        self.input_card_list = input_card_list
+        self.done_file = done_file
+        self.done = set()
+        if os.path.exists(done_file):
+            with open(done_file, "r", encoding="utf-8") as file:
+                self.done = {line.strip() for line in file if line.strip()}
+
+    def pending(self) -> list[str]:
+        return [path for path in self.input_card_list if path not in self.done]
+
+    def mark_done(self, path: str):
+        self.done.add(path)
+        with open(self.done_file, "a", encoding="utf-8") as file:
+            file.write(path + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+
+async def annotate_input_card(
+    path: str, dp_json: dict, config: RunnableConfig, queue: WorkQueue, semaphore: asyncio.Semaphore
+) -> str:
+    """
+    注释一个输入卡（rag -> writer -> 保存），失败时按指数退避重试。
+
+    Returns:
+        str: "done", "skipped" 或 "failed"。
+    """
+    configuration = Configuration.from_runnable_config(config)
+    async with semaphore:
+        for attempt in range(configuration.comment_max_retries + 1):
+            try:
+                with open(path, "r", encoding="utf-8") as file:
+                    inpcard_content = file.read()
+                if len(inpcard_content.splitlines()) <= 10:
+                    queue.mark_done(path)
+                    return "skipped"
+                state = {"input_card_name": adjust_path(path), "inpcard": inpcard_content, "dp_json": dp_json}
+                state.update(await asyncio.to_thread(rag, state, config))
+                state.update(await asyncio.to_thread(writer, state, config))
+                write_comment(
+                    state["input_card_name"], state["overall_description"], state["annotated_input_card"], path
+                )
+                queue.mark_done(path)
+                return "done"
+            except Exception as e:
+                if attempt == configuration.comment_max_retries:
+                    print(f"---failed to annotate {path}: {e}---")
+                    return "failed"
+                delay = configuration.comment_retry_delay * 2**attempt
+                print(f"---retry {path} in {delay}s ({attempt + 1}/{configuration.comment_max_retries}): {e}---")
+                await asyncio.sleep(delay)
+
+
+async def batch_comment(input_card_list: list[str], dp_json: dict, config: RunnableConfig, max_commented: int = 400):
+    """
+    批量注释模式：用有界的异步池同时注释多个输入卡，吞吐量由comment_concurrency控制，
+    可根据模型提供商的速率限制调整。失败的输入卡不会被标记为完成，下次运行时会重新注释。
+    """
+    configuration = Configuration.from_runnable_config(config)
+    queue = WorkQueue(input_card_list, done_path)
+    pending = queue.pending()[:max_commented]
+    print(f"---{len(pending)} input cards to annotate, {len(queue.done)} already done---")
+    semaphore = asyncio.Semaphore(configuration.comment_concurrency)
+    start_time = time.perf_counter()
+    results = await asyncio.gather(
+        *[annotate_input_card(path, dp_json, config, queue, semaphore) for path in pending]
+    )
+    elapsed = time.perf_counter() - start_time
+    n_done = results.count("done")
+    print(
+        f"---annotated: {n_done}, skipped: {results.count('skipped')}, failed: {results.count('failed')}, "
+        f"{n_done / elapsed * 60:.1f} cards/min---"
+    )
+    return results
+
+
 # 使用示例
 if __name__ == "__main__":
     with open(input_card_path, "r", encoding="utf-8") as file:
         input_card_list = [line.strip() for line in file.readlines()]
     with open(dp_json_path, "r", encoding="utf-8") as file:
         dp_json = json.load(file)
-    app = workflow.compile()
-    result = app.invoke(
-        {"input_card_path": input_card_list, "dp_json": dp_json, "max_commented": 400}, {"recursion_limit": 10000}
-    )
+    if "--batch" in sys.argv:
+        asyncio.run(batch_comment(input_card_list, dp_json, RunnableConfig(), max_commented=400))
+    else:
+        app = workflow.compile()
+        result = app.invoke(
+            {"input_card_path": input_card_list, "dp_json": dp_json, "max_commented": 400}, {"recursion_limit": 10000}
+        )
     # print(result)
@@ -0,0 +1,142 @@
+"""Block-level chunks of the annotated input cards, and the parent cards they are retrieved with.
+
+With ``chunk_mode = "block"`` every top-level block of an annotated card (``[Kernels]``, ``[BCs]``, ...) is embedded
+as its own chunk, with the beginning of the card description as context, so a long card is not diluted into one
+vector. The whole records are kept in a ``ParentStore`` next to the vector database. At query time the chunks are
+grouped by their card, and every card is returned once, trimmed: the blocks which matched are kept in full, the
+other blocks are reduced to their headers and ``type`` lines.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from functools import lru_cache
+from typing import Dict, Iterator, List
+
+from langchain_core.documents import Document
+
+from mooseagent.corpus import read_records
+from mooseagent.hit import TopBlock, parse
+from mooseagent.moose_modules import tag_record
+
+PARENTS_FILE = "parents.json"
+
+
+def parent_id(record: Dict) -> str:
+    """The input card name of an annotated card, or the hash of other records."""
+    return record.get("input_card_name") or hashlib.sha256(json.dumps(record).encode("utf-8")).hexdigest()
+
+
+def chunk_record(record: Dict, metadata: Dict, context_chars: int = 400) -> List[Document]:
+    """Split an annotated card into one document per top-level block.
+
+    Records without an annotated card (e.g. of dp_detail.json) and cards without blocks stay one document.
+    """
+    card = record.get("annotated_input_card")
+    blocks = parse(card).blocks if isinstance(card, str) else []
+    if not blocks:
+        return [Document(page_content=json.dumps(record), metadata=dict(metadata))]
+    description = record.get("overall_description", "")
+    if len(description) > context_chars:
+        description = description[:context_chars].rsplit(" ", 1)[0] + " ..."
+    context = f"Input card: {record.get('input_card_name', '')}\nDescription: {description}\n\n"
+    pid = parent_id(record)
+    return [
+        Document(page_content=context + block.text, metadata=dict(metadata, parent_id=pid, block=block.path))
+        for block in blocks
+    ]
+
+
+def iter_chunks(path: str, parents: "ParentStore", context_chars: int = 400) -> Iterator[Document]:
+    """Stream the block chunks of the records of ``path``, and put every record into the parent store."""
+    for seq_num, record in enumerate(read_records(path), 1):
+        parents.add(record)
+        yield from chunk_record(record, {"source": path, "seq_num": seq_num, **tag_record(record)}, context_chars)
+
+
+def _skeleton(top: TopBlock) -> str:
+    """The headers, terminators and ``type`` lines of a top-level block."""
+    keep = set()
+    for block in top.walk():
+        keep.update((block.start, block.end))
+        for param in block.params:
+            if param.name == "type":
+                keep.update(range(param.start, param.end + 1))
+    lines = top.text.splitlines(keepends=True)
+    return "".join(lines[i] for i in sorted(keep) if i < len(lines))
+
+
+def trim_card(card: str, blocks: List[str]) -> str:
+    """Keep the text between the blocks and the ``blocks`` in full, reduce the other top-level blocks to skeletons."""
+    doc = parse(card)
+    if doc.errors:
+        return card
+    pieces = []
+    for piece in doc.pieces:
+        if isinstance(piece, str):
+            pieces.append(piece)
+        else:
+            pieces.append(piece.text if piece.path in blocks else _skeleton(piece))
+    return "".join(pieces)
+
+
+class ParentStore:
+    """The whole records of the chunked cards by ``parent_id``, saved as one JSON file."""
+
+    def __init__(self, path: str = ""):
+        self.path = path
+        self.records: Dict[str, Dict] = {}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.records = json.load(f)
+
+    def add(self, record: Dict):
+        with self.lock:
+            self.records[parent_id(record)] = record
+
+    def get(self, pid: str):
+        return self.records.get(pid)
+
+    def save(self):
+        if self.path:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.records, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    def parents(self, chunks: List[Document], k: int) -> List[Document]:
+        """Turn the retrieved chunks into at most ``k`` trimmed cards, ranked by their best chunk.
+
+        Documents which are not chunks (or whose card is missing from the store) are returned as they are.
+        """
+        ranked: Dict[str, List[str]] = {}
+        whole: Dict[str, Document] = {}
+        for chunk in chunks:
+            pid = chunk.metadata.get("parent_id")
+            if pid is None or self.get(pid) is None:
+                key = chunk.page_content
+                whole.setdefault(key, chunk)
+                ranked.setdefault(key, [])
+            elif chunk.metadata.get("block") not in ranked.setdefault(pid, []):
+                ranked[pid].append(chunk.metadata.get("block"))
+            if len(ranked) > k:
+                ranked.popitem()
+                break
+        docs = []
+        for key, blocks in ranked.items():
+            if key in whole:
+                docs.append(whole[key])
+                continue
+            record = dict(self.get(key))
+            record["annotated_input_card"] = trim_card(record["annotated_input_card"], blocks)
+            docs.append(Document(page_content=json.dumps(record), metadata={"parent_id": key, "blocks": blocks}))
+        return docs
+
+
+@lru_cache(maxsize=None)
+def get_parent_store(database_path: str) -> ParentStore:
+    """The parent store of a vector database, loaded once per process."""
+    return ParentStore(os.path.join(database_path, PARENTS_FILE))
@@ -1,10 +1,19 @@
 import os
+import tempfile
 from enum import Enum
 from dataclasses import dataclass, fields
 from typing import Any, Optional, Dict
 from langchain_core.runnables import RunnableConfig
 
 
+def store_name(embedding_function: str) -> str:
+    """The name of the vector space of an embedding function in the names of the store directories.
+
+    BGE_M3_ONNX computes the BGE-M3 vectors with an int8 copy of the model, so it searches the BGE-M3 stores.
+    """
+    return {"BGE_M3_ONNX": "BGE_M3_EmbeddingFunction"}.get(embedding_function, embedding_function)
+
+
 @dataclass(kw_only=True)
 class Configuration:
     """The configurable fields for the chatbot."""
@@ -18,12 +27,13 @@ class Configuration:
     review_model: str = "huoshan/deepseek-v3-241226"  # Defaults to claude-3-7-sonnet-latest
     writer_model: str = "huoshan/deepseek-v3-241226"  # Defaults to claude-3-5-sonnet-latest
     extracter_model: str = "openai/gpt-4o-mini"
-    embedding_function: str = "BGE_M3_EmbeddingFunction"  # "OPENAI"  or "BGE_M3_EmbeddingFunction"
+    embedding_function: str = "BGE_M3_EmbeddingFunction"  # "OPENAI", "BGE_M3_EmbeddingFunction" or "BGE_M3_ONNX"
 
     # DIR
     ABSOLUTE_PATH: str = "/home/zt/workspace/MooseAgent/src"
     MOOSE_DIR: str = "/home/zt/workspace/mymoose/mymoose-opt"
-    save_dir: str = "/home/zt/workspace/MooseAgent/run_path/"
+    save_dir: str = "/home/zt/workspace/MooseAgent/run_path/"  # the cards of every run go to save_dir/<run_id>
+    workspace_dir: str = os.path.join(ABSOLUTE_PATH, "workspace")  # every version of the cards of every run
     docs_dir: str = os.path.join(ABSOLUTE_PATH, "database")
     DATABASE_NAME: str = "*.md"
     TEMPERATURE: float = 0.1
@@ -31,36 +41,117 @@ class Configuration:
     # RAG
     top_k: int = 3
     rag_model: str = "openai/gpt-4o-mini"
+    query_cache_path: str = os.path.join(ABSOLUTE_PATH, "database", "query_cache.json")
+    query_skip_threshold: float = 0.0  # > 0: skip the query model if the keyword search scores above it
+    rerank: bool = False  # over-fetch similar cases and rerank them before the architect
+    rerank_fetch_k: int = 30
+    rerank_model: str = "cross-encoder/BAAI/bge-reranker-base"  # "cross-encoder/<name>" on CPU or a chat model
+    rerank_cache_path: str = os.path.join(ABSOLUTE_PATH, "database", "rerank_cache.jsonl")
+    rerank_cache_max_entries: int = 50000  # scores of (query, case) pairs, the least recently used are evicted
+    chunk_fetch_k: int = 20  # chunk_mode "block": chunks retrieved, grouped into at most top_k cards
+    batch_retrieval: bool = True  # retrieve the cases of all files of an architect round in one batched search
+    filter_by_module: bool = True  # search the MOOSE modules inferred from the requirement, unfiltered if too few hits
 
     # setting for load_vector_database.py
-    rag_json_path: str = os.path.join(ABSOLUTE_PATH, "database", "comment.json")  # comment.json or dp_detail.json
-    batch_size: int = 1  # batch size for adding documents to the vector store
+    rag_json_path: str = os.path.join(
+        ABSOLUTE_PATH, "database", "comment.jsonl"
+    )  # comment.jsonl, comment.json or dp_detail.json
+    batch_size: int = 1  # batch size for adding documents to the vector store with a local embedding model
+    remote_batch_size: int = 64  # the same with a remote embedding API, whose requests are split as below
+    # "card": one vector per annotated card, "block": one vector per top-level block, retrieved with its card
+    chunk_mode: str = "card"
+    chunk_context_chars: int = 400  # chunk_mode "block": characters of the card description added to every chunk
+    # remote embedding API: requests are split by items and tokens, sent concurrently and retried on 429/5xx
+    embedding_max_items: int = 64
+    embedding_max_tokens: int = 8000
+    embedding_concurrency: int = 4
+    embedding_max_retries: int = 5
+    embedding_timeout: float = 60
+    # int8 ONNX model of BGE_M3_ONNX, written by onnx_embedding.py export
+    onnx_model_dir: str = os.path.join(ABSOLUTE_PATH, "database", "bge-m3-onnx")
     vector_store: str = "Chroma"
     PERSIST_DIRECTORY: str = os.path.join(
-        ABSOLUTE_PATH, "database", embedding_function + f"_{vector_store}_inpcard"
+        ABSOLUTE_PATH, "database", store_name(embedding_function) + f"_{vector_store}_inpcard"
     )  # database to save
 
     # database for loading
 
-    dp_database_path: str = os.path.join(ABSOLUTE_PATH, "database", embedding_function + f"_{vector_store}_dp")
-    input_database_path: str = os.path.join(ABSOLUTE_PATH, "database", embedding_function + f"_{vector_store}_inpcard")
+    dp_database_path: str = os.path.join(
+        ABSOLUTE_PATH, "database", store_name(embedding_function) + f"_{vector_store}_dp"
+    )
+    input_database_path: str = os.path.join(
+        ABSOLUTE_PATH, "database", store_name(embedding_function) + f"_{vector_store}_inpcard"
+    )
 
     # AUTO COMMENT
     use_llm_rag: bool = False
     comment_rag_model: str = "openai/gpt-4o-mini"
     comment_writer_model: str = "openai/gpt-4o-mini"
     dp_json_path: str = os.path.join(ABSOLUTE_PATH, "database", "dp.json")
+    comment_concurrency: int = 8  # number of input cards annotated at the same time in batch mode
+    comment_max_retries: int = 3
+    comment_retry_delay: float = 2.0  # seconds, doubled after every failed attempt
 
     # run
     MAX_ITER: int = 7
     MAX_REARCHITECT = 3
     mpi: int = 1
+    mpi_auto: bool = False  # choose the number of ranks from the mesh size of the input card
+    elements_per_rank: int = 20000
+    max_cores: int = 0  # cores shared by all simulations on this host, 0 means all cores
+    scheduler_dir: str = os.path.join(tempfile.gettempdir(), "mooseagent_cores")  # shared by all runs on the host
+    scheduler_metrics_path: str = ""  # append the queue and run time of every simulation to this JSONL file
+    validation_socket: str = ""  # socket of a running validation_server.py, used for --check-input
+    watchdog: bool = False  # follow the output of MOOSE and stop runs which already failed or diverge
+    watchdog_success_steps: int = 0  # > 0: a run succeeds after this many converged time steps
+    watchdog_divergence_factor: float = 1e8
+    watchdog_max_failed_solves: int = 3  # solves in a row which did not converge
+    watchdog_timeout: float = 0  # seconds, 0 for no limit
+    # run a few time steps of a coarser mesh without output files before the full run, to find the errors in seconds;
+    # only cards whose time steps or generated mesh are reduced get the quick check
+    reduced_fidelity: bool = False
+    reduced_num_steps: int = 2
+    reduced_coarsen: int = 4  # nx, ny and nz of generated meshes are divided by this
+    run_cache: bool = False  # reuse the setup error or quick check success of identical cards instead of running MOOSE
+    run_cache_dir: str = os.path.join(ABSOLUTE_PATH, "run_cache")
+    run_cache_max_entries: int = 256
+    rollback: bool = True  # undo a modify which makes the run fail earlier than the best version so far
+    modify_mode: str = "patch"  # "patch": only rewrite the changed blocks, "full": rewrite the whole input card
+    prefetch_docs: bool = True  # give modify the documentation of every object of the cards, looked up by name
+    helper_max_rounds: int = 6  # tool rounds of the helper agent before it must answer
+    helper_max_tokens: int = 60000
+    helper_timeout: float = 300  # seconds
+    helper_tool_concurrency: int = 4  # tool calls of one assistant turn running at the same time
+    online_learning: bool = False  # add the input cards of successful runs to the case store (input_database_path)
+    learned_cases_path: str = os.path.join(ABSOLUTE_PATH, "database", "learned.jsonl")
+    online_compact_every: int = 20  # learned cards between two background compactions of the case store, 0 for never
+    repair_memory: bool = True  # remember the repairs of successful runs, and reuse them for the same errors
+    repair_memory_path: str = os.path.join(ABSOLUTE_PATH, "database", "repairs.jsonl")
+    repair_memory_top_k: int = 3  # remembered repairs put into the modify prompt
+    repair_memory_threshold: float = 0.75  # minimal similarity of the error signatures of a similar error
+    repair_memory_apply: bool = True  # apply a repair of the same error directly if its blocks are still unchanged
 
     @classmethod
     def from_runnable_config(cls, config: Optional[RunnableConfig] = None) -> "Configuration":
         """Create a Configuration instance from a RunnableConfig."""
         configurable = config["configurable"] if config and "configurable" in config else {}
         values: dict[str, Any] = {
-            f.name: os.environ.get(f.name.upper(), configurable.get(f.name)) for f in fields(cls) if f.init
+            f.name: _coerce(f.name, f.type, os.environ.get(f.name.upper(), configurable.get(f.name)))
+            for f in fields(cls)
+            if f.init
         }
-        return cls(**{k: v for k, v in values.items() if v})
+        # a switch set to False or a count set to 0 is an override as well, only unset fields keep their default
+        return cls(**{k: v for k, v in values.items() if v is not None})
+
+
+def _coerce(name: str, field_type: Any, value: Any) -> Any:
+    """Convert a value from an environment variable (always a string) to the type of its field."""
+    if not isinstance(value, str) or field_type not in (bool, int, float):
+        return value
+    if field_type is bool:
+        if value.strip().lower() in ("1", "true", "yes", "on"):
+            return True
+        if value.strip().lower() in ("0", "false", "no", "off"):
+            return False
+        raise ValueError(f"{name.upper()}={value!r} is not a boolean.")
+    return field_type(value)
@@ -0,0 +1,124 @@
+"""Append-only JSONL storage for the annotated input cards (comment.jsonl).
+
+Every annotated card is one line. Appending a line never rewrites the existing records, so a crash can at most
+leave a torn last line, which is skipped when reading and dropped by ``compact``.
+
+Usage:
+    python corpus.py convert database/comment.json   # -> database/comment.jsonl
+    python corpus.py compact database/comment.jsonl
+"""
+
+import json
+import os
+import sys
+import threading
+from typing import Dict, Iterator, List
+
+_append_lock = threading.Lock()
+
+
+def append_record(path: str, record: Dict) -> None:
+    """Append one record to a JSONL file.
+
+    The line is written with a single unbuffered ``write`` on a file opened in append mode and synced to disk, so
+    concurrent writers never interleave and the existing records are never touched. Works on POSIX and Windows.
+    """
+    line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+    with _append_lock, open(path, "a+b", buffering=0) as f:
+        if f.seek(0, os.SEEK_END):
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                # the last append was torn, start a new line so the new record stays readable
+                line = b"\n" + line
+        f.write(line)
+        os.fsync(f.fileno())
+
+
+def read_records(path: str) -> Iterator[Dict]:
+    """Stream the records of a JSONL file, or of a legacy JSON list file.
+
+    Lines that can not be decoded (e.g. torn by a crash during the append) are skipped.
+    """
+    if not path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        yield from data.values() if isinstance(data, dict) else data
+        return
+    with open(path, "r", encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                print(f"Skip broken line {n} in {path}")
+
+
+def iter_documents(path: str):
+    """Stream the records of ``path`` as documents for the vector store.
+
+    The page contents are the same as ``JSONLoader(path, jq_schema=".[]", text_content=False)`` creates, so the
+    hashes of already indexed records do not change when switching from comment.json to comment.jsonl. The metadata
+    also has the MOOSE module, physics and objects of the record, which searches can be filtered by.
+    """
+    for seq_num, record in enumerate(read_records(path), 1):
+        yield record_document(record, path, seq_num)
+
+
+def record_document(record: Dict, source: str, seq_num: int = 0):
+    """The document of one record, see ``iter_documents``."""
+    from langchain_core.documents import Document
+    from mooseagent.moose_modules import tag_record
+
+    metadata = {"source": source, "seq_num": seq_num, **tag_record(record)}
+    return Document(page_content=json.dumps(record), metadata=metadata)
+
+
+def compact(path: str, key: str = "input_card_name") -> int:
+    """Rewrite a JSONL file without broken lines and duplicated records (the last record of each key wins).
+
+    The compacted file is written to a temporary file and atomically renamed over the original one.
+
+    Returns:
+        int: The number of records kept.
+    """
+    records: Dict[str, Dict] = {}
+    for record in read_records(path):
+        records.pop(record.get(key), None)
+        records[record.get(key)] = record
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in records.values():
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return len(records)
+
+
+def convert_json_to_jsonl(json_path: str, jsonl_path: str = None) -> str:
+    """Convert a comment.json list file to the JSONL format.
+
+    Returns:
+        str: The path of the JSONL file.
+    """
+    jsonl_path = jsonl_path or os.path.splitext(json_path)[0] + ".jsonl"
+    records: List[Dict] = list(read_records(json_path))
+    tmp_path = jsonl_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, jsonl_path)
+    print(f"Convert {len(records)} records from {json_path} to {jsonl_path}")
+    return jsonl_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] not in ("convert", "compact"):
+        print(__doc__)
+        sys.exit(1)
+    if sys.argv[1] == "convert":
+        convert_json_to_jsonl(sys.argv[2])
+    else:
+        print(f"{compact(sys.argv[2])} records are kept in {sys.argv[2]}")
@@ -0,0 +1,104 @@
+"""Direct lookup of the documentation of MOOSE objects (dp.json), split per object and per parameter.
+
+The objects of an input card are known exactly (``type = X``), so their documentation is read from the store by name
+instead of searching the dp vector database with an embedding query.
+"""
+
+import json
+import os
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, Set
+
+from mooseagent.hit import parse
+
+# a parameter is mentioned as `name`, or starts a line of a list / table / definition: "- **name**: ..."
+_PARAM_MENTION = re.compile(r"`([A-Za-z_]\w*)`|^\s*(?:[-*|]\s*)?\**([A-Za-z_]\w*)\**\s*(?:[:|(]|-\s)", re.MULTILINE)
+
+
+class ObjectDoc:
+    """The documentation of one object: an overview and the paragraphs mentioning each parameter."""
+
+    __slots__ = ("name", "overview", "paragraphs", "params")
+
+    def __init__(self, name: str, text: str, overview_chars: int = 1500):
+        self.name = name
+        self.paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+        overview = []
+        for paragraph in self.paragraphs:
+            if overview and sum(len(p) for p in overview) + len(paragraph) > overview_chars:
+                break
+            overview.append(paragraph)
+        self.overview = "\n\n".join(overview)[:overview_chars]
+        self.params: Dict[str, List[int]] = {}
+        for n, paragraph in enumerate(self.paragraphs):
+            for match in _PARAM_MENTION.finditer(paragraph):
+                indexes = self.params.setdefault(match.group(1) or match.group(2), [])
+                if not indexes or indexes[-1] != n:
+                    indexes.append(n)
+
+    def param(self, name: str, max_chars: int = 600) -> str:
+        """Return the paragraphs about one parameter, empty if the documentation does not mention it."""
+        text = ""
+        for n in self.params.get(name, []):
+            if self.paragraphs[n] in self.overview:
+                continue
+            if text and len(text) + len(self.paragraphs[n]) > max_chars:
+                break
+            text += self.paragraphs[n] + "\n"
+        return text[:max_chars]
+
+
+class DocStore:
+    """The documentation of all objects of dp.json, chunked once when the store is loaded."""
+
+    def __init__(self, dp_json: Dict[str, str], overview_chars: int = 1500, param_chars: int = 600):
+        self.param_chars = param_chars
+        self.objects = {name: ObjectDoc(name, text, overview_chars) for name, text in dp_json.items()}
+
+    def __contains__(self, name: str):
+        return name in self.objects
+
+    def lookup(self, objects: Iterable[str], params: Dict[str, Iterable[str]] = None) -> str:
+        """Return the documentation of several objects at once.
+
+        Args:
+            objects (list): The object names, e.g. ``["DirichletBC", "Diffusion"]``.
+            params (dict): The parameters of each object to document besides its overview.
+        Returns:
+            str: The overview of every object and the paragraphs about its parameters.
+        """
+        params = params or {}
+        text, missing = "", []
+        for name in dict.fromkeys(objects):
+            doc = self.objects.get(name)
+            if doc is None:
+                missing.append(name)
+                continue
+            text += f"# Here is the documentation of {name}\n{doc.overview}\n"
+            for param in params.get(name, ()):
+                param_text = doc.param(param, self.param_chars)
+                if param_text:
+                    text += f"## Parameter {param} of {name}\n{param_text}"
+            text += "\n"
+        if missing:
+            text += f"No documentation is found for: {', '.join(missing)}.\n"
+        return text
+
+    def lookup_card(self, inpcard: str) -> str:
+        """Return the documentation of every object of an input card and of the parameters it sets."""
+        params: Dict[str, Set[str]] = {}
+        for block in parse(inpcard).walk():
+            object_type = block.get("type")
+            if object_type:
+                params.setdefault(object_type, set()).update(p.name for p in block.params if p.name != "type")
+        return self.lookup(params, {name: sorted(names) for name, names in params.items()})
+
+
+@lru_cache(maxsize=None)
+def get_docstore(dp_json_path: str) -> DocStore:
+    """Load and chunk dp.json once per process. A missing file gives an empty store."""
+    if not os.path.exists(dp_json_path):
+        return DocStore({})
+    with open(dp_json_path, "r", encoding="utf-8") as f:
+        return DocStore(json.load(f))
@@ -0,0 +1,133 @@
+"""Client of an OpenAI compatible ``/embeddings`` endpoint for large batches of texts.
+
+The texts are split into requests below the item and token limits of the provider, the requests are sent
+concurrently over one pooled HTTP session, and rate limits (429), server errors (5xx) and timeouts are retried with
+exponential backoff. The embeddings are returned in the order of the texts.
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class EmbeddingError(RuntimeError):
+    """Raised when a request still fails after all retries."""
+
+
+def estimate_tokens(text: str) -> int:
+    """A rough, tokenizer-free upper estimate of the number of tokens of a text."""
+    return len(text) // 3 + 1
+
+
+class EmbeddingClient:
+    """Embed texts with a remote embedding API.
+
+    Args:
+        api_url (str): The URL of the embeddings endpoint.
+        api_key (str): The API key, sent as a bearer token.
+        model (str): The model name.
+        max_items (int): The maximum number of texts in one request.
+        max_tokens (int): The maximum number of (estimated) tokens in one request.
+        concurrency (int): The number of requests sent at the same time.
+        max_retries (int): The number of retries of a failed request.
+        backoff (float): Seconds before the first retry, doubled after every retry (or the ``Retry-After`` header).
+        timeout (float): Seconds before a request times out.
+    """
+
+    def __init__(
+        self,
+        api_url: str,
+        api_key: str,
+        model: str,
+        max_items: int = 64,
+        max_tokens: int = 8000,
+        concurrency: int = 4,
+        max_retries: int = 5,
+        backoff: float = 1.0,
+        timeout: float = 60,
+    ):
+        self.api_url = api_url
+        self.model = model
+        self.max_items = max_items
+        self.max_tokens = max_tokens
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"})
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.stats = {"texts": 0, "requests": 0, "retries": 0, "seconds": 0.0}
+
+    def chunks(self, texts: List[str]) -> List[Tuple[int, List[str]]]:
+        """Split the texts into requests. Returns ``(index of the first text, texts)`` for each request."""
+        chunks, start, tokens = [], 0, 0
+        for i, text in enumerate(texts):
+            text_tokens = estimate_tokens(text)
+            if i > start and (i - start >= self.max_items or tokens + text_tokens > self.max_tokens):
+                chunks.append((start, texts[start:i]))
+                start, tokens = i, 0
+            tokens += text_tokens
+        if start < len(texts):
+            chunks.append((start, texts[start:]))
+        return chunks
+
+    def post(self, texts: List[str]) -> List[List[float]]:
+        """Send one request, retrying rate limits, server errors and network errors."""
+        data = {"model": self.model, "input": texts, "encoding_format": "float"}
+        for attempt in range(self.max_retries + 1):
+            delay = self.backoff * 2**attempt * (1 + random.random() * 0.1)
+            try:
+                response = self.session.post(self.api_url, json=data, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = str(e)
+            else:
+                if response.status_code < 400:
+                    items = response.json()["data"]
+                    if all("index" in item for item in items):
+                        items = sorted(items, key=lambda item: item["index"])
+                    if len(items) != len(texts):
+                        raise EmbeddingError(f"{len(texts)} texts were sent but {len(items)} embeddings returned.")
+                    return [item["embedding"] for item in items]
+                if response.status_code not in RETRY_STATUS:
+                    response.raise_for_status()
+                error = f"HTTP {response.status_code}: {response.text[:200]}"
+                retry_after = response.headers.get("Retry-After", "")
+                if retry_after.replace(".", "", 1).isdigit():
+                    delay = float(retry_after)
+            if attempt == self.max_retries:
+                break
+            with self.lock:
+                self.stats["retries"] += 1
+            time.sleep(delay)
+        raise EmbeddingError(f"Embedding request failed after {self.max_retries} retries: {error}")
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """Embed the texts, in order."""
+        if not texts:
+            return []
+        start_time = time.perf_counter()
+        chunks = self.chunks(texts)
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(chunks))) as executor:
+            results = list(executor.map(self.post, [chunk for _, chunk in chunks]))
+        with self.lock:
+            self.stats["texts"] += len(texts)
+            self.stats["requests"] += len(chunks)
+            self.stats["seconds"] += time.perf_counter() - start_time
+        return [embedding for result in results for embedding in result]
+
+    def throughput(self) -> Dict:
+        """The texts per second and the requests sent so far."""
+        stats = dict(self.stats)
+        stats["texts_per_second"] = stats["texts"] / stats["seconds"] if stats["seconds"] else 0.0
+        return stats
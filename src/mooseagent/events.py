@@ -0,0 +1,165 @@
+"""Progress events of a graph run.
+
+Every event is a dict ``{"event": <kind>, "time": <unix time>, ...}`` sent to the ``custom`` stream mode of
+LangGraph, so a client can render the progress of a run live::
+
+    async for mode, chunk in graph.astream(inputs, config, stream_mode=["custom", "values"]):
+        if mode == "custom":
+            render(chunk)
+
+Kinds: ``log`` (message), ``node_start`` / ``node_end`` (node, elapsed), ``token`` (text), ``validation``
+(file, passed, errors, advice), ``simulation_output`` (line) and ``simulation_result`` (success, cached).
+
+Each run can write its events to its own log file with ``run_log``. The log file is kept in a context variable, so
+runs sharing a process (e.g. parallel experiments) do not mix their logs. Without a log file, ``log`` events are
+printed.
+"""
+
+import functools
+import inspect
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Optional, TextIO
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.tracers._streaming import _StreamingCallbackHandler
+from langgraph.config import get_stream_writer
+
+
+class RunLog:
+    """The log file of one run. Events are rendered as text, like the printed output, and also to the terminal if
+    ``echo`` is set."""
+
+    def __init__(self, path: str, echo: bool = False):
+        self.path = path
+        self.echo = echo
+        self.file = open(path, "w", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def write(self, payload: Dict[str, Any]):
+        with self.lock:
+            render(payload, self.file)
+            if self.echo:
+                render(payload)
+
+    def close(self):
+        self.file.close()
+
+
+_run_log: ContextVar[Optional[RunLog]] = ContextVar("mooseagent_run_log", default=None)
+
+
+@contextmanager
+def run_log(path: str, echo: bool = False):
+    """Write the events emitted in this context (and the tasks it starts) to ``path``."""
+    log_file = RunLog(path, echo)
+    token = _run_log.set(log_file)
+    try:
+        yield log_file
+    finally:
+        _run_log.reset(token)
+        log_file.close()
+
+
+def emit(event: str, **data):
+    """Send an event to the stream of the running graph and to the log file of the run."""
+    payload = {"event": event, "time": time.time(), **data}
+    log_file = _run_log.get()
+    if log_file is not None:
+        log_file.write(payload)
+    elif event == "log":
+        print(data["message"])
+    try:
+        writer = get_stream_writer()
+    except (RuntimeError, KeyError):  # not inside a graph node
+        return
+    writer(payload)
+
+
+def log(message: Any):
+    emit("log", message=str(message))
+
+
+def render(payload: Dict[str, Any], stream: TextIO = None):
+    """Write an event as text, e.g. to the terminal of a client."""
+    stream = stream or sys.stdout
+    event = payload["event"]
+    if event == "token":
+        stream.write(payload["text"])
+        return
+    if event == "log":
+        text = payload["message"]
+    elif event == "node_start":
+        text = f"---{payload['node'].upper()}---"
+    elif event == "node_end":
+        text = f"---{payload['node'].upper()} DONE ({payload['elapsed']:.1f}s)---"
+    elif event == "validation":
+        text = f"---CHECK {payload['file']} {'PASSED' if payload['passed'] else 'FAILED'}---"
+        if payload.get("errors"):
+            text += f"\n{payload['errors']}"
+        if payload.get("advice"):
+            text += f"\n{payload['advice']}"
+    elif event == "simulation_output":
+        text = payload["line"].rstrip("\n")
+    elif event == "simulation_result":
+        text = f"---SIMULATION {'SUCCEEDED' if payload['success'] else 'FAILED'}---"
+        if payload.get("cached"):
+            text += " (cached result)"
+    else:
+        text = str(payload)
+    stream.write(text + "\n")
+    stream.flush()
+
+
+def traced(name: str, node):
+    """Emit ``node_start`` and ``node_end`` events around a graph node (sync or async).
+
+    Args:
+        name (str): The name the node is added to the graph with, the events carry it.
+        node: The node function.
+    """
+
+    if inspect.iscoroutinefunction(node):
+
+        @functools.wraps(node)
+        async def async_wrapper(*args, **kwargs):
+            start_time = time.perf_counter()
+            emit("node_start", node=name)
+            try:
+                return await node(*args, **kwargs)
+            finally:
+                emit("node_end", node=name, elapsed=time.perf_counter() - start_time)
+
+        return async_wrapper
+
+    @functools.wraps(node)
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        emit("node_start", node=name)
+        try:
+            return node(*args, **kwargs)
+        finally:
+            emit("node_end", node=name, elapsed=time.perf_counter() - start_time)
+
+    return wrapper
+
+
+class TokenEventHandler(BaseCallbackHandler, _StreamingCallbackHandler):
+    """Emit the tokens of chat models as ``token`` events.
+
+    As a streaming handler it makes the chat models of the run stream their answers, like the ``messages`` stream
+    mode of LangGraph. The graph (``graph.py``) and the server pass it in the ``callbacks`` of the config of every run.
+    """
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if token:
+            emit("token", text=token)
+
+    def tap_output_aiter(self, run_id, output):
+        return output
+
+    def tap_output_iter(self, run_id, output):
+        return output
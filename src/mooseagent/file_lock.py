@@ -0,0 +1,47 @@
+"""Exclusive locks of open files, shared by all processes on the host.
+
+POSIX systems use ``fcntl.flock``, Windows locks the first byte of the file with ``msvcrt.locking``. Both locks are
+released by the operating system when the process dies.
+"""
+
+import os
+import time
+
+
+def lock_file(handle, blocking: bool = True, poll_interval: float = 0.05) -> bool:
+    """Lock an open file exclusively.
+
+    Returns:
+        bool: True if the lock is held, False if ``blocking`` is False and another process holds it.
+    """
+    if os.name == "nt":
+        import msvcrt
+
+        while True:
+            handle.seek(0)
+            try:
+                msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+                return True
+            except OSError:
+                if not blocking:
+                    return False
+            time.sleep(poll_interval)
+    import fcntl
+
+    try:
+        fcntl.flock(handle, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+        return False
+    return True
+
+
+def unlock_file(handle):
+    if os.name == "nt":
+        import msvcrt
+
+        handle.seek(0)
+        msvcrt.locking(handle.fileno(), msvcrt.LK_UNLCK, 1)
+        return
+    import fcntl
+
+    fcntl.flock(handle, fcntl.LOCK_UN)
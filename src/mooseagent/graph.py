@@ -4,11 +4,13 @@ Works with a chat model with tool calling support.
 """
 
 import asyncio
+import dataclasses
 import json
 import sys
 import os, re
 from dotenv import load_dotenv
 import subprocess
+import time
 from datetime import datetime
 
 load_dotenv()
@@ -16,9 +18,6 @@ run_path = os.getenv("RUN_PATH")
 sys.path.append(run_path)
 
 from langgraph.checkpoint.memory import MemorySaver
-from langchain_community.callbacks.manager import get_openai_callback
-
-from tqdm import tqdm
 from langchain_core.messages import AIMessage, SystemMessage, HumanMessage
 from langchain_core.runnables import RunnableConfig
 from langgraph.graph import START, END, StateGraph
@@ -29,10 +28,28 @@ from mooseagent.state import (
     ExtracterFileState,
     InpcardContentState,
     ModifyState,
+    ModifyPatchState,
+    BlockPatchState,
     RearchitechState,
     QueryState,
 )
-from mooseagent.utils import load_chat_model, check_app, combine_code_with_description, Logger
+from mooseagent.utils import load_chat_model, combine_code_with_description
+from mooseagent.events import TokenEventHandler, emit, log, run_log, traced
+from mooseagent.hit import HitError, replace_block
+from mooseagent.runner import (
+    RunCache,
+    Watchdog,
+    app_advice,
+    check_card,
+    moose_command,
+    quick_check_failed,
+    reduced_fidelity_args,
+    reduces_the_run,
+    run_progress,
+    run_with_watchdog,
+    sub_app_files,
+)
+from mooseagent.scheduler import get_scheduler
 from mooseagent.prompts import (
     SYSTEM_ALIGNMENT_PROMPT,
     HUMAN_ALIGNMENT_PROMPT,
@@ -41,16 +58,45 @@ from mooseagent.prompts import (
     SYSTEM_WRITER_PROMPT,
     MultiAPP_PROMPT,
     MODIFY_PROMPT,
+    MODIFY_PATCH_PROMPT,
     REARCHITECT_PROMPT,
     SYSTEM_QUERY_PROMPT,
     # HUMAN_ARCHITECT_PROMPT,
 )
-from mooseagent.helper import bulid_helper, retriever_input
+from mooseagent.helper import bulid_helper, load_vector_databases
+from mooseagent.docstore import get_docstore
+from mooseagent.chunking import get_parent_store
+from mooseagent.retrieval import abatch_search, get_reranker, get_query_cache, keyword_retrieve
+from mooseagent.moose_modules import infer_modules
+from mooseagent.vector_store import get_online_index
+from mooseagent.repair_memory import changed_blocks, error_message, error_signature, format_repairs, get_repair_memory
+from mooseagent.workspace import Workspace, get_workspace, new_run_id, release_workspace
 from langgraph.constants import Send
 from langgraph.types import interrupt, Command
 
 configuration = Configuration.from_runnable_config(RunnableConfig())
-helper = bulid_helper(configuration.assistant_model)
+
+
+def get_helper(configuration: Configuration):
+    """The helper agent with the model, budgets and vector stores of ``configuration``, the one of the request."""
+    return bulid_helper(
+        configuration.assistant_model,
+        configuration.helper_max_rounds,
+        configuration.helper_max_tokens,
+        configuration.helper_timeout,
+        configuration.helper_tool_concurrency,
+        configuration,
+    )
+
+
+def run_workspace(state: FlowState, configuration: Configuration) -> Workspace:
+    """The versioned input cards of the run of ``state``."""
+    return get_workspace(configuration.workspace_dir, state["run_id"], configuration.save_dir)
+
+
+def workspace_configuration(configuration: Configuration, workspace: Workspace) -> Configuration:
+    """The configuration with ``save_dir`` set to the run directory, where MOOSE finds the materialised cards."""
+    return dataclasses.replace(configuration, save_dir=workspace.directory)
 
 
 def align_simulation_description(state: FlowState, config: RunnableConfig):
@@ -73,7 +119,7 @@ def align_simulation_description(state: FlowState, config: RunnableConfig):
             HumanMessage(content=human_message_alignment),
         ]
     )
-    print(alignment_reply.content)
+    log(alignment_reply.content)
     extracter_file = load_chat_model(configuration.extracter_model).with_structured_output(ExtracterFileState)
     extracter_reply = extracter_file.invoke(
         [
@@ -104,37 +150,185 @@ def human(state: FlowState, config: RunnableConfig):
 
 
 async def architect_all(state: FlowState, config: RunnableConfig):
+    """Architect every file and check each one as soon as its own input card is written.
+    A file which uses MultiApps waits until the input cards of its sub-apps are written before its check.
+    """
     rearchitect_count = state.get("rearchitect_count", 0) + 1
-    print(f"-----ARCHITECT_{rearchitect_count}-----")
+    log(f"-----ARCHITECT_{rearchitect_count}-----")
     history_error = state.get("history_error", "")
     multiapps = True if len(state["file_list"]) > 1 else False
-    tasks = [architect_input_card(file, config, multiapps, history_error) for file in state["file_list"]]
-    await asyncio.gather(*tasks)
-    return {"rearchitect_count": rearchitect_count}
+    loop = asyncio.get_running_loop()
+    written = {file.file_name: loop.create_future() for file in state["file_list"]}
+    start_time = time.perf_counter()
+    configuration = Configuration.from_runnable_config(config)
+    run_id = state.get("run_id") or new_run_id()
+    workspace = get_workspace(configuration.workspace_dir, run_id, configuration.save_dir)
+    # a new architecture starts without the cards of the previous one
+    workspace.reset()
+    if configuration.batch_retrieval:
+        descriptions = [file.description for file in state["file_list"]]
+        cases = await retrieve_similar_cases_batch(descriptions, configuration)
+    else:
+        cases = [None] * len(state["file_list"])
+    tasks = [
+        architect_and_check(
+            file, config, workspace, multiapps, history_error, state["dp_json"], written, start_time, similar
+        )
+        for file, similar in zip(state["file_list"], cases)
+    ]
+    feedback = await asyncio.gather(*tasks)
+    version = workspace.commit("architect", 0, rearchitect_count)
+    log(f"---INPUT CARDS OF RUN {run_id} SAVED AS VERSION {version}---")
+    return {"rearchitect_count": rearchitect_count, "precheck": "".join(feedback), "run_id": run_id}
+
+
+async def architect_and_check(
+    state: FileState,
+    config: RunnableConfig,
+    workspace: Workspace,
+    multiapps: bool,
+    history_error: str,
+    dp_json: dict,
+    written: dict,
+    start_time: float,
+    similar_cases: list = None,
+) -> str:
+    """Architect one input card, then check its applications and run MOOSE --check-input on it.
+    Only the errors of --check-input fail the card, the object types missing from the documentation are advice.
+    Returns:
+        str: The errors found in this input card, empty if it passes the check.
+    """
+    configuration = Configuration.from_runnable_config(config)
+    try:
+        await architect_input_card(state, config, workspace, multiapps, history_error, similar_cases)
+    finally:
+        if not written[state.file_name].done():
+            written[state.file_name].set_result(True)
+    inpcard_code = workspace.read(state.file_name)
+    sub_apps = [name for name in sub_app_files(inpcard_code) if name in written and name != state.file_name]
+    files = {state.file_name: inpcard_code}
+    if sub_apps:
+        await asyncio.gather(*(written[name] for name in sub_apps))
+        for name in sub_apps:
+            files[name] = workspace.read(name)
+    workspace.materialise()
+    feedback, advice = await check_card(
+        workspace_configuration(configuration, workspace), state.file_name, files, dp_json
+    )
+    emit(
+        "validation",
+        file=state.file_name,
+        passed=not feedback,
+        errors=feedback,
+        advice=advice,
+        elapsed=time.perf_counter() - start_time,  # since the architect started
+    )
+    if feedback:
+        return f"The error of {state.file_name}:\n{feedback}\n"
+    return ""
+
+
+async def generate_query(description: str, configuration: Configuration) -> str:
+    """Generate the retrieval query of a file description, memoised by the description, the model and the prompt."""
+    query_cache = get_query_cache(configuration.query_cache_path)
+    query = query_cache.get(description, configuration.query_model, SYSTEM_QUERY_PROMPT)
+    if query is None:
+        queryllm = load_chat_model(configuration.query_model)  # .with_structured_output(QueryState)
+        query_reply = await queryllm.ainvoke(
+            [
+                SystemMessage(content=SYSTEM_QUERY_PROMPT.format(requirements=description)),
+            ]
+        )
+        query = query_reply.content
+        query_cache.set(description, query, configuration.query_model, SYSTEM_QUERY_PROMPT)
+    return query
+
+
+async def plan_retrieval(description: str, k: int, configuration: Configuration):
+    """Choose the modules and the query of a file description.
+    If the keywords of the description already hit a case confidently, the query generation by LLM is skipped.
+    Returns:
+        tuple: ``(query, modules, similar_cases)``, the cases are None if they still have to be searched.
+    """
+    # only search the cases of the MOOSE modules the description points to, if there are enough of them
+    modules = infer_modules(description) if configuration.filter_by_module else []
+    if modules:
+        log(f"---RETRIEVE IN MODULES: {modules}---")
+    if configuration.query_skip_threshold > 0:
+        query, similar_cases = await keyword_retrieve(
+            load_vector_databases(configuration)[0], description, k, configuration.query_skip_threshold, modules
+        )
+        if query is not None:
+            log(f"---RETRIEVE WITH KEYWORDS: {query}---")
+            return query, modules, similar_cases
+    return await generate_query(description, configuration), modules, None
+
+
+async def retrieve_similar_cases_batch(descriptions: list[str], configuration: Configuration) -> list:
+    """Retrieve the similar cases of the descriptions of all files of one architect round.
+    The queries are searched together with one batched embedding and one multi-query search of the vector store.
+    Returns:
+        list: The similar cases of every description, in order.
+    """
+    k = configuration.rerank_fetch_k if configuration.rerank else configuration.top_k
+    # block chunks: fetch more chunks, they are grouped into at most k cards below
+    fetch_k = max(configuration.chunk_fetch_k, k) if configuration.chunk_mode == "block" else k
+    plans = await asyncio.gather(*(plan_retrieval(description, fetch_k, configuration) for description in descriptions))
+    pending = [i for i, (_, _, cases) in enumerate(plans) if cases is None]
+    results = [cases for _, _, cases in plans]
+    if pending:
+        searched = await abatch_search(
+            load_vector_databases(configuration)[0],
+            [plans[i][0] for i in pending],
+            fetch_k,
+            [plans[i][1] for i in pending],
+        )
+        for i, cases in zip(pending, searched):
+            results[i] = cases
+        unique = len({id(doc) for cases in searched for doc in cases})
+        log(f"---BATCH RETRIEVE: {len(pending)} queries, {sum(map(len, searched))} hits, {unique} unique---")
+    if configuration.chunk_mode == "block":
+        parents = get_parent_store(configuration.input_database_path)
+        results = [parents.parents(cases, k) for cases in results]
+        blocks = [[doc.metadata.get("blocks") for doc in cases] for cases in results]
+        log(f"---RETRIEVE CARDS WITH BLOCKS: {blocks}---")
+    if configuration.rerank:
+        reranker = get_reranker(
+            configuration.rerank_model, configuration.rerank_cache_path, configuration.rerank_cache_max_entries
+        )
+        results = await asyncio.gather(
+            *(reranker.arerank(query, cases, configuration.top_k) for (query, _, _), cases in zip(plans, results))
+        )
+    return list(results)
+
+
+async def retrieve_similar_cases(description: str, configuration: Configuration):
+    """Retrieve the similar cases of a file description."""
+    return (await retrieve_similar_cases_batch([description], configuration))[0]
 
 
 async def architect_input_card(
-    state: FileState, config: RunnableConfig, multiapps: bool = False, history_error: str = ""
+    state: FileState,
+    config: RunnableConfig,
+    workspace: Workspace,
+    multiapps: bool = False,
+    history_error: str = "",
+    similar_cases=None,
 ):
     """Generate the architect of the input card
     Args:
         state (OneFileState): The current state of the conversation.
         config (RunnableConfig): Configuration for the model run.
+        workspace (Workspace): The input card is written to the workspace of the run.
+        similar_cases (list): The cases retrieved for all files together, retrieved here if None.
     Returns:
         dict: A dictionary containing the model's response
     """
     # inpcard = state["inpcard"]
     configuration = Configuration.from_runnable_config(config)
-    print(f"---ARCHITECT INPUT CARD---")  #
-    # generate query
-    queryllm = load_chat_model(configuration.query_model)  # .with_structured_output(QueryState)
-    query_reply = await queryllm.ainvoke(
-        [
-            SystemMessage(content=SYSTEM_QUERY_PROMPT.format(requirements=state.description)),
-        ]
-    )
-
-    similar_cases = await retriever_input.ainvoke(query_reply.content)
+    log(f"---ARCHITECT INPUT CARD---")  #
+    if similar_cases is None:
+        similar_cases = await retrieve_similar_cases(state.description, configuration)
     similar_cases = f"Here is some relevant cases for this question:\n{similar_cases}"
     if multiapps:
         similar_cases += MultiAPP_PROMPT
@@ -150,35 +344,36 @@ async def architect_input_card(
             # HumanMessage(content=human_message_architect),
         ]
     )
-    inpcard_code = architect_reply.inpcard
-    if os.path.exists(configuration.save_dir) is False:
-        os.makedirs(configuration.save_dir)
-    with open(os.path.join(configuration.save_dir, state.file_name), "w", encoding="utf-8") as f:
-        f.write(inpcard_code)
-    print(f"---ARCHITECT INPUT CARD DONE---")
+    workspace.write(state.file_name, architect_reply.inpcard)
+    log(f"---ARCHITECT INPUT CARD DONE---")
     return state
 
 
-def modify(state: FlowState, config: RunnableConfig):
-    review_count = state.get("review_count", 0) + 1
-    print(f"---REWRITE INPCARD---{review_count}")
-    configuration = Configuration.from_runnable_config(config)
-    all_input_cards = ""
-    for inpcard in state["file_list"]:
-        with open(os.path.join(configuration.save_dir, inpcard.file_name), "r", encoding="utf-8") as f:
-            inpcard_code = f.read()
-        all_input_cards += f"-------------------\nThe file name is: {inpcard.file_name}\nThe description of this file is:\n{inpcard.description}\nThe code of this file is: \n{inpcard_code}-------------------\n\n"
-    state["run_result"][-1] = state["run_result"][-1] + "\n" + check_app(all_input_cards, state["dp_json"])
+def rewrite_inpcard(
+    all_input_cards: str,
+    error: str,
+    configuration: Configuration,
+    workspace: Workspace,
+    documentation: str = "",
+    helper_stats: list = None,
+    modules: list = None,
+    repairs: str = "",
+):
+    """Let the helper rewrite the whole input card which has error.
+    Returns:
+        ModifyState: The file name, the reason of the error and the modified code.
+    """
     messages = [
         {
             "role": "user",
             "content": MODIFY_PROMPT.format(
-                inpcard_code=all_input_cards,
-                error=state["run_result"][-1],
+                inpcard_code=all_input_cards, error=error, documentation=documentation, repairs=repairs
             ),
         }
     ]
-    helper_answer = helper.invoke({"messages": messages})
+    helper_answer = get_helper(configuration).invoke({"messages": messages}, modules)
+    if helper_stats is not None:
+        helper_stats.append(helper_answer["stats"])
     feedback = helper_answer["messages"][-1].content
     extracter_review = load_chat_model(configuration.extracter_model).with_structured_output(ModifyState)
     extracter_reply = extracter_review.invoke(
@@ -189,69 +384,340 @@ def modify(state: FlowState, config: RunnableConfig):
             HumanMessage(content=feedback),
         ]
     )
-    print(f"The error in file: {extracter_reply.filename}. The reason is that: {extracter_reply.error}")
+    workspace.write(extracter_reply.filename, extracter_reply.code)
+    return extracter_reply
+
+
+def patch_inpcard(
+    all_input_cards: str,
+    error: str,
+    configuration: Configuration,
+    workspace: Workspace,
+    documentation: str = "",
+    helper_stats: list = None,
+    modules: list = None,
+    repairs: str = "",
+):
+    """Let the helper return only the modified blocks and apply them to the stored input card.
+    Returns:
+        ModifyPatchState: The file name, the reason of the error and the modified blocks.
+    Raises:
+        HitError: If the patches can not be applied to the input card.
+    """
+    messages = [
+        {
+            "role": "user",
+            "content": MODIFY_PATCH_PROMPT.format(
+                inpcard_code=all_input_cards, error=error, documentation=documentation, repairs=repairs
+            ),
+        }
+    ]
+    helper_answer = get_helper(configuration).invoke({"messages": messages}, modules)
+    if helper_stats is not None:
+        helper_stats.append(helper_answer["stats"])
+    feedback = helper_answer["messages"][-1].content
+    extracter_review = load_chat_model(configuration.extracter_model).with_structured_output(ModifyPatchState)
+    extracter_reply = extracter_review.invoke(
+        [
+            SystemMessage(
+                content="You are a helpful assistant that can extract file name, error information and the modified blocks.  You should never change the origin information."
+            ),
+            HumanMessage(content=feedback),
+        ]
+    )
+    if not extracter_reply.patches:
+        raise HitError("No block is modified.")
+    if extracter_reply.filename not in workspace.files:
+        raise HitError(f"{extracter_reply.filename} does not exist.")
+    inpcard_code = workspace.read(extracter_reply.filename)
+    for patch in extracter_reply.patches:
+        inpcard_code = replace_block(inpcard_code, patch.block, patch.content)
+    workspace.write(extracter_reply.filename, inpcard_code)
+    return extracter_reply
+
+
+def modify(state: FlowState, config: RunnableConfig):
+    review_count = state.get("review_count", 0) + 1
+    log(f"---REWRITE INPCARD---{review_count}")
+    configuration = Configuration.from_runnable_config(config)
+    workspace = run_workspace(state, configuration)
+    start_time = time.perf_counter()
+    all_input_cards = ""
+    documentation = ""
+    cards = {}
+    for inpcard in state["file_list"]:
+        inpcard_code = workspace.read(inpcard.file_name)
+        cards[inpcard.file_name] = inpcard_code
+        all_input_cards += f"-------------------\nThe file name is: {inpcard.file_name}\nThe description of this file is:\n{inpcard.description}\nThe code of this file is: \n{inpcard_code}-------------------\n\n"
+        if configuration.prefetch_docs:
+            documentation += get_docstore(configuration.dp_json_path).lookup_card(inpcard_code)
+    if documentation:
+        documentation = f"Here is the documentation of the MOOSE objects used in the input files:\n{documentation}"
+    run_error = state["run_result"][-1]
+    # the advice goes into this prompt only, the run results keep the errors of MOOSE
+    app_feedback = app_advice(cards, state["dp_json"])
+    error_with_advice = f"{run_error}\n{app_feedback}" if app_feedback else run_error
+    mode = configuration.modify_mode
+    extracter_reply = None
+    helper_stats = []
+    modules = infer_modules(state["requirement"]) if configuration.filter_by_module else []
+    # the pending repairs whose error came back did not fix it
+    signature = error_signature(run_error)
+    pending_repairs = [repair for repair in state.get("repairs", []) if repair["signature"] != signature]
+    repair_hits = []
+    if configuration.repair_memory:
+        memory = get_repair_memory(configuration.repair_memory_path)
+        repair_hits = memory.lookup(
+            run_error, cards, configuration.repair_memory_top_k, configuration.repair_memory_threshold
+        )
+        if configuration.repair_memory_apply and repair_hits and repair_hits[0]["exact"]:
+            repaired = memory.apply(repair_hits[0], cards)
+            if repaired is not None:
+                mode = "memory"
+                workspace.write(*repaired)
+                extracter_reply = ModifyPatchState(
+                    filename=repaired[0],
+                    error=f"Applied the remembered repair of this error. {repair_hits[0]['explanation']}",
+                    patches=[
+                        BlockPatchState(block=block["block"], content=block["after"])
+                        for block in repair_hits[0]["blocks"]
+                    ],
+                )
+        emit("repair_memory", hits=len(repair_hits), applied=mode == "memory")
+    from langchain_community.callbacks.manager import get_openai_callback
+
+    with get_openai_callback() as cb:
+        if mode == "patch":
+            try:
+                extracter_reply = patch_inpcard(
+                    all_input_cards,
+                    error_with_advice,
+                    configuration,
+                    workspace,
+                    documentation,
+                    helper_stats,
+                    modules,
+                    format_repairs(repair_hits),
+                )
+            except HitError as e:
+                log(f"Can not apply the modified blocks, fall back to rewrite the whole input card. {e}")
+        if extracter_reply is None:
+            mode = "full"
+            extracter_reply = rewrite_inpcard(
+                all_input_cards,
+                error_with_advice,
+                configuration,
+                workspace,
+                documentation,
+                helper_stats,
+                modules,
+                format_repairs(repair_hits),
+            )
+    log(f"The error in file: {extracter_reply.filename}. The reason is that: {extracter_reply.error}")
     reason = state.get("reason", [])
     reason.append(extracter_reply.error)
-    inpcard_code = extracter_reply.code
-    with open(os.path.join(configuration.save_dir, extracter_reply.filename), "w", encoding="utf-8") as f:
-        f.write(extracter_reply.code)
-    print(f"---REWRITE INPCARD DONE---")
-    return {"review_count": review_count, "run_result": state["run_result"], "reason": reason}
+    version = workspace.commit("modify", review_count, state["rearchitect_count"])
+    log(f"---INPUT CARDS SAVED AS VERSION {version}---")
+    if extracter_reply.filename in cards:
+        blocks = changed_blocks(cards[extracter_reply.filename], workspace.read(extracter_reply.filename))
+        if blocks:
+            pending_repairs.append(
+                {
+                    "signature": signature,
+                    "error": error_message(run_error),
+                    "file": extracter_reply.filename,
+                    "blocks": blocks,
+                    "explanation": repair_hits[0]["explanation"] if mode == "memory" else extracter_reply.error,
+                }
+            )
+    modify_stats = state.get("modify_stats", [])
+    modify_stats.append(
+        {
+            "iteration": review_count,
+            "mode": mode,
+            "prompt_tokens": cb.prompt_tokens,
+            "completion_tokens": cb.completion_tokens,
+            "latency": round(time.perf_counter() - start_time, 2),
+            "helper_rounds": sum(s["rounds"] for s in helper_stats),
+            "helper_tool_calls": sum(s["tool_calls"] for s in helper_stats),
+            "helper_cached_tool_calls": sum(s["cached_tool_calls"] for s in helper_stats),
+            "repair_hits": len(repair_hits),
+        }
+    )
+    log(f"Modify stats: {modify_stats[-1]}")
+    log(f"---REWRITE INPCARD DONE---")
+    return {
+        "review_count": review_count,
+        "run_result": state["run_result"],
+        "reason": reason,
+        "modify_stats": modify_stats,
+        "precheck": "",
+        "repairs": pending_repairs,
+    }
+
+
+def handle_run_error(state: FlowState, configuration: Configuration, error: str, workspace: Workspace = None):
+    """Decide whether to modify the input cards or re-architect them after a failed run.
+    If the last modify made the run fail earlier, the input cards are rolled back to the version which got furthest.
+    """
+    review_count = state.get("review_count", 0)
+    run_result = state.get("run_result", [])
+    if workspace is not None and configuration.rollback:
+        best = workspace.rollback(state["rearchitect_count"])
+        if best is not None:
+            log(f"---ROLL BACK TO VERSION {best['version']}, IT GOT FURTHEST {best['progress']}---")
+            emit("rollback", version=best["version"], progress=best["progress"])
+            error = (
+                f"{best['error']}\nThe last modification made the simulation fail earlier, with the error:\n{error}\n"
+                "It was undone, the input cards are back to the version with the first error above."
+            )
+    run_result.append(error)
+    if review_count < configuration.MAX_ITER:
+        return Command(goto="modify", update={"run_result": run_result})
+    if state["rearchitect_count"] < configuration.MAX_REARCHITECT:
+        rearchitect = load_chat_model(configuration.rearchitect_model).with_structured_output(RearchitechState)
+        feedback = rearchitect.invoke([SystemMessage(content=REARCHITECT_PROMPT.format(Error=run_result[-5:]))])
+        if "True" in feedback.rearchitect:
+            log("retry")
+            return Command(
+                goto="architect",
+                update={
+                    "review_count": 0,
+                    "run_result": [],
+                    "history_error": feedback.error,
+                    "reason": [],
+                    "repairs": [],
+                },
+            )
+        else:
+            log("try to modify again!")
+            return Command(goto="modify", update={"run_result": run_result, "review_count": review_count - 1})
+    else:
+        log("Up to max iteration.")
+        return Command(goto="End")
+
+
+def learn_cases(state: FlowState, configuration: Configuration, files: dict):
+    """Add the input cards of a successful run to the case store. A failure here never fails the run."""
+    try:
+        online_index = get_online_index(configuration)
+        descriptions = {inpcard.file_name: inpcard.description for inpcard in state["file_list"]}
+        added = online_index.learn(state["requirement"], files, descriptions)
+        log(f"---ADD {added} DOCUMENTS OF THE SUCCESSFUL RUN TO THE CASE STORE---")
+    except Exception as e:
+        log(f"Can not add the input cards to the case store: {e}")
+
+
+def remember_repairs(state: FlowState, configuration: Configuration):
+    """Save the repairs of a successful run to the repair memory. A failure here never fails the run."""
+    try:
+        memory = get_repair_memory(configuration.repair_memory_path)
+        for repair in state.get("repairs", []):
+            memory.add(repair)
+        if state.get("repairs"):
+            log(f"---REMEMBER {len(state['repairs'])} REPAIRS OF THE SUCCESSFUL RUN---")
+    except Exception as e:
+        log(f"Can not save the repairs to the repair memory: {e}")
+
+
+def simulate(
+    configuration: Configuration,
+    workspace: Workspace,
+    files: dict,
+    exec_name: str,
+    mpi: int,
+    extra_args: list = (),
+):
+    """Run MOOSE on the materialised input cards, or reuse the result of an identical run.
+    Returns:
+        tuple: The result of the run and whether it was cached.
+    """
+    scheduler = get_scheduler(
+        configuration.scheduler_dir, configuration.max_cores, configuration.scheduler_metrics_path
+    )
+    # the run gets no more ranks than the scheduler hands out
+    mpi = scheduler.clamp(mpi)
+    command = moose_command(workspace_configuration(configuration, workspace), exec_name, mpi, extra_args)
+    result, cache, cache_key = None, None, None
+    if configuration.run_cache:
+        cache = RunCache(configuration.run_cache_dir, configuration.run_cache_max_entries)
+        cache_key = RunCache.key(files, configuration.MOOSE_DIR, mpi, extra_args)
+        result = cache.get(cache_key)
+        if result is not None:
+            log("---SAME INPUT CARDS HAVE BEEN RUN BEFORE, USE THE CACHED RESULT---")
+    cached = result is not None
+    if result is None:
+        with scheduler.acquire(mpi, label=exec_name):
+            if configuration.watchdog:
+                watchdog = Watchdog(
+                    success_steps=configuration.watchdog_success_steps,
+                    divergence_factor=configuration.watchdog_divergence_factor,
+                    max_failed_solves=configuration.watchdog_max_failed_solves,
+                    timeout=configuration.watchdog_timeout,
+                )
+                result = run_with_watchdog(command, watchdog, on_line=lambda line: emit("simulation_output", line=line))
+            else:
+                result = subprocess.run(command, capture_output=True, text=True)
+        if cache is not None:
+            # the overrides of the quick check turn the output files off
+            cache.put(cache_key, result, writes_outputs=not extra_args)
+    return result, cached
 
 
 def run_inpcard(state: FlowState, config: RunnableConfig):
     configuration = Configuration.from_runnable_config(config)
     """Save the generated inpcard to a file."""
     inpcards = state["file_list"]
-    review_count = state.get("review_count", 0)
+    workspace = run_workspace(state, configuration)
     # ? modify in future
     exec_name = inpcards[0].file_name
+    if state.get("precheck"):
+        # the check after architect already found errors, no need to run the simulation
+        log(f"ERROR:\n{state['precheck']}")
+        workspace.set_progress(workspace.version, (0, 0), state["precheck"])
+        return handle_run_error(state, configuration, state["precheck"], workspace)
     """Run the moose simulation."""
     if os.path.exists(os.path.join(configuration.MOOSE_DIR)):
-        print(f"Running moose with {exec_name}")
-        command = [
-            "mpiexec",
-            "-n",
-            str(configuration.mpi),
-            configuration.MOOSE_DIR,
-            "-i",
-            os.path.join(configuration.save_dir, exec_name),
-        ]
-        result = subprocess.run(command, capture_output=True, text=True)
+        log(f"Running moose with {exec_name}")
+        files = {inpcard.file_name: workspace.read(inpcard.file_name) for inpcard in inpcards}
+        workspace.materialise()
+        scheduler = get_scheduler(
+            configuration.scheduler_dir, configuration.max_cores, configuration.scheduler_metrics_path
+        )
+        mpi = configuration.mpi
+        if configuration.mpi_auto:
+            mpi = scheduler.ranks_for(files[exec_name], configuration.mpi, configuration.elements_per_rank)
+        if configuration.reduced_fidelity:
+            # a few time steps of a coarser mesh on one rank find the setup and first step errors in seconds
+            reduced_args = reduced_fidelity_args(
+                files[exec_name], configuration.reduced_num_steps, configuration.reduced_coarsen
+            )
+            if reduces_the_run(reduced_args):
+                log(f"---QUICK CHECK WITH {' '.join(reduced_args)}---")
+                result, cached = simulate(configuration, workspace, files, exec_name, 1, reduced_args)
+                emit("simulation_result", success=result.stderr == "", cached=cached, reduced=True)
+                if quick_check_failed(result, reduced_args):
+                    workspace.set_progress(workspace.version, run_progress(result), result.stderr)
+                    log(f"ERROR:\n{result.stderr}")
+                    return handle_run_error(state, configuration, result.stderr, workspace)
+                if result.stderr:
+                    log("The quick check failed while solving or because of its overrides, run the cards in full.")
+        result, cached = simulate(configuration, workspace, files, exec_name, mpi)
         # 打印输出
+        emit("simulation_result", success=result.stderr == "", cached=cached)
+        workspace.set_progress(workspace.version, run_progress(result), result.stderr)
         if result.stderr == "":
-            print(f"SUCCESS:\n{result.stdout}")
-            return Command(goto="End", update=state)
+            log(f"SUCCESS:\n{result.stdout}")
+            if configuration.online_learning:
+                learn_cases(state, configuration, files)
+            if configuration.repair_memory:
+                remember_repairs(state, configuration)
+            return Command(goto="End", update={"success": True})
         else:
-            print(f"ERROR:\n{result.stderr}")
-            run_result = state.get("run_result", [])
-            run_result.append(result.stderr)
-            if review_count < configuration.MAX_ITER:
-                return Command(goto="modify", update={"run_result": run_result})
-            if state["rearchitect_count"] < configuration.MAX_REARCHITECT:
-                rearchitect = load_chat_model(configuration.rearchitect_model).with_structured_output(RearchitechState)
-                feedback = rearchitect.invoke(
-                    [SystemMessage(content=REARCHITECT_PROMPT.format(Error=state["run_result"][-5:]))]
-                )
-                if "True" in feedback.rearchitect:
-                    print("retry")
-                    return Command(
-                        goto="architect",
-                        update={
-                            "review_count": 0,
-                            "run_result": [],
-                            "history_error": feedback.error,
-                            "reason": [],
-                        },
-                    )
-                else:
-                    print("try to modify again!")
-                    return Command(goto="modify", update={"run_result": run_result, "review_count": review_count - 1})
-            else:
-                print("Up to max iteration.")
-                return Command(goto="End")
+            log(f"ERROR:\n{result.stderr}")
+            return handle_run_error(state, configuration, result.stderr, workspace)
     else:
-        print(f"Moose directory {configuration.MOOSE_DIR} does not exist.")
+        log(f"Moose directory {configuration.MOOSE_DIR} does not exist.")
         return Command(goto="End")
 
 
@@ -259,11 +725,13 @@ def run_inpcard(state: FlowState, config: RunnableConfig):
 architect_builder = StateGraph(FlowState)  # v, input=ArchitectInputState, output=ArchitectOutputState)
 
 # Add the nodes
-architect_builder.add_node("align_simulation_description", align_simulation_description)
-architect_builder.add_node("human", human)
-architect_builder.add_node("architect", architect_all)
-architect_builder.add_node("modify", modify)
-architect_builder.add_node("run_inpcard", run_inpcard)
+architect_builder.add_node(
+    "align_simulation_description", traced("align_simulation_description", align_simulation_description)
+)
+architect_builder.add_node("human", traced("human", human))
+architect_builder.add_node("architect", traced("architect", architect_all))
+architect_builder.add_node("modify", traced("modify", modify))
+architect_builder.add_node("run_inpcard", traced("run_inpcard", run_inpcard))
 # Add edges to connect nodes
 architect_builder.add_edge(START, "align_simulation_description")
 architect_builder.add_edge("align_simulation_description", "human")
@@ -273,36 +741,29 @@ architect_builder.add_edge("modify", "run_inpcard")
 memory = MemorySaver()
 graph = architect_builder.compile(checkpointer=memory)
 if __name__ == "__main__":
-    config = {"configurable": {"thread_id": "1"}, "recursion_limit": 10000}
+    config = {"configurable": {"thread_id": "1"}, "callbacks": [TokenEventHandler()], "recursion_limit": 10000}
     dp_json_path = "database/dp.json"
     with open(os.path.join(run_path, dp_json_path), "r", encoding="utf-8") as file:
         dp_json = json.load(file)
 
-    def stream_graph_updates(user_input: str, dp_json: dict):
-        for event in graph.stream({"requirement": user_input, "dp_json": dp_json}, config=config):
-            for value in event.values():
-                print(value)
-
     topic = """
  Construct a Moose phase field simulation case to simulate the solidification process of pure metal in a two-dimensional rectangular region. This task will use a phase field model to simulate the transition of solid-liquid phase by solving the coupled evolution equation of phase field variables and temperature field. The boundary condition is to apply a low temperature below the solidification point on one side of the rectangular region to drive solidification, with the initial condition being that the metal is in a liquid state. The goal is to observe the formation and growth of solid phases, as well as the evolution and temperature distribution of solid-liquid interfaces.
 
-
-You can make the settings a bit rougher to speed up the simulation
     """
 
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     output_file = os.path.join(run_path, f"log/{timestamp}.log")
-    sys.stdout = Logger(output_file)
-    subprocess.run(["rm", "-r", configuration.save_dir])
-    with get_openai_callback() as cb:
+    from langchain_community.callbacks.manager import get_openai_callback
+
+    with get_openai_callback() as cb, run_log(output_file, echo=True):
         # 运行异步主程序
         result = asyncio.run(graph.ainvoke({"requirement": topic, "dp_json": dp_json}, config=config))
-        code_length = 0
-        for file in result["file_list"]:
-            with open(os.path.join(configuration.save_dir, file.file_name), "r") as f:
-                code_length += len(f.read())
-        print(code_length)
-        print("===== Token Usage =====")
-        print("Prompt Tokens:", cb.prompt_tokens)
-        print("Completion Tokens:", cb.completion_tokens)
-        print("Total Tokens:", cb.total_tokens)
+        workspace = run_workspace(result, configuration)
+        code_length = sum(len(workspace.read(file.file_name)) for file in result["file_list"])
+        log(f"The input cards are in {workspace.materialise()}")
+        log(code_length)
+        log("===== Token Usage =====")
+        log(f"Prompt Tokens: {cb.prompt_tokens}")
+        log(f"Completion Tokens: {cb.completion_tokens}")
+        log(f"Total Tokens: {cb.total_tokens}")
+    release_workspace(configuration.workspace_dir, result["run_id"], configuration.save_dir)
@@ -1,33 +1,84 @@
 from dotenv import load_dotenv
 import sys, os
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import ContextVar, copy_context
 
 load_dotenv()
 run_path = os.getenv("RUN_PATH")
 sys.path.append(run_path)
 from langchain_core.runnables import RunnableConfig
-from langchain.tools.retriever import create_retriever_tool
-from langchain.tools.retriever import create_retriever_tool
-from langchain_community.vectorstores import FAISS, Chroma
 from mooseagent.configuration import Configuration
-from langchain_openai import OpenAIEmbeddings
-from mooseagent.utils import BGE_M3_EmbeddingFunction
+from mooseagent.utils import load_embedding_function
 from mooseagent.utils import load_chat_model
+from mooseagent.docstore import get_docstore
+from mooseagent.events import log
+from mooseagent.retrieval import search
+from langchain_core.tools import tool
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage, convert_to_messages
 from typing import Annotated
 from typing_extensions import TypedDict
 
-from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
-from langgraph.prebuilt import ToolNode, tools_condition
 
 config = RunnableConfig()
 configuration = Configuration.from_runnable_config(config)
-vector_type = configuration.vector_store
-embedding_function = OpenAIEmbeddings() if configuration.embedding_function == "OPENAI" else BGE_M3_EmbeddingFunction()
 batch_size = configuration.batch_size
-top_k = configuration.top_k
 json_file = configuration.rag_json_path
-try:
+
+
+@tool
+def lookup_moose_objects(objects: list[str]) -> str:
+    """Return the documentation of MOOSE objects by their exact names (the X of `type = X`), several objects in one call. Prefer this to retrieve_moose_dp when the names of the objects are known."""
+    return get_docstore(current_configuration().dp_json_path).lookup(objects)
+
+
+# the configuration of the request the running helper answers, the import-time configuration outside of a request
+_configuration: ContextVar[Configuration] = ContextVar("helper_configuration", default=None)
+
+
+def current_configuration() -> Configuration:
+    return _configuration.get() or configuration
+
+
+def store_key(configuration: Configuration) -> tuple:
+    """The settings the vector databases are loaded with."""
+    return (
+        configuration.vector_store.lower(),
+        configuration.embedding_function,
+        configuration.onnx_model_dir,
+        configuration.input_database_path,
+        configuration.dp_database_path,
+    )
+
+
+_vector_databases: dict = {}
+_vector_databases_lock = threading.Lock()
+
+
+def load_vector_databases(configuration: Configuration = None):
+    """Load the vector databases of the input cards and of the documentation on first use, once per ``store_key``.
+    Args:
+        configuration (Configuration): Defaults to the configuration of the request the helper answers.
+    Returns:
+        tuple: ``(vectordb_input, vectordb_dp)``.
+    """
+    configuration = configuration or current_configuration()
+    key = store_key(configuration)
+    with _vector_databases_lock:
+        if key not in _vector_databases:
+            _vector_databases[key] = _load_vector_databases(configuration)
+        return _vector_databases[key]
+
+
+def _load_vector_databases(configuration: Configuration):
+    vector_type = configuration.vector_store
+    embedding_function = load_embedding_function(configuration)
     if vector_type.lower() == "faiss":
+        from langchain_community.vectorstores import FAISS
+
         vectordb_input = FAISS.load_local(
             configuration.input_database_path, embedding_function, allow_dangerous_deserialization=True
         )
@@ -35,30 +86,59 @@ try:
             configuration.dp_database_path, embedding_function, allow_dangerous_deserialization=True
         )
     elif vector_type.lower() == "chroma":
+        from langchain_community.vectorstores import Chroma
+
         vectordb_input = Chroma(
             persist_directory=configuration.input_database_path, embedding_function=embedding_function
         )
         vectordb_dp = Chroma(persist_directory=configuration.dp_database_path, embedding_function=embedding_function)
     else:
         raise ValueError(f"Unsupported vector store type: {vector_type}")
+    return vectordb_input, vectordb_dp
+
+
+# the MOOSE modules the retriever tools of the running helper call are filtered to
+_modules: ContextVar[tuple] = ContextVar("helper_modules", default=())
+
+
+def _retrieve(vectordb, query: str) -> str:
+    docs = search(vectordb, query, current_configuration().top_k, list(_modules.get()))
+    return "\n\n".join(doc.page_content for doc in docs)
 
-    retriever_input = vectordb_input.as_retriever(search_type="similarity", search_kwargs={"k": top_k})
-    retriever_dp = vectordb_dp.as_retriever(search_type="similarity", search_kwargs={"k": top_k})
-    # define tools
-    tools = [
-        create_retriever_tool(
-            retriever_input,
-            "retrieve_moose_case",
-            "Search and return information about MOOSE simulation cases that are relevant to the simulation case you are working on.",
-        ),
-        create_retriever_tool(
-            retriever_dp,
-            "retrieve_moose_dp",
-            "Search and return information about the document of MOOSE app that are relevant to the simulation case you are working on.",
-        ),
-    ]
-except Exception as e:
-    print(f"Error loading vector database: {e}")
+
+@tool
+def retrieve_moose_case(query: str) -> str:
+    """Search and return information about MOOSE simulation cases that are relevant to the simulation case you are working on."""
+    return _retrieve(load_vector_databases()[0], query)
+
+
+@tool
+def retrieve_moose_dp(query: str) -> str:
+    """Search and return information about the document of MOOSE app that are relevant to the simulation case you are working on."""
+    return _retrieve(load_vector_databases()[1], query)
+
+
+_tools: dict = {}
+
+
+def get_tools(configuration: Configuration = None) -> tuple:
+    """The tools of the helper. The retriever tools are left out if the vector databases can not be loaded.
+
+    Only the complete tools are kept, so a later call tries to load the vector databases again (e.g. once they are
+    built, or after a network error of the embedding API).
+    """
+    configuration = configuration or current_configuration()
+    key = store_key(configuration)
+    if key in _tools:
+        return _tools[key]
+    tools = (lookup_moose_objects,)
+    try:
+        load_vector_databases(configuration)
+    except Exception as e:
+        print(f"Error loading vector database: {e}")
+        return tools
+    _tools[key] = tools + (retrieve_moose_case, retrieve_moose_dp)
+    return _tools[key]
 
 
 class State(TypedDict):
@@ -73,30 +153,138 @@ configuration = Configuration.from_runnable_config(config)
 sys_msg = """You are a knowledgeable assistant specializing in Finite Element Method (FEM) software, particularly in MOOSE simulation. Your mission is to locate and provide relevant information on input parameters, techniques, and best practices to ensure accurate and efficient simulations."""
 
 
-def bulid_helper(model: str):
-    def helper(state: State):
-        llm = load_chat_model(model).bind_tools(tools)
-        return {"messages": [llm.invoke([sys_msg] + state["messages"])]}
-
-    graph_builder = StateGraph(State)
-    graph_builder.add_node("helper", helper)
-    tool_node = ToolNode(tools=tools)
-    graph_builder.add_node("tools", tool_node)
-    graph_builder.add_edge("tools", "helper")
-    graph_builder.set_entry_point("helper")
-    graph_builder.add_conditional_edges(
-        "helper",
-        tools_condition,
-    )
-    return graph_builder.compile()
+class Helper:
+    """The helper agent: the LLM calls the tools until it answers, within budgets of tool rounds, tokens and time.
 
+    The tool calls of one assistant turn run concurrently, and a tool called again with the same arguments in the
+    same session gets the earlier result without running again. When a budget is used up, the LLM answers once more
+    with the tools still bound but ``tool_choice="none"``, so the tool turns of the conversation stay valid. A provider
+    which does not support ``"none"`` gets the conversation without tools, with the tool turns written as text.
 
-if __name__ == "__main__":
-    graph = bulid_helper()
+    The tools search the stores of ``configuration`` (the import-time configuration if not given).
+    """
+
+    def __init__(
+        self,
+        model: str,
+        max_rounds: int = 6,
+        max_tokens: int = 60000,
+        timeout: float = 300,
+        concurrency: int = 4,
+        configuration: Configuration = None,
+    ):
+        self.model = model
+        self.max_rounds = max_rounds
+        self.max_tokens = max_tokens
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.configuration = configuration or current_configuration()
 
-    def stream_graph_updates(user_input: str):
-        for event in graph.stream({"messages": [{"role": "user", "content": user_input}]}):
-            for value in event.values():
-                print("Assistant:", value["messages"][-1].content)
+    @property
+    def tools(self) -> dict:
+        # the vector databases are loaded by the first call, not when the graph is built
+        return {t.name: t for t in get_tools(self.configuration)}
 
-    stream_graph_updates("How to define Dirichlet boundary condition in MOOSE?")
+    def chat_model(self):
+        return load_chat_model(self.model)
+
+    def run_tool(self, call: dict, modules: tuple = ()) -> str:
+        token, configuration_token = _modules.set(modules), _configuration.set(self.configuration)
+        try:
+            return str(self.tools[call["name"]].invoke(call["args"]))
+        except Exception as e:
+            return f"Error: {e}"
+        finally:
+            _configuration.reset(configuration_token)
+            _modules.reset(token)
+
+    def final_answer(self, tools: list, messages: list):
+        """Answer once more without calling tools."""
+        try:
+            # the messages have tool calls, so the tools stay bound, but the last answer may not call them
+            return self.chat_model().bind_tools(tools, tool_choice="none").invoke([sys_msg] + messages)
+        except Exception as e:
+            log(f"The model does not answer with tool_choice='none' ({e}), answering without tools")
+        return self.chat_model().invoke([sys_msg] + tool_turns_as_text(messages))
+
+    def invoke(self, state: State, modules: list = None) -> dict:
+        """Answer the messages of ``state``. The retriever tools only search the documents of ``modules`` if given.
+        Returns:
+            dict: ``messages`` with the answer last, and ``stats`` of the rounds, tool calls, tokens and time used.
+        """
+        tools = list(self.tools.values())
+        llm = self.chat_model().bind_tools(tools)
+        messages = list(state["messages"])
+        modules = tuple(modules or ())
+        session: dict[str, str] = {}
+        stats = {"rounds": 0, "tool_calls": 0, "cached_tool_calls": 0, "tokens": 0, "stopped": ""}
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while True:
+                response = llm.invoke([sys_msg] + messages)
+                messages.append(response)
+                stats["tokens"] += (response.usage_metadata or {}).get("total_tokens", 0)
+                if not response.tool_calls:
+                    break
+                if stats["rounds"] >= self.max_rounds:
+                    stats["stopped"] = "rounds"
+                elif stats["tokens"] >= self.max_tokens:
+                    stats["stopped"] = "tokens"
+                elif time.perf_counter() - start_time >= self.timeout:
+                    stats["stopped"] = "timeout"
+                keys = [f"{call['name']}:{json.dumps(call['args'], sort_keys=True)}" for call in response.tool_calls]
+                if stats["stopped"]:
+                    results = ["The tool budget is used up, answer with the information you already have."] * len(keys)
+                else:
+                    stats["rounds"] += 1
+                    new_calls = {key: call for key, call in zip(keys, response.tool_calls) if key not in session}
+                    stats["tool_calls"] += len(new_calls)
+                    stats["cached_tool_calls"] += len(keys) - len(new_calls)
+                    # every tool runs in a copy of the caller's context, so the callbacks and tracing of the run apply
+                    futures = [
+                        executor.submit(copy_context().run, self.run_tool, call, modules) for call in new_calls.values()
+                    ]
+                    session.update(zip(new_calls, (future.result() for future in futures)))
+                    results = [session[key] for key in keys]
+                for call, result in zip(response.tool_calls, results):
+                    messages.append(ToolMessage(content=result, tool_call_id=call["id"], name=call["name"]))
+                if stats["stopped"]:
+                    response = self.final_answer(tools, messages)
+                    messages.append(response)
+                    stats["tokens"] += (response.usage_metadata or {}).get("total_tokens", 0)
+                    break
+        stats["elapsed"] = round(time.perf_counter() - start_time, 2)
+        log(f"Helper stats: {stats}")
+        return {"messages": messages, "stats": stats}
+
+
+def tool_turns_as_text(messages: list) -> list:
+    """Write the tool calls and results of ``messages`` as text, for a model called without tools."""
+    plain = []
+    for message in convert_to_messages(messages):
+        if isinstance(message, ToolMessage):
+            plain.append(HumanMessage(content=f"Result of the tool {message.name}:\n{message.content}"))
+        elif isinstance(message, AIMessage) and message.tool_calls:
+            calls = "\n".join(f"{call['name']}({json.dumps(call['args'])})" for call in message.tool_calls)
+            plain.append(AIMessage(content=f"{message.content}\nCalling the tools:\n{calls}".strip()))
+        else:
+            plain.append(message)
+    return plain
+
+
+def bulid_helper(
+    model: str,
+    max_rounds: int = 6,
+    max_tokens: int = 60000,
+    timeout: float = 300,
+    concurrency: int = 4,
+    configuration: Configuration = None,
+):
+    return Helper(model, max_rounds, max_tokens, timeout, concurrency, configuration)
+
+
+if __name__ == "__main__":
+    helper = bulid_helper(configuration.assistant_model)
+    question = "How to define Dirichlet boundary condition in MOOSE?"
+    answer = helper.invoke({"messages": [{"role": "user", "content": question}]})
+    print("Assistant:", answer["messages"][-1].content)
@@ -0,0 +1,329 @@
+"""A light parsed representation of the HIT syntax used by MOOSE input cards.
+
+A block starts with ``[name]`` (or the legacy ``[./name]``) and ends with ``[]`` (or ``[../]``).
+Block paths are written like ``BCs/left``.
+
+``parse`` is cached by content, and every top-level block is cached by its own text, so a new version of an input
+card only re-parses the top-level blocks that changed. Parsed documents are shared between callers and must not be
+modified: edit the text (e.g. with ``replace_block``) and parse it again. ``str(parse(text)) == text`` always holds.
+"""
+
+import re
+from functools import lru_cache
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+_HEADER = re.compile(r"^\[\s*(?:\./)?([^\[\]]*?)\s*\]$")
+_PARAM = re.compile(r"^\s*([A-Za-z_][\w:/.\-]*)\s*=\s*(.*?)\s*$", re.DOTALL)
+_TYPE = re.compile(r"(?:^|\s)type\s*=\s*(\S+)", re.MULTILINE)
+
+
+class HitError(ValueError):
+    """Raised when an input card or a block patch is not valid HIT."""
+
+
+class Param:
+    """``name = value``. ``start`` and ``end`` are line numbers relative to the top-level block."""
+
+    __slots__ = ("name", "raw", "start", "end")
+
+    def __init__(self, name: str, raw: str, start: int, end: int):
+        self.name = name
+        self.raw = raw
+        self.start = start
+        self.end = end
+
+    @property
+    def value(self) -> str:
+        """The value without its surrounding quotes."""
+        raw = self.raw
+        if len(raw) > 1 and raw[0] == raw[-1] and raw[0] in "'\"":
+            return raw[1:-1].strip()
+        return raw
+
+    def __repr__(self):
+        return f"Param({self.name} = {self.raw})"
+
+
+class Block:
+    """``[name] ... []``. ``start`` and ``end`` are line numbers relative to the top-level block."""
+
+    __slots__ = ("name", "path", "params", "children", "start", "end")
+
+    def __init__(self, name: str, path: str, start: int):
+        self.name = name
+        self.path = path
+        self.params: List[Param] = []
+        self.children: List["Block"] = []
+        self.start = start
+        self.end = start
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """Return the value of a parameter of this block."""
+        for param in self.params:
+            if param.name == name:
+                return param.value
+        return default
+
+    def walk(self) -> Iterator["Block"]:
+        """Iterate over this block and all its sub-blocks, depth first."""
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+    def __repr__(self):
+        return f"Block([{self.path}], {len(self.params)} params, {len(self.children)} blocks)"
+
+
+class TopBlock(Block):
+    """A top-level block, which also keeps its source text and its parse errors."""
+
+    __slots__ = ("text", "errors")
+
+
+class Document:
+    """A parsed input card: the top-level blocks, and the text between them (comments, top-level parameters)."""
+
+    __slots__ = ("pieces", "offsets", "blocks", "params", "errors")
+
+    def __init__(self):
+        self.pieces: List[Union[str, TopBlock]] = []
+        self.offsets: List[int] = []  # the first line of every top-level block
+        self.blocks: List[TopBlock] = []
+        self.params: List[Param] = []  # top-level parameters, with line numbers of the document
+        self.errors: List[str] = []
+
+    def __str__(self):
+        return "".join(piece if isinstance(piece, str) else piece.text for piece in self.pieces)
+
+    def find(self, path: str) -> Optional[Block]:
+        """Return the block with the given path, e.g. ``BCs/left``."""
+        path = path.strip().strip("[]").strip("/")
+        for top in self.blocks:
+            if path == top.path or path.startswith(top.path + "/"):
+                for block in top.walk():
+                    if block.path == path:
+                        return block
+        return None
+
+    def walk(self) -> Iterator[Block]:
+        for top in self.blocks:
+            yield from top.walk()
+
+    def spans(self) -> Dict[str, Tuple[int, int]]:
+        """Map every block path to its 0-based, inclusive line span in the document."""
+        spans = {}
+        for offset, top in zip(self.offsets, self.blocks):
+            for block in top.walk():
+                spans[block.path] = (offset + block.start, offset + block.end)
+        return spans
+
+    def object_types(self) -> List[str]:
+        """Return the ``type`` of every block, i.e. the MOOSE objects used in the input card."""
+        return [block.get("type") for block in self.walk() if block.get("type")]
+
+    def leading_comments(self) -> List[str]:
+        """Return the comment lines before the first block."""
+        if not self.pieces or not isinstance(self.pieces[0], str):
+            return []
+        return [line.strip() for line in self.pieces[0].splitlines() if line.strip().startswith("#")]
+
+
+def _strip_comment(line: str) -> str:
+    """Remove the trailing ``#`` comment of a line, ignoring ``#`` inside quotes."""
+    quote = None
+    for i, ch in enumerate(line):
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch == "#":
+            return line[:i]
+    return line
+
+
+def _open_quote(line: str, quote: Optional[str]) -> Optional[str]:
+    """Return the quote character still open at the end of ``line``."""
+    for ch in line:
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"":
+            quote = ch
+        elif ch == "#":
+            break
+    return quote
+
+
+def _header(line: str) -> Optional[str]:
+    """Return the block name of a header line, ``""`` for a terminator and None for any other line."""
+    match = _HEADER.match(_strip_comment(line).strip())
+    if match is None:
+        return None
+    name = match.group(1).rstrip("/")
+    return "" if name == ".." else name
+
+
+def _add_param(statement: List[str], first: int, params: List[Param]):
+    """Parse one ``name = value`` statement, which spans several lines if a quoted value does."""
+    match = _PARAM.match("\n".join(_strip_comment(line) for line in statement))
+    if match:
+        params.append(Param(match.group(1), match.group(2), first, first + len(statement) - 1))
+
+
+@lru_cache(maxsize=4096)
+def _parse_top_block(text: str) -> TopBlock:
+    """Parse one top-level block, from its header to its terminator."""
+    lines = text.splitlines()
+    name = _header(lines[0])
+    top = TopBlock(name, name, 0)
+    top.text = text
+    top.errors = []
+    stack: List[Block] = [top]
+    statement: List[str] = []
+    first, quote = 0, None
+    for i, line in enumerate(lines[1:], 1):
+        if quote is None:
+            name = _header(line)
+            if name == "":
+                stack.pop().end = i
+                continue
+            if name is not None:
+                block = Block(name, f"{stack[-1].path}/{name}", i)
+                stack[-1].children.append(block)
+                stack.append(block)
+                continue
+            statement, first = [], i
+        statement.append(line)
+        quote = _open_quote(line, quote)
+        if quote is None:
+            _add_param(statement, first, stack[-1].params)
+    for block in stack:
+        block.end = len(lines) - 1
+        top.errors.append(f"Block [{block.path}] is not terminated, please add [] at the end of the block.")
+    return top
+
+
+def _block_end(lines: List[str], start: int) -> int:
+    """Return the line of the terminator of the top-level block starting at ``start`` (the last line if missing)."""
+    depth, quote = 0, None
+    for i in range(start, len(lines)):
+        if quote is None:
+            name = _header(lines[i])
+            if name is not None:
+                depth += 1 if name else -1
+                if depth == 0:
+                    return i
+                continue
+        quote = _open_quote(lines[i], quote)
+    return len(lines) - 1
+
+
+@lru_cache(maxsize=256)
+def parse(text: str) -> Document:
+    """Parse an input card. Unbalanced blocks are reported in ``Document.errors`` instead of raising."""
+    doc = Document()
+    lines = text.splitlines(keepends=True)
+    gap: List[str] = []
+    statement: List[str] = []
+    first, quote, i = 0, None, 0
+    while i < len(lines):
+        name = _header(lines[i]) if quote is None else None
+        if name:
+            if gap:
+                doc.pieces.append("".join(gap))
+                gap = []
+            end = _block_end(lines, i)
+            top = _parse_top_block("".join(lines[i : end + 1]))
+            doc.pieces.append(top)
+            doc.offsets.append(i)
+            doc.blocks.append(top)
+            doc.errors += top.errors
+            i = end + 1
+            continue
+        if name == "":
+            doc.errors.append(f"Unexpected block terminator at line {i + 1}.")
+        elif quote is not None or "=" in lines[i]:
+            if quote is None:
+                statement, first = [], i
+            statement.append(lines[i].rstrip("\r\n"))
+            quote = _open_quote(lines[i], quote)
+            if quote is None:
+                _add_param(statement, first, doc.params)
+        gap.append(lines[i])
+        i += 1
+    if gap:
+        doc.pieces.append("".join(gap))
+    return doc
+
+
+def block_spans(text: str) -> Dict[str, Tuple[int, int]]:
+    """Map every block path of an input card to its line span.
+
+    Args:
+        text (str): The content of the input card.
+    Returns:
+        dict: ``{"BCs/left": (first_line, last_line)}`` with 0-based, inclusive line numbers.
+    Raises:
+        HitError: If the blocks are not balanced.
+    """
+    doc = parse(text)
+    if doc.errors:
+        raise HitError(doc.errors[0])
+    return doc.spans()
+
+
+def object_types(text: str) -> List[str]:
+    """Return the MOOSE objects (``type = X``) used in an input card.
+
+    The objects of a card with unbalanced blocks are still found, line by line.
+    """
+    doc = parse(text)
+    if doc.errors:
+        return [match.group(1).strip("'\"") for match in _TYPE.finditer(text)]
+    return doc.object_types()
+
+
+def replace_block(text: str, path: str, content: str) -> str:
+    """Replace, insert or delete one block of an input card.
+
+    Args:
+        text (str): The content of the input card.
+        path (str): The block path, e.g. ``BCs/left``.
+        content (str): The complete new block including its header and terminator. An empty string deletes the block.
+    Returns:
+        str: The patched input card.
+    Raises:
+        HitError: If the patch is not a single block named like ``path`` or the result is not valid HIT.
+    """
+    path = path.strip().strip("[]").strip("/")
+    lines = text.splitlines()
+    spans = block_spans(text)
+    new_lines = content.strip("\n").splitlines() if content.strip() else []
+    if new_lines:
+        patch = parse("\n".join(new_lines) + "\n")
+        if patch.errors:
+            raise HitError(patch.errors[0])
+        if len(patch.blocks) != 1 or patch.blocks[0].name != path.split("/")[-1]:
+            raise HitError(f"The patch of [{path}] must contain exactly one block named [{path.split('/')[-1]}].")
+        # keep the indentation of the block that is replaced
+        indent = "  " * path.count("/")
+        if not new_lines[0].startswith(indent):
+            new_lines = [indent + line if line.strip() else line for line in new_lines]
+    if path in spans:
+        start, end = spans[path]
+        lines[start : end + 1] = new_lines
+    elif not new_lines:
+        raise HitError(f"Block [{path}] does not exist and cannot be deleted.")
+    elif "/" in path:
+        parent = path.rsplit("/", 1)[0]
+        if parent not in spans:
+            raise HitError(f"Parent block [{parent}] of [{path}] does not exist.")
+        end = spans[parent][1]
+        lines[end:end] = new_lines
+    else:
+        lines += [""] + new_lines
+    patched = "\n".join(lines) + "\n"
+    if new_lines and path not in block_spans(patched):
+        raise HitError(f"Block [{path}] is missing after applying the patch.")
+    return patched
@@ -0,0 +1,79 @@
+"""Report where the import time of the mooseagent modules goes, from ``python -X importtime``.
+
+Every module is imported in a fresh interpreter, so the numbers do not depend on what was imported before.
+
+Usage:
+    python import_report.py [module ...] [--top N]
+"""
+
+import os
+import subprocess
+import sys
+from typing import Dict, List
+
+DEFAULT_MODULES = ["mooseagent.hit", "mooseagent.utils", "mooseagent.helper", "mooseagent.graph"]
+# 只在第一次使用时才应导入的模型供应商和推理后端
+DEFERRED_MODULES = [
+    "torch",
+    "transformers",
+    "onnxruntime",
+    "langchain_openai",
+    "langchain_deepseek",
+    "langchain_community",
+    "faiss",
+    "chromadb",
+    "sentence_transformers",
+    "tqdm",
+]
+
+
+def import_time(module: str, deferred_modules: List[str] = DEFERRED_MODULES) -> Dict:
+    """Import ``module`` in a new interpreter.
+    Returns:
+        dict: ``total_ms`` of the module, the ``imports`` as ``(name, self ms, cumulative ms)`` in import order, and
+        the ``deferred`` modules of ``deferred_modules`` that were imported anyway (found in ``sys.modules``).
+    """
+    src = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, RUN_PATH=os.getenv("RUN_PATH") or src)
+    env["PYTHONPATH"] = os.pathsep.join(p for p in (src, os.getenv("PYTHONPATH")) if p)
+    code = f"import sys, {module}; print(','.join(m for m in {list(deferred_modules)!r} if m in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code], env=env, capture_output=True, text=True, check=True
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        imports.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    total_ms = next(cumulative for name, _, cumulative in imports if name == module)
+    deferred = [m for m in result.stdout.strip().splitlines()[-1].split(",") if m] if result.stdout.strip() else []
+    return {"total_ms": total_ms, "imports": imports, "deferred": deferred}
+
+
+def report(modules: List[str], top: int = 10) -> str:
+    lines = []
+    for module in modules:
+        result = import_time(module)
+        lines.append(f"{module}: {result['total_ms']:.0f} ms")
+        if result["deferred"]:
+            lines.append(f"  imported at import time: {', '.join(result['deferred'])}")
+        # the self time of all the modules of a top level package, interpreter start up (site) left out
+        packages: Dict[str, float] = {}
+        for name, self_ms, _ in result["imports"]:
+            package = name.split(".")[0]
+            packages[package] = packages.get(package, 0.0) + self_ms
+        packages.pop("site", None)
+        for package, ms in sorted(packages.items(), key=lambda p: p[1], reverse=True)[:top]:
+            lines.append(f"  {ms:8.1f} ms  {package}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    top = 10
+    if "--top" in args:
+        i = args.index("--top")
+        top = int(args[i + 1])
+        del args[i : i + 2]
+    print(report(args or DEFAULT_MODULES, top))
@@ -1,115 +1,88 @@
 import sys
 import os
+from itertools import chain
 from dotenv import load_dotenv
 
 load_dotenv()
 run_path = os.getenv("RUN_PATH")
 sys.path.append(run_path)
-from langgraph.checkpoint.memory import MemorySaver
-from langchain_community.vectorstores import FAISS, Chroma
 from mooseagent.configuration import Configuration
-from langchain_community.document_loaders import JSONLoader
 from langchain_core.runnables import RunnableConfig
-from langchain_openai import OpenAIEmbeddings
-from mooseagent.utils import BGE_M3_EmbeddingFunction
+from mooseagent.utils import load_embedding_function
+from mooseagent.corpus import iter_documents
+from mooseagent.chunking import ParentStore, PARENTS_FILE, iter_chunks
+from mooseagent.vector_store import HashIndex, create_store, open_store, save_store, store_lock
 from tqdm import tqdm
-import hashlib
-import json
 
 config = RunnableConfig()
 configuration = Configuration.from_runnable_config(config)
 vector_type = configuration.vector_store
-embedding_function = OpenAIEmbeddings() if configuration.embedding_function == "OPENAI" else BGE_M3_EmbeddingFunction()
-batch_size = configuration.batch_size
+embedding_function = load_embedding_function(configuration)
+# 远程 API 的请求会按条数和 token 数拆分，可以大批量添加；本地模型保持小批量以限制内存峰值
+remote = configuration.embedding_function == "OPENAI" or hasattr(embedding_function, "client")
+batch_size = configuration.remote_batch_size if remote else configuration.batch_size
 top_k = configuration.top_k
 json_file = configuration.rag_json_path
 
-# 用于存储已处理文档的哈希值
-processed_hashes = set()
+vectordb = open_store(vector_type, configuration.PERSIST_DIRECTORY, embedding_function)
+# 用于存储已处理文档的哈希值, 哈希文件不存在时从已有的文档计算
+processed_hashes = HashIndex(configuration.PERSIST_DIRECTORY, vectordb)
 
-HASHES_FILE = os.path.join(configuration.PERSIST_DIRECTORY, "hashes.json")
-if vector_type.lower() == "chroma":
-    if os.path.exists(configuration.PERSIST_DIRECTORY):
-        vectordb = Chroma(
-            persist_directory=configuration.PERSIST_DIRECTORY,
-            embedding_function=embedding_function,
-        )
-        # 如果哈希文件存在，加载已有的哈希值
-        if os.path.exists(HASHES_FILE):
-            with open(HASHES_FILE, "r") as f:
-                processed_hashes = set(json.load(f))
-        else:
-            # 获取Chroma中的所有文档
-            existing_docs = vectordb.get()["documents"]
-            for doc in existing_docs:
-                doc_hash = hashlib.sha256(doc.encode("utf-8")).hexdigest()
-                processed_hashes.add(doc_hash)
-    else:
-        vectordb = None
-else:
-    if os.path.exists(configuration.PERSIST_DIRECTORY):
-        vectordb = FAISS.load_local(
-            configuration.PERSIST_DIRECTORY,
-            embedding_function,
-            allow_dangerous_deserialization=True,
-        )
-        # 如果哈希文件存在，加载已有的哈希值
-        if os.path.exists(HASHES_FILE):
-            with open(HASHES_FILE, "r") as f:
-                processed_hashes = set(json.load(f))
-        else:
-            # 假设 vectordb 中的文档内容可以被用来计算哈希
-            existing_docs = vectordb.docstore._dict.values()
-            for doc in existing_docs:
-                # 计算现有文档的哈希值
-                doc_hash = hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
-                processed_hashes.add(doc_hash)
-    else:
-        vectordb = None
 
-print("加载json文件...")
-loader = JSONLoader(file_path=json_file, jq_schema=".[]", text_content=False)
-docs = loader.load()
-for i in tqdm(range(0, len(docs), batch_size)):
-    batch_docs = docs[i : i + batch_size]
-    # 过滤掉已经处理过的文档
-    filtered_batch = []
-    for doc in batch_docs:
-        # 计算当前文档的哈希值
-        doc_hash = hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
-        if doc_hash not in processed_hashes:
-            filtered_batch.append(doc)
-            processed_hashes.add(doc_hash)
+def iter_batches(docs, batch_size: int):
+    """逐批读取文档，comment.jsonl 不需要一次性加载到内存中"""
+    batch = []
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
 
-    if not filtered_batch:
-        continue  # 如果批次中没有新文档，跳过
-    try:
-        if vectordb is None:
-            if vector_type.lower() == "chroma":
-                vectordb = Chroma.from_documents(
-                    documents=filtered_batch,
-                    embedding=embedding_function,
-                    persist_directory=configuration.PERSIST_DIRECTORY,
+print("加载json文件...")
+sources = [json_file]
+# 重建输入卡数据库时，也索引在线学习得到的输入卡 (learned.jsonl)，否则重建会丢掉它们
+is_case_store = os.path.realpath(configuration.PERSIST_DIRECTORY) == os.path.realpath(configuration.input_database_path)
+if is_case_store and os.path.exists(configuration.learned_cases_path):
+    sources.append(configuration.learned_cases_path)
+if configuration.chunk_mode == "block":
+    # 按顶层块切分注释后的输入卡，完整的输入卡保存在向量数据库旁边，检索时按块取回
+    parent_store = ParentStore(os.path.join(configuration.PERSIST_DIRECTORY, PARENTS_FILE))
+    documents = chain.from_iterable(
+        iter_chunks(source, parent_store, configuration.chunk_context_chars) for source in sources
+    )
+else:
+    parent_store = None
+    documents = chain.from_iterable(iter_documents(source) for source in sources)
+with store_lock(configuration.PERSIST_DIRECTORY):
+    for i, batch_docs in enumerate(tqdm(iter_batches(documents, batch_size))):
+        # 过滤掉已经处理过的文档
+        filtered_batch = processed_hashes.new(batch_docs)
+        if not filtered_batch:
+            continue  # 如果批次中没有新文档，跳过
+        try:
+            if vectordb is None:
+                vectordb = create_store(
+                    vector_type, configuration.PERSIST_DIRECTORY, embedding_function, filtered_batch
                 )
             else:
-                vectordb = FAISS.from_documents(
-                    documents=filtered_batch,
-                    embedding=embedding_function,
-                )
-        else:
-            vectordb.add_documents(documents=filtered_batch)
-    except Exception as e:
-        print(f"处理批次 {i//batch_size + 1} 时出错: {e}")
-        break
-# 保存向量数据库
-if vectordb:
-    if vector_type.lower() == "chroma":
-        vectordb.persist()  # Chroma特有的持久化方法
+                vectordb.add_documents(documents=filtered_batch)
+        except Exception as e:
+            # 嵌入请求已经重试过，跳过这一批，下次运行时会重新处理
+            print(f"处理批次 {i + 1} 时出错: {e}")
+            continue
+        # 只记录成功写入的文档
+        processed_hashes.add(filtered_batch)
+    if hasattr(embedding_function, "client"):
+        print(f"Embedding throughput: {embedding_function.client.throughput()}")
+    # 保存向量数据库
+    if vectordb:
+        save_store(vectordb, configuration.PERSIST_DIRECTORY)
+        if parent_store is not None:
+            parent_store.save()
+        processed_hashes.save()
+        print("向量数据库已更新并保存。")
     else:
-        vectordb.save_local(configuration.PERSIST_DIRECTORY)
-
-    with open(HASHES_FILE, "w") as f:
-        json.dump(list(processed_hashes), f)
-    print("向量数据库已更新并保存。")
-else:
-    print("没有新文档需要添加，向量数据库未更改。")
+        print("没有新文档需要添加，向量数据库未更改。")
@@ -0,0 +1,126 @@
+"""The MOOSE module, physics and objects of the indexed documents, and the module filter of a search.
+
+The documents are tagged when they are indexed: the module is taken from the source path of a case
+(``modules/phase_field/test/tests/...``), or from the input card name which ``autocomment.adjust_path`` made of it
+(``phase_field_...``), unless the record already has a ``module``. The cases of the framework tests, examples and
+tutorials are tagged ``framework``, documents whose module is unknown get an empty module. A search is filtered to
+the modules inferred from the requirement, and the framework and untagged documents always pass the filter.
+"""
+
+import json
+import re
+from typing import Dict, List
+
+from mooseagent.hit import object_types
+
+# the directories of moose/modules, with the physics they belong to
+PHYSICS = {
+    "chemical_reactions": "chemistry",
+    "geochemistry": "chemistry",
+    "combined": "multiphysics",
+    "contact": "solid mechanics",
+    "solid_mechanics": "solid mechanics",
+    "xfem": "solid mechanics",
+    "peridynamics": "solid mechanics",
+    "solid_properties": "material properties",
+    "fluid_properties": "material properties",
+    "electromagnetics": "electromagnetics",
+    "fsi": "fluid-structure interaction",
+    "functional_expansion_tools": "multiphysics",
+    "heat_transfer": "heat transfer",
+    "level_set": "interface tracking",
+    "misc": "general",
+    "navier_stokes": "fluid flow",
+    "thermal_hydraulics": "fluid flow",
+    "rdg": "fluid flow",
+    "scalar_transport": "species transport",
+    "optimization": "optimization",
+    "phase_field": "phase field",
+    "porous_flow": "porous flow",
+    "richards": "porous flow",
+    "ray_tracing": "radiation transport",
+    "reactor": "reactor",
+    "stochastic_tools": "uncertainty quantification",
+    "external_petsc_solver": "general",
+}
+FRAMEWORK = "framework"
+
+# words of a requirement which point to a module, separated by "|"
+MODULE_KEYWORDS = {
+    "phase_field": (
+        "phase field|phase-field|allen-cahn|cahn-hilliard|solidification|"
+        "grain growth|dendrit|spinodal|order parameter|free energy"
+    ),
+    "heat_transfer": "heat|thermal|temperature|conduction|convection|radiative",
+    "solid_mechanics": (
+        "stress|strain|elastic|plastic|deformation|displacement|"
+        "mechanical|beam|creep|fracture|tensile|compression"
+    ),
+    "contact": "contact|friction|mortar",
+    "navier_stokes": (
+        "navier|incompressible|compressible flow|fluid flow|flow around|velocity field|"
+        "viscous|turbulen|cfd|channel flow|lid-driven|lid driven"
+    ),
+    "porous_flow": "porous|darcy|permeability|groundwater|aquifer|reservoir|poroelastic",
+    "richards": "richards|unsaturated|saturation",
+    "chemical_reactions": "chemical reaction|reactive transport|species|precipitation|dissolution",
+    "geochemistry": "geochemi|mineral|aqueous",
+    "electromagnetics": "electromagnetic|electric field|magnetic|maxwell|waveguide",
+    "thermal_hydraulics": "thermal hydraulic|thermal-hydraulic|pipe flow|1-phase|two-phase|heat exchanger",
+    "level_set": "level set|level-set",
+    "xfem": "xfem|crack",
+    "stochastic_tools": "monte carlo|uncertainty|sampling|surrogate|stochastic",
+    "optimization": "optimization|inverse problem|parameter estimation",
+    "scalar_transport": "advection|scalar transport",
+    "ray_tracing": "ray tracing|view factor",
+    "peridynamics": "peridynamic",
+    "reactor": "reactor|fuel pin|fuel assembly",
+}
+
+_MODULE_PATH = re.compile(r"(?:^|[/\\])modules[/\\](\w+)[/\\]")
+_FRAMEWORK_PATH = re.compile(r"(?:^|[/\\])(?:test[/\\]tests|examples|tutorials)[/\\]")
+
+
+def module_of_path(path: str) -> str:
+    """The module of a source path, ``framework`` for the framework tests, examples and tutorials, else ``""``."""
+    match = _MODULE_PATH.search(path)
+    if match:
+        return match.group(1)
+    return FRAMEWORK if _FRAMEWORK_PATH.search(path) else ""
+
+
+def module_of_name(name: str) -> str:
+    """The module of an input card name made by ``adjust_path``, which removed the ``modules/`` directory."""
+    for module in sorted(PHYSICS, key=len, reverse=True):
+        if name.startswith(module + "_"):
+            return module
+    return FRAMEWORK
+
+
+def tag_record(record: Dict) -> Dict[str, str]:
+    """The ``module``, ``physics`` and ``objects`` metadata of a record of comment.jsonl or dp_detail.json."""
+    card = record.get("annotated_input_card")
+    if isinstance(card, str):
+        module = (
+            record.get("module")
+            or module_of_path(record.get("source_path", ""))
+            or module_of_name(record.get("input_card_name", ""))
+        )
+        objects = ",".join(sorted(set(object_types(card))))
+    else:
+        module = module_of_path(json.dumps(record))
+        objects = ""
+    physics = "general" if module == FRAMEWORK else PHYSICS.get(module, "")
+    return {"module": module, "physics": physics, "objects": objects}
+
+
+def infer_modules(text: str) -> List[str]:
+    """The modules a requirement points to, the most mentioned first. An empty list means no filter."""
+    text = text.lower()
+    hits = {module: sum(text.count(word) for word in words.split("|")) for module, words in MODULE_KEYWORDS.items()}
+    return sorted((module for module, n in hits.items() if n), key=lambda module: hits[module], reverse=True)
+
+
+def module_filter(modules: List[str]) -> Dict:
+    """The metadata filter of Chroma and FAISS which keeps the modules, the framework and the untagged documents."""
+    return {"module": {"$in": list(modules) + [FRAMEWORK, ""]}}
@@ -0,0 +1,180 @@
+"""Local BGE-M3 embeddings on CPU with an int8 quantised ONNX model.
+
+The full fp32 model loaded by ``BGE_M3_EmbeddingFunction`` through transformers/torch is slow per query and takes
+several GB of memory in every process. This backend runs an exported, dynamically quantised copy of the model with
+onnxruntime and only needs ``onnxruntime`` and ``tokenizers`` at run time (torch and transformers only to export).
+Set ``embedding_function = "BGE_M3_ONNX"`` and ``onnx_model_dir`` in configuration.py to use it. The vectors stay in
+the vector space of BGE-M3, so it searches the existing BGE-M3 stores without a re-index (see ``store_name``).
+
+Usage:
+    python onnx_embedding.py export [model name or path] [output dir]
+    python onnx_embedding.py benchmark <BGE_M3_ONNX | BGE_M3_EmbeddingFunction> [onnx model dir]
+
+Run the benchmark once per backend: each run is a fresh process, so the peak RSS it prints is the memory of that
+backend alone.
+"""
+
+import os
+import sys
+import time
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+MODEL_FILE = "model.onnx"
+QUANTIZED_MODEL_FILE = "model_int8.onnx"
+
+
+class ONNXEmbeddingFunction(Embeddings):
+    """BGE-M3 embeddings (CLS pooling, like ``BGE_M3_EmbeddingFunction``) computed by onnxruntime on CPU.
+
+    Args:
+        model_dir (str): The directory written by ``export``, with the ONNX model and ``tokenizer.json``.
+        model_file (str): The model in ``model_dir``, the int8 model by default.
+        max_length (int): Texts are truncated to this many tokens.
+        batch_size (int): The number of texts run through the model at once.
+        threads (int): The intra-op threads of onnxruntime, 0 for all cores.
+    """
+
+    def __init__(
+        self,
+        model_dir: str,
+        model_file: str = QUANTIZED_MODEL_FILE,
+        max_length: int = 512,
+        batch_size: int = 16,
+        threads: int = 0,
+    ):
+        import numpy as np
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        self.np = np
+        self.batch_size = batch_size
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length)
+        pad_token = "<pad>"
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id(pad_token), pad_token=pad_token)
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            os.path.join(model_dir, model_file), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        embeddings = []
+        for i in range(0, len(texts), self.batch_size):
+            encodings = self.tokenizer.encode_batch(texts[i : i + self.batch_size])
+            inputs = {
+                "input_ids": self.np.array([e.ids for e in encodings], dtype=self.np.int64),
+                "attention_mask": self.np.array([e.attention_mask for e in encodings], dtype=self.np.int64),
+                "token_type_ids": self.np.array([e.type_ids for e in encodings], dtype=self.np.int64),
+            }
+            last_hidden_state = self.session.run(None, {name: inputs[name] for name in self.input_names})[0]
+            embeddings += last_hidden_state[:, 0, :].tolist()
+        return embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+
+def export(model_name_or_path: str = "BAAI/bge-m3", output_dir: str = "bge-m3-onnx", quantize: bool = True) -> str:
+    """Export the model to ONNX and quantise its weights to int8 (dynamic quantisation).
+
+    Returns:
+        str: The path of the quantised model, or of the fp32 model if ``quantize`` is False.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(output_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name_or_path)
+    model = AutoModel.from_pretrained(model_name_or_path)
+    model.eval()
+    tokenizer.save_pretrained(output_dir)  # writes tokenizer.json for the runtime
+    sample = tokenizer(["MOOSE input card"], return_tensors="pt")
+    model_path = os.path.join(output_dir, MODEL_FILE)
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            (sample["input_ids"], sample["attention_mask"]),
+            model_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=17,
+        )
+    if not quantize:
+        return model_path
+    quantized_path = os.path.join(output_dir, QUANTIZED_MODEL_FILE)
+    # the fp32 weights of BGE-M3 are larger than the 2GB protobuf limit
+    quantize_dynamic(model_path, quantized_path, weight_type=QuantType.QInt8, use_external_data_format=True)
+    return quantized_path
+
+
+def peak_rss_mb() -> float:
+    """The peak resident memory of this process in MB, 0.0 without the POSIX ``resource`` module (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    # ru_maxrss is in bytes on macOS and in KB on Linux
+    unit = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / unit
+
+
+def benchmark(embedding_function: Embeddings, texts: List[str], repeats: int = 20) -> Dict:
+    """Measure the latency of single queries and of a document batch, and the peak RSS of the process."""
+    embedding_function.embed_query(texts[0])  # warm up
+    latencies = []
+    for n in range(repeats):
+        start_time = time.perf_counter()
+        embedding_function.embed_query(texts[n % len(texts)])
+        latencies.append(time.perf_counter() - start_time)
+    latencies.sort()
+    start_time = time.perf_counter()
+    embedding_function.embed_documents(texts)
+    batch_time = time.perf_counter() - start_time
+    return {
+        "query_latency_p50": round(latencies[len(latencies) // 2], 4),
+        "query_latency_p95": round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 4),
+        "documents_per_second": round(len(texts) / batch_time, 2),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+BENCHMARK_TEXTS = [
+    "Transient heat conduction in a 2D plate with a fixed temperature on the left boundary.",
+    "[Kernels]\n  [diff]\n    type = Diffusion\n    variable = u\n  []\n[]",
+    "Phase field simulation of the solidification of a pure metal with an Allen-Cahn equation coupled to heat.",
+    "Incompressible Navier-Stokes flow around a cylinder with INSFV kernels and a Rhie-Chow interpolator.",
+    "Linear elasticity of a cantilever beam under a pressure load, using the solid mechanics QuasiStatic action.",
+] * 4
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] not in ("export", "benchmark"):
+        print(__doc__)
+        sys.exit(1)
+    if sys.argv[1] == "export":
+        print(export(*sys.argv[2:4]))
+    else:
+        backend = sys.argv[2] if len(sys.argv) > 2 else "BGE_M3_ONNX"
+        if backend == "BGE_M3_ONNX":
+            embedding_function = ONNXEmbeddingFunction(sys.argv[3] if len(sys.argv) > 3 else "bge-m3-onnx")
+        else:
+            sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            from mooseagent.utils import BGE_M3_EmbeddingFunction
+
+            embedding_function = BGE_M3_EmbeddingFunction(use_local_model=True)
+        print(f"RSS after loading: {peak_rss_mb():.1f} MB")
+        print(backend, benchmark(embedding_function, BENCHMARK_TEXTS))
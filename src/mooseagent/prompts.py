@@ -73,13 +73,26 @@ MODIFY_PROMPT = """Here are some error messages about moose input card:
 {error}
 Please conduct a thorough review of the following MOOSE input files:
 {inpcard_code}
-Please help me to modify the input card based on the error messages.
+{documentation}{repairs}Please help me to modify the input card based on the error messages.
 You should reply like this:
 The error occur in: <filename>.
 The error and reason is that: <Provide the original error message, explain the reason for the error and the method of modification>.
 The modified <filename> is that:
 <The update content of <filename>.>
 """
+MODIFY_PATCH_PROMPT = """Here are some error messages about moose input card:
+{error}
+Please conduct a thorough review of the following MOOSE input files:
+{inpcard_code}
+{documentation}{repairs}Please help me to modify the input card based on the error messages. Only return the blocks that need to be changed, do not repeat the unchanged blocks.
+You should reply like this:
+The error occur in: <filename>.
+The error and reason is that: <Provide the original error message, explain the reason for the error and the method of modification>.
+The modified blocks of <filename> are:
+Block: <the path of the block, e.g. BCs/left or Executioner>
+<The complete new content of this block, from its header [left] to its terminator []. Leave it empty to delete the block.>
+Block: ...
+"""
 
 SYSTEM_REVIEW_PROMPT = """You are the dedicated input file review specialist for MOOSE. Your role is to accurately pinpoint problematic files and their exact locations by analyzing MOOSE input files and the error results encountered during execution. For each error message, you should clearly identify the code segment in the input card that is incorrect and provide the corresponding error message for that segment. Additionally, you should assess whether this error is present in other parts of the input card and highlight this if applicable.
 Please conduct a thorough review of the following MOOSE input files:
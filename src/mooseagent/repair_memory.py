@@ -0,0 +1,197 @@
+"""Remember the repairs of MOOSE errors across runs, keyed by the normalised error signature.
+
+Every ``modify`` keeps the top-level blocks it changed (before and after) as a pending repair of the error it was
+given. A pending repair is dropped if the same error comes back in the next run, the remaining ones are appended to
+``repairs.jsonl`` when the run succeeds. ``modify`` looks the error up by its exact signature first, and by the most
+similar signatures second. An exact hit whose blocks are still unchanged in one of the cards is applied directly,
+without the helper; the other hits are put into the modify prompt.
+"""
+
+import difflib
+import json
+import os
+import re
+import threading
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from mooseagent.corpus import append_record, read_records
+from mooseagent.hit import HitError, parse, replace_block
+from mooseagent.retrieval import content_hash
+
+_ANSI = re.compile(r"\x1b\[[0-9;]*m")
+_LOCATION = re.compile(r"\S+\.i:\d+(?:\.\d+)?(?::\d+)?:?")
+_PATH = re.compile(r"/?(?:[\w.\-]+/)+[\w.\-]+")
+_QUOTED = re.compile(r"'[^'\n]*'|\"[^\"\n]*\"")
+_NUMBER = re.compile(r"(?<![A-Za-z_])[-+]?\d+(?:\.\d+)?(?:e[-+]?\d+)?", re.IGNORECASE)
+_STOP = ("Stack frames", "application called MPI_Abort", "[0]", "---")
+
+
+def error_message(error: str, max_lines: int = 6) -> str:
+    """The explanation of the first ``*** ERROR ***`` of the MOOSE output, else the first lines of ``error``."""
+    lines = _ANSI.sub("", error).splitlines()
+    for i, line in enumerate(lines):
+        if "*** ERROR ***" in line:
+            lines = lines[i + 1 :]
+            break
+    message = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            if message:
+                break
+            continue
+        if line.startswith(_STOP):
+            break
+        message.append(line)
+        if len(message) == max_lines:
+            break
+    return "\n".join(message)
+
+
+def _path(match: re.Match) -> str:
+    # the file and block paths differ from card to card, keep only their first and last parts
+    parts = match.group(0).strip("/").split("/")
+    return f"{parts[0]}/*/{parts[-1]}" if len(parts) > 2 else match.group(0)
+
+
+def error_signature(error: str) -> str:
+    """The error message without locations, names, block paths and numbers, so the same error of any card matches."""
+    signature = _LOCATION.sub("<file>:", error_message(error))
+    signature = _QUOTED.sub("'<name>'", signature)
+    signature = _PATH.sub(_path, signature)
+    signature = _NUMBER.sub("<n>", signature)
+    return " ".join(signature.split())
+
+
+def _normal(text: str) -> str:
+    """A block without indentation, blank lines and comment lines, to compare blocks of different cards."""
+    return "\n".join(line.strip() for line in text.splitlines() if line.strip() and not line.strip().startswith("#"))
+
+
+def _blocks(card: str) -> Dict[str, str]:
+    doc = parse(card)
+    return {} if doc.errors else {block.path: block.text for block in doc.blocks}
+
+
+def changed_blocks(before: str, after: str) -> List[Dict[str, str]]:
+    """The top-level blocks which differ between two versions of a card, ``""`` for an added or deleted block."""
+    old, new = _blocks(before), _blocks(after)
+    if not old or not new:
+        return []
+    return [
+        {"block": path, "before": old.get(path, ""), "after": new.get(path, "")}
+        for path in list(old) + [path for path in new if path not in old]
+        if _normal(old.get(path, "")) != _normal(new.get(path, ""))
+    ]
+
+
+class RepairMemory:
+    """The successful repairs of all runs, saved as a JSONL file.
+
+    A repair is ``{"signature", "error", "file", "blocks": [{"block", "before", "after"}], "explanation"}``. The same
+    repair appended again counts as another use, the repairs used most often rank first among equal hits.
+    """
+
+    def __init__(self, path: str = ""):
+        self.path = path
+        self.repairs: Dict[str, Dict] = {}
+        self.uses: Dict[str, int] = {}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            for repair in read_records(path):
+                self._put(repair)
+
+    @staticmethod
+    def repair_id(repair: Dict) -> str:
+        return content_hash(json.dumps([repair["signature"], repair["blocks"]], sort_keys=True))
+
+    def _put(self, repair: Dict):
+        repair_id = self.repair_id(repair)
+        self.repairs[repair_id] = repair
+        self.uses[repair_id] = self.uses.get(repair_id, 0) + 1
+
+    def add(self, repair: Dict):
+        with self.lock:
+            self._put(repair)
+            if self.path:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                append_record(self.path, repair)
+
+    def lookup(self, error: str, cards: Dict[str, str], k: int = 3, threshold: float = 0.75) -> List[Dict]:
+        """The repairs of the same or a similar error, best first.
+
+        Returns:
+            list: Copies of the repairs with ``exact`` (the signatures are equal) and ``score`` (the similarity of the
+            signatures, and of the blocks before the repair to the blocks of the same name in ``cards``).
+        """
+        signature = error_signature(error)
+        if not signature:
+            return []
+        current: Dict[str, List[str]] = {}
+        for card in cards.values():
+            for path, text in _blocks(card).items():
+                current.setdefault(path, []).append(_normal(text))
+        hits = []
+        for repair_id, repair in list(self.repairs.items()):
+            exact = repair["signature"] == signature
+            if exact:
+                similarity = 1.0
+            else:
+                matcher = difflib.SequenceMatcher(None, signature, repair["signature"], autojunk=False)
+                if matcher.quick_ratio() < threshold or matcher.ratio() < threshold:
+                    continue
+                similarity = matcher.ratio()
+            snippet = max(
+                (
+                    difflib.SequenceMatcher(None, _normal(block["before"]), text, autojunk=False).ratio()
+                    for block in repair["blocks"]
+                    for text in current.get(block["block"], [])
+                ),
+                default=0.0,
+            )
+            hits.append((exact, similarity, snippet, self.uses[repair_id], repair))
+        hits.sort(key=lambda hit: hit[:4], reverse=True)
+        return [
+            dict(repair, exact=exact, score=round(similarity + snippet, 3))
+            for exact, similarity, snippet, _, repair in hits[:k]
+        ]
+
+    @staticmethod
+    def apply(repair: Dict, cards: Dict[str, str]) -> Optional[Tuple[str, str]]:
+        """Apply a repair to the first card which still has all blocks as they were before the repair.
+
+        Returns:
+            tuple: The file name and the repaired card, None if no card matches.
+        """
+        for file_name, card in cards.items():
+            blocks = _blocks(card)
+            if not blocks or any(_normal(blocks.get(b["block"], "")) != _normal(b["before"]) for b in repair["blocks"]):
+                continue
+            try:
+                for block in repair["blocks"]:
+                    card = replace_block(card, block["block"], block["after"])
+            except HitError:
+                continue
+            return file_name, card
+        return None
+
+
+def format_repairs(repairs: List[Dict]) -> str:
+    """The repairs as a section of the modify prompt."""
+    if not repairs:
+        return ""
+    text = "Here are repairs of the same or similar errors which made earlier runs succeed:\n"
+    for n, repair in enumerate(repairs, 1):
+        text += f"Repair {n} ({'same error' if repair['exact'] else 'similar error'}):\nError: {repair['error']}\n"
+        text += f"Explanation: {repair['explanation']}\n"
+        for block in repair["blocks"]:
+            text += f"Block [{block['block']}] before:\n{block['before'] or '(missing)'}\n"
+            text += f"after:\n{block['after'] or '(deleted)'}\n"
+    return text + "\n"
+
+
+@lru_cache(maxsize=None)
+def get_repair_memory(path: str) -> RepairMemory:
+    """The repair memory of a file, loaded once per process."""
+    return RepairMemory(path)
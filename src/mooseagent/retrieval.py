@@ -0,0 +1,387 @@
+"""Retrieval helpers used on top of the vector stores loaded in helper.py.
+
+Usage:
+    python -m mooseagent.retrieval benchmark [query ...]   # batch_search against one search per query, input cases
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from functools import lru_cache
+from typing import Dict, List
+
+from langchain_core.documents import Document
+from langchain_core.messages import SystemMessage
+from pydantic import BaseModel, Field
+
+from mooseagent.corpus import append_record, read_records
+from mooseagent.moose_modules import module_filter
+from mooseagent.utils import load_chat_model
+
+RERANK_PROMPT = """You are an expert in using the finite element software MOOSE. Rate how useful each of the following MOOSE input cards is as a reference for the search query, from 0 (irrelevant) to 10 (the same simulation).
+<Query>
+{query}
+</Query>
+{cases}
+Return one score for each case, in the order of the cases."""
+
+
+class RerankScoreState(BaseModel):
+    scores: list[float] = Field(description="The score of each case from 0 to 10, in the order of the cases.")
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class Reranker:
+    """Rescore retrieved documents for a query and keep the best ones.
+
+    ``model`` is either ``cross-encoder/<huggingface name>`` for a local cross-encoder running on CPU (needs
+    sentence-transformers), or a chat model name like ``openai/gpt-4o-mini`` which scores a batch of documents in one
+    call. Scores are cached per (query, document hash), at most ``max_entries`` of them, the least recently used are
+    evicted first. The new scores of every query are appended to the JSONL file ``cache_path`` as one line, and the
+    file is compacted when it is loaded with more lines than entries.
+    """
+
+    def __init__(
+        self, model: str, cache_path: str = "", batch_size: int = 10, max_chars: int = 2000, max_entries: int = 50000
+    ):
+        self.model = model
+        self.cache_path = cache_path
+        self.batch_size = batch_size
+        self.max_chars = max_chars
+        self.max_entries = max_entries
+        self.cache: Dict[str, float] = {}
+        self.lock = threading.Lock()
+        if cache_path and os.path.exists(cache_path):
+            lines = 0
+            for record in read_records(cache_path):
+                lines += 1
+                self.put(record["scores"])
+            if lines > 1:
+                self.compact()
+        if model.startswith("cross-encoder/"):
+            from sentence_transformers import CrossEncoder
+
+            self.cross_encoder = CrossEncoder(model.split("/", 1)[1], device="cpu")
+        else:
+            self.cross_encoder = None
+
+    def score(self, query: str, texts: List[str]) -> List[float]:
+        """Score texts which are not in the cache, batch by batch."""
+        if self.cross_encoder is not None:
+            pairs = [(query, text[: self.max_chars]) for text in texts]
+            return [float(s) for s in self.cross_encoder.predict(pairs, batch_size=self.batch_size)]
+        llm = load_chat_model(self.model).with_structured_output(RerankScoreState)
+        scores = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i : i + self.batch_size]
+            cases = "".join(
+                f"<Case {n}>\n{text[: self.max_chars]}\n</Case {n}>\n" for n, text in enumerate(batch, 1)
+            )
+            reply = llm.invoke([SystemMessage(content=RERANK_PROMPT.format(query=query, cases=cases))])
+            batch_scores = list(reply.scores)[: len(batch)]
+            # a missing score ranks the case last instead of failing the retrieval
+            scores += batch_scores + [0.0] * (len(batch) - len(batch_scores))
+        return scores
+
+    def rerank(self, query: str, docs: List[Document], top_k: int) -> List[Document]:
+        """Return the ``top_k`` documents with the highest scores."""
+        query_hash = content_hash(query)
+        keys = [f"{query_hash}:{content_hash(doc.page_content)}" for doc in docs]
+        with self.lock:
+            scores = {key: self.cache[key] for key in keys if key in self.cache}
+            self.put(scores)
+        missing = {key: doc.page_content for key, doc in zip(keys, docs) if key not in scores}
+        if missing:
+            new_scores = dict(zip(missing.keys(), self.score(query, list(missing.values()))))
+            scores.update(new_scores)
+            with self.lock:
+                self.put(new_scores)
+                if self.cache_path:
+                    append_record(self.cache_path, {"scores": new_scores})
+        ranked = sorted(zip(keys, docs), key=lambda item: scores[item[0]], reverse=True)
+        return [doc for _, doc in ranked[:top_k]]
+
+    async def arerank(self, query: str, docs: List[Document], top_k: int) -> List[Document]:
+        return await asyncio.to_thread(self.rerank, query, docs, top_k)
+
+    def put(self, scores: Dict[str, float]):
+        for key, score in scores.items():
+            self.cache.pop(key, None)
+            self.cache[key] = score
+        while len(self.cache) > self.max_entries:
+            self.cache.pop(next(iter(self.cache)))
+
+    def compact(self):
+        """Rewrite the cache file as one line with the entries which are kept."""
+        if self.cache_path:
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps({"scores": self.cache}) + "\n")
+            os.replace(tmp_path, self.cache_path)
+
+
+@lru_cache(maxsize=None)
+def get_reranker(model: str, cache_path: str = "", max_entries: int = 50000) -> Reranker:
+    """Load the reranker once per process, the cross-encoder weights are expensive to load."""
+    return Reranker(model, cache_path, max_entries=max_entries)
+
+
+class QueryCache:
+    """Persistent cache of the generated retrieval query.
+
+    The key is the hash of the file description, the query model and the hash of the query prompt, so a query
+    generated by another model or with an older prompt is generated again instead of reused.
+    """
+
+    def __init__(self, path: str = ""):
+        self.path = path
+        self.queries: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.queries = json.load(f)
+
+    @staticmethod
+    def key(description: str, model: str = "", prompt: str = "") -> str:
+        return content_hash(json.dumps([description.strip(), model, content_hash(prompt)]))
+
+    def get(self, description: str, model: str = "", prompt: str = ""):
+        return self.queries.get(self.key(description, model, prompt))
+
+    def set(self, description: str, query: str, model: str = "", prompt: str = ""):
+        with self.lock:
+            self.queries[self.key(description, model, prompt)] = query
+            if self.path:
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self.queries, f, ensure_ascii=False)
+                os.replace(tmp_path, self.path)
+
+
+@lru_cache(maxsize=None)
+def get_query_cache(path: str = "") -> QueryCache:
+    return QueryCache(path)
+
+
+STOPWORDS = set(
+    """a an the and or of to in on at by for with from as is are be been being this that these those it its into
+    which will should would can could must use using used than then there their such each per all any both not no
+    over under between after before during while where when how what so also may might about above below other
+    simulation simulate case file input card moose model problem task set setting settings based""".split()
+)
+
+
+def extract_keywords(text: str, max_keywords: int = 20) -> List[str]:
+    """Pick the most frequent non-stopword terms of a description, in the order they first appear."""
+    words = [w.strip("-_.") for w in re.findall(r"[A-Za-z][A-Za-z0-9_\-.]*", text.lower())]
+    counts: Dict[str, int] = {}
+    for word in words:
+        if len(word) > 2 and word not in STOPWORDS:
+            counts[word] = counts.get(word, 0) + 1
+    top = sorted(counts, key=lambda w: counts[w], reverse=True)[:max_keywords]
+    return [w for w in counts if w in top]
+
+
+def lexical_score(keywords: List[str], text: str) -> float:
+    """Fraction of the keywords that appear in the text."""
+    if not keywords:
+        return 0.0
+    text = text.lower()
+    return sum(keyword in text for keyword in keywords) / len(keywords)
+
+
+def search(vectordb, query: str, k: int, modules: List[str] = None) -> List[Document]:
+    """Similarity search prefiltered to the documents of ``modules`` (see ``moose_modules``).
+
+    If the filter keeps fewer than ``k`` documents (e.g. a store indexed without the module metadata), the rest is
+    filled up with the best unfiltered hits.
+    """
+    docs = vectordb.similarity_search(query, k=k, filter=module_filter(modules)) if modules else []
+    if len(docs) < k:
+        seen = {doc.page_content for doc in docs}
+        docs += [doc for doc in vectordb.similarity_search(query, k=k) if doc.page_content not in seen][: k - len(docs)]
+    return docs
+
+
+async def asearch(vectordb, query: str, k: int, modules: List[str] = None) -> List[Document]:
+    return await asyncio.to_thread(search, vectordb, query, k, modules)
+
+
+def _allowed(modules: List[str]):
+    return set(module_filter(modules)["module"]["$in"]) if modules else None
+
+
+def _fill(filtered: List[Document], unfiltered: List[Document], k: int) -> List[Document]:
+    """The filtered hits first, filled up to ``k`` with the unfiltered hits (the same as ``search``)."""
+    seen = {doc.page_content for doc in filtered}
+    return filtered[:k] + [doc for doc in unfiltered if doc.page_content not in seen][: k - len(filtered[:k])]
+
+
+def _faiss_batch_search(vectordb, embeddings: List[List[float]], k: int, modules: List[List[str]], shared: Dict):
+    import faiss
+    import numpy as np
+
+    vectors = np.array(embeddings, dtype=np.float32)
+    if vectordb._normalize_L2:
+        faiss.normalize_L2(vectors)
+    # over-fetch like FAISS.similarity_search does when a filter is given
+    fetch_k = max(k, 20) if any(modules) else k
+    _, indices = vectordb.index.search(vectors, fetch_k)
+    results = []
+    for row, query_modules in zip(indices, modules):
+        docs = []
+        for i in row:
+            if i == -1:
+                continue
+            doc_id = vectordb.index_to_docstore_id[i]
+            if doc_id not in shared:
+                shared[doc_id] = vectordb.docstore.search(doc_id)
+            docs.append(shared[doc_id])
+        allowed = _allowed(query_modules)
+        filtered = [doc for doc in docs if allowed is None or doc.metadata.get("module") in allowed]
+        results.append(_fill(filtered, docs[:k], k))
+    return results
+
+
+def _chroma_query(vectordb, embeddings: List[List[float]], k: int, where: Dict, shared: Dict) -> List[List[Document]]:
+    kwargs = {"where": where} if where else {}
+    result = vectordb._collection.query(
+        query_embeddings=embeddings, n_results=k, include=["documents", "metadatas"], **kwargs
+    )
+    results = []
+    for ids, texts, metadatas in zip(result["ids"], result["documents"], result["metadatas"]):
+        for doc_id, text, metadata in zip(ids, texts, metadatas):
+            if doc_id not in shared:
+                shared[doc_id] = Document(page_content=text, metadata=metadata or {})
+        results.append([shared[doc_id] for doc_id in ids])
+    return results
+
+
+def _chroma_batch_search(vectordb, embeddings: List[List[float]], k: int, modules: List[List[str]], shared: Dict):
+    results: List[List[Document]] = [[] for _ in embeddings]
+    # one query call per distinct module filter, a Chroma query has a single where clause
+    groups: Dict[tuple, List[int]] = {}
+    for i, query_modules in enumerate(modules):
+        groups.setdefault(tuple(query_modules or ()), []).append(i)
+    for query_modules, indexes in groups.items():
+        where = module_filter(list(query_modules)) if query_modules else None
+        for i, docs in zip(indexes, _chroma_query(vectordb, [embeddings[i] for i in indexes], k, where, shared)):
+            results[i] = docs
+    short = [i for i, docs in enumerate(results) if modules[i] and len(docs) < k]
+    if short:
+        for i, docs in zip(short, _chroma_query(vectordb, [embeddings[i] for i in short], k, None, shared)):
+            results[i] = _fill(results[i], docs, k)
+    return results
+
+
+def batch_search(vectordb, queries: List[str], k: int, modules: List[List[str]] = None) -> List[List[Document]]:
+    """Search the queries of several files at once, e.g. of all the files of one architect round.
+
+    The distinct queries are embedded in one batch and searched with one multi-query call of the index (Chroma
+    ``collection.query`` or FAISS ``index.search``). A case hit by several files is one shared ``Document``. The
+    results are the same as of ``search`` for every query, including the module filter and its fallback. Other
+    vector stores fall back to one ``search`` per query.
+
+    Returns:
+        list: The documents of every query, in the order of ``queries``.
+    """
+    modules = modules or [[] for _ in queries]
+    distinct = list(dict.fromkeys(zip(queries, (tuple(m or ()) for m in modules))))
+    if not distinct:
+        return []
+    if hasattr(vectordb, "_collection"):
+        backend = _chroma_batch_search
+    elif hasattr(vectordb, "index") and hasattr(vectordb, "index_to_docstore_id"):
+        backend = _faiss_batch_search
+    else:
+        backend = None
+    if backend is None:
+        found = [search(vectordb, query, k, list(query_modules)) for query, query_modules in distinct]
+    else:
+        embeddings = vectordb.embeddings.embed_documents([query for query, _ in distinct])
+        found = backend(vectordb, embeddings, k, [list(query_modules) for _, query_modules in distinct], {})
+    by_query = dict(zip(distinct, found))
+    return [by_query[(query, tuple(m or ()))] for query, m in zip(queries, modules)]
+
+
+async def abatch_search(vectordb, queries: List[str], k: int, modules: List[List[str]] = None):
+    return await asyncio.to_thread(batch_search, vectordb, queries, k, modules)
+
+
+async def keyword_retrieve(vectordb, description: str, k: int, threshold: float, modules: List[str] = None):
+    """Retrieve directly with the keywords of the description, without generating a query with the LLM.
+
+    The hybrid score of the best hit is the mean of its vector relevance score and its lexical keyword overlap.
+    With ``modules`` only the documents of these modules are searched.
+
+    Returns:
+        tuple: ``(query, docs)`` if the hybrid score reaches ``threshold``, else ``(None, None)``.
+    """
+    keywords = extract_keywords(description)
+    if not keywords:
+        return None, None
+    query = " ".join(keywords)
+    kwargs = {"filter": module_filter(modules)} if modules else {}
+    results = await vectordb.asimilarity_search_with_relevance_scores(query, k=k, **kwargs)
+    if not results:
+        return None, None
+    top_doc, top_score = results[0]
+    hybrid = 0.5 * top_score + 0.5 * lexical_score(keywords, top_doc.page_content)
+    if hybrid < threshold:
+        return None, None
+    return query, [doc for doc, _ in results]
+
+
+def benchmark_batch_search(vectordb, queries: List[str], k: int, modules: List[List[str]] = None, repeats: int = 5):
+    """Time ``batch_search`` against one ``search`` per query, and count the hits shared between the queries."""
+    modules = modules or [[] for _ in queries]
+    timings = {"per_query": [], "batch": []}
+    for _ in range(repeats):
+        start_time = time.perf_counter()
+        for query, query_modules in zip(queries, modules):
+            search(vectordb, query, k, query_modules)
+        timings["per_query"].append(time.perf_counter() - start_time)
+        start_time = time.perf_counter()
+        results = batch_search(vectordb, queries, k, modules)
+        timings["batch"].append(time.perf_counter() - start_time)
+    hits = [doc.page_content for docs in results for doc in docs]
+    per_query, batch = min(timings["per_query"]), min(timings["batch"])
+    return {
+        "queries": len(queries),
+        "hits": len(hits),
+        "unique_hits": len(set(hits)),
+        "per_query_seconds": round(per_query, 4),
+        "batch_seconds": round(batch, 4),
+        "speedup": round(per_query / batch, 2) if batch else 0.0,
+    }
+
+
+BENCHMARK_QUERIES = [
+    "phase field solidification of a pure metal with Allen-Cahn and heat conduction",
+    "transient heat conduction in a 2D plate with a Dirichlet boundary",
+    "MultiApp transfer of the temperature from the parent app to a sub app",
+    "sub app solving the phase field equation with the temperature from the parent app",
+]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "benchmark":
+        print(__doc__)
+        sys.exit(1)
+    from mooseagent.configuration import Configuration
+    from mooseagent.helper import load_vector_databases
+    from mooseagent.moose_modules import infer_modules
+
+    queries = sys.argv[2:] or BENCHMARK_QUERIES
+    configuration = Configuration()
+    vectordb_input = load_vector_databases(configuration)[0]
+    print(benchmark_batch_search(vectordb_input, queries, configuration.top_k))
+    print(benchmark_batch_search(vectordb_input, queries, configuration.top_k, [infer_modules(q) for q in queries]))
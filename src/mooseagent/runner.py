@@ -0,0 +1,465 @@
+"""Run MOOSE on the generated input cards."""
+
+import asyncio
+import hashlib
+import json
+import os
+import queue
+import re
+import signal
+import subprocess
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from mooseagent.configuration import Configuration
+from mooseagent.events import log
+from mooseagent.hit import parse
+from mooseagent.utils import check_app
+from mooseagent.validation_server import ValidationClient
+
+
+def moose_command(configuration: Configuration, input_file: str, mpi: int = None, extra_args: List[str] = ()):
+    """Build the ``mpiexec`` command running MOOSE on one input card of ``save_dir``."""
+    return [
+        "mpiexec",
+        "-n",
+        str(mpi or configuration.mpi),
+        configuration.MOOSE_DIR,
+        "-i",
+        os.path.join(configuration.save_dir, input_file),
+        *extra_args,
+    ]
+
+
+_FILE_OUTPUTS = ("exodus", "csv", "vtk", "nemesis", "checkpoint", "gmv", "gnuplot", "tecplot", "xda", "xdr", "json")
+_GENERATED_MESHES = ("GeneratedMesh", "GeneratedMeshGenerator")
+
+
+def reduced_fidelity_args(inpcard: str, num_steps: int = 2, coarsen: int = 4) -> List[str]:
+    """Command-line overrides which run an input card as a quick check, the card itself stays as it is.
+
+    A transient is stopped after ``num_steps`` time steps, ``nx``, ``ny`` and ``nz`` of generated meshes are divided by
+    ``coarsen`` (without ``uniform_refine``), and no output files are written. The console output is kept for the
+    watchdog.
+
+    Returns:
+        list: The ``path=value`` arguments of MOOSE, empty if there is nothing to reduce or the card can not be parsed.
+    """
+    doc = parse(inpcard)
+    if doc.errors:
+        return []
+    args = []
+    executioner = doc.find("Executioner")
+    if executioner is not None and executioner.get("type") == "Transient":
+        steps = executioner.get("num_steps", "")
+        if not steps.isdigit() or int(steps) > num_steps:
+            args.append(f"Executioner/num_steps={num_steps}")
+    mesh = doc.find("Mesh")
+    for block in mesh.walk() if mesh is not None else []:
+        # a [Mesh] without type and file is a GeneratedMesh
+        generated = block.get("type") in _GENERATED_MESHES or (
+            block.path == "Mesh" and block.get("type") is None and block.get("file") is None
+        )
+        for param in block.params:
+            if not param.value.isdigit():
+                continue
+            if param.name == "uniform_refine" and int(param.value) > 0:
+                args.append(f"{block.path}/uniform_refine=0")
+            elif generated and param.name in ("nx", "ny", "nz") and int(param.value) // coarsen >= 1:
+                args.append(f"{block.path}/{param.name}={int(param.value) // coarsen}")
+    outputs = doc.find("Outputs")
+    if outputs is not None:
+        for param in outputs.params:
+            if param.name in _FILE_OUTPUTS and param.value.lower() == "true":
+                args.append(f"Outputs/{param.name}=false")
+        for block in outputs.children:
+            if block.get("type") != "Console":
+                args.append(f"{block.path}/execute_on=none")
+    return args
+
+
+def reduces_the_run(args: List[str]) -> bool:
+    """Whether the overrides cut the time steps or coarsen a generated mesh, so the quick check is much shorter.
+
+    Without them (e.g. a steady card with a mesh file) the quick check solves about the same problem as the full run.
+    """
+    return any(arg.split("=", 1)[0].rsplit("/", 1)[-1] in ("num_steps", "nx", "ny", "nz") for arg in args)
+
+
+def override_error(stderr: str, args: List[str]) -> bool:
+    """Whether the error of a reduced run names one of its overrides, so it says nothing about the input card."""
+    for arg in args:
+        path = arg.split("=", 1)[0]
+        if path in stderr or f"'{path.rsplit('/', 1)[-1]}'" in stderr:
+            return True
+    return False
+
+
+def quick_check_failed(result: subprocess.CompletedProcess, args: List[str]) -> bool:
+    """Whether a reduced run proves the input card wrong, so the full run can be skipped.
+
+    Only an error during the setup (``run_progress`` of ``(1, 0)``) which is not caused by the overrides counts. A
+    failure while solving may come from the coarser mesh or the fewer time steps, so the cards still run in full.
+    """
+    return bool(result.stderr) and run_progress(result) == (1, 0) and not override_error(result.stderr, args)
+
+
+def sub_app_files(inpcard: str) -> List[str]:
+    """Return the input files of the MultiApps used in an input card."""
+    files = []
+    for block in parse(inpcard).walk():
+        files += (block.get("input_files") or "").split()
+    return files
+
+
+async def check_input(configuration: Configuration, input_file: str, files: Dict[str, str] = None) -> str:
+    """Parse and set up one input card with ``--check-input`` without solving it.
+
+    If ``Configuration.validation_socket`` is set, the check is sent to the warm validation server
+    (see validation_server.py) together with ``files``, the other input cards it needs (e.g. MultiApp sub-cards), and
+    ``save_dir``, whose meshes and data files the server links next to the cards. If the server does not answer (e.g.
+    a stale socket of a stopped server), MOOSE checks the card here.
+
+    Returns:
+        str: The error message of MOOSE, empty if the input card passes the check.
+    """
+    if configuration.validation_socket and os.path.exists(configuration.validation_socket):
+        files = dict(files or {})
+        if input_file not in files:
+            with open(os.path.join(configuration.save_dir, input_file), "r", encoding="utf-8") as f:
+                files[input_file] = f.read()
+        try:
+            response = await ValidationClient(configuration.validation_socket).check(
+                files, input_file, configuration.save_dir
+            )
+            return response["stderr"]
+        except (OSError, ValueError) as e:
+            log(f"The validation server at {configuration.validation_socket} does not answer ({e}), check here.")
+    if not os.path.exists(configuration.MOOSE_DIR):
+        return ""
+    process = await asyncio.create_subprocess_exec(
+        *moose_command(configuration, input_file, mpi=1, extra_args=["--check-input"]),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        cwd=configuration.save_dir,
+    )
+    _, stderr = await process.communicate()
+    return stderr.decode("utf-8", errors="replace")
+
+
+def app_advice(cards: Dict[str, str], dp_json: dict) -> str:
+    """The object types of the input cards which are missing from the documentation, as advice for the modify.
+
+    A type missing from the documentation may still be registered in the MOOSE executable, so this never fails a card.
+    """
+    advice = "".join(check_app(card, dp_json) for card in cards.values())
+    if not advice:
+        return ""
+    return f"Advice (the documentation check, not an error of MOOSE):\n{advice}"
+
+
+async def check_card(
+    configuration: Configuration, input_file: str, files: Dict[str, str], dp_json: dict
+) -> Tuple[str, str]:
+    """Check one input card right after it is written, before the simulation runs.
+
+    Only the errors of MOOSE ``--check-input`` are conclusive, the documentation check of ``app_advice`` is advice.
+
+    Returns:
+        tuple: ``(errors, advice)``, both empty if the card passes the checks.
+    """
+    advice = app_advice({input_file: files[input_file]}, dp_json)
+    return await check_input(configuration, input_file, files), advice
+
+
+def binary_identity(executable: str) -> str:
+    """Identify a MOOSE executable by its real path, size and modification time."""
+    path = os.path.realpath(executable)
+    stat = os.stat(path)
+    return f"{path}:{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class RunCache:
+    """Cache of MOOSE run results, keyed by the content of all input cards, the MOOSE executable and the MPI size.
+
+    Only the results which the same cards always give again are cached (see ``cacheable``). Each entry is a small
+    JSON file with the exit status and summaries of stdout/stderr. The least recently used entries are evicted when
+    there are more than ``max_entries`` entries or they take more than ``max_bytes``.
+    """
+
+    def __init__(self, cache_dir: str, max_entries: int = 256, max_bytes: int = 64 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(files: Dict[str, str], executable: str, mpi: int, extra_args: List[str] = ()) -> str:
+        digest = hashlib.sha256()
+        for name in sorted(files):
+            digest.update(name.encode("utf-8") + b"\0" + files[name].encode("utf-8") + b"\0")
+        digest.update(f"{binary_identity(executable)}|{mpi}|{' '.join(extra_args)}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[subprocess.CompletedProcess]:
+        path = os.path.join(self.cache_dir, key + ".json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+        os.utime(path)  # mark as recently used
+        return subprocess.CompletedProcess(entry["args"], entry["returncode"], entry["stdout"], entry["stderr"])
+
+    @staticmethod
+    def cacheable(result: subprocess.CompletedProcess, writes_outputs: bool = True) -> bool:
+        """Whether running the same cards again gives the same result.
+
+        An error of MOOSE during the setup (a wrong input) is deterministic. A failure while solving may be a timeout,
+        the watchdog or the machine, so it is run again. A success is only cached for runs without output files, e.g.
+        the quick check, because a cached success does not write the output files of the simulation.
+        """
+        if result.stderr == "":
+            return result.returncode == 0 and not writes_outputs
+        return "*** ERROR ***" in result.stderr and run_progress(result) == (1, 0)
+
+    def put(
+        self, key: str, result: subprocess.CompletedProcess, writes_outputs: bool = True, summary_chars: int = 20000
+    ) -> bool:
+        """Cache a result if it is ``cacheable``.
+
+        Returns:
+            bool: Whether the result was cached.
+        """
+        if not self.cacheable(result, writes_outputs):
+            return False
+        entry = {
+            "args": result.args,
+            "returncode": result.returncode,
+            # the end of the log has the final residuals or the error message
+            "stdout": result.stdout[-summary_chars:],
+            "stderr": result.stderr[-summary_chars:],
+            "time": time.time(),
+        }
+        path = os.path.join(self.cache_dir, key + ".json")
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+        self.evict()
+        return True
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".json"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:  # evicted by another run at the same time
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+        entries.sort(reverse=True)
+        total = 0
+        for n, (_, size, name) in enumerate(entries):
+            total += size
+            if n >= self.max_entries or total > self.max_bytes:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:
+                    pass
+
+
+_ANSI = re.compile(r"\x1b\[[0-9;]*m")
+_TIME_STEP = re.compile(r"^\s*Time Step\s+(\d+)")
+_NONLINEAR = re.compile(r"^\s*(\d+)\s+Nonlinear \|R\|\s*=\s*(\S+)")
+
+
+class Watchdog:
+    """Follow the output of MOOSE line by line and decide early whether a run failed or succeeded.
+
+    Args:
+        success_steps (int): Stop the run as a success after this many converged time steps, 0 to run to the end.
+        divergence_factor (float): Stop the run if the nonlinear residual grows this much above its initial value.
+        max_failed_solves (int): Stop the run after this many solves in a row that did not converge. A converged solve
+            resets the count, so a transient which cuts its time step and recovers keeps running.
+        timeout (float): Seconds of wall time before the run is stopped, 0 for no limit.
+        fatal_patterns (list): Stop the run as soon as a line contains one of these strings.
+    """
+
+    def __init__(
+        self,
+        success_steps: int = 0,
+        divergence_factor: float = 1e8,
+        max_failed_solves: int = 3,
+        timeout: float = 0,
+        fatal_patterns: List[str] = ("*** ERROR ***", "Segmentation fault", "Aborting"),
+    ):
+        self.success_steps = success_steps
+        self.divergence_factor = divergence_factor
+        self.max_failed_solves = max_failed_solves
+        self.timeout = timeout
+        self.fatal_patterns = list(fatal_patterns)
+        self.converged_steps = 0
+        self.failed_solves = 0
+        self.time_step = 0
+        self.initial_residual = None
+        self.fatal = False  # MOOSE printed an error and is about to print the explanation
+
+    def feed(self, line: str) -> Optional[str]:
+        """Read one line of output.
+
+        Returns:
+            str: ``"success"`` or the reason to stop the run as an error, None to keep running.
+        """
+        line = _ANSI.sub("", line)
+        for pattern in self.fatal_patterns:
+            if pattern in line:
+                self.fatal = True
+                return f"MOOSE reported a fatal error: {line.strip()}"
+        match = _TIME_STEP.match(line)
+        if match:
+            self.time_step = int(match.group(1))
+            return None
+        match = _NONLINEAR.match(line)
+        if match:
+            try:
+                residual = float(match.group(2))
+            except ValueError:
+                residual = float("nan")
+            if residual != residual or residual in (float("inf"), float("-inf")):
+                return f"The nonlinear residual became {match.group(2)} at time step {self.time_step}."
+            if match.group(1) == "0":
+                self.initial_residual = residual
+            elif self.initial_residual and residual > self.divergence_factor * self.initial_residual:
+                return (
+                    f"The nonlinear solve is diverging at time step {self.time_step}: |R| grew from "
+                    f"{self.initial_residual:e} to {residual:e}."
+                )
+            return None
+        if "Solve Converged!" in line:
+            self.converged_steps += 1
+            self.failed_solves = 0
+            if self.success_steps and self.converged_steps >= self.success_steps:
+                return "success"
+        elif "Solve Did NOT Converge!" in line:
+            self.failed_solves += 1
+            if self.failed_solves >= self.max_failed_solves:
+                return (
+                    f"The solve did not converge {self.failed_solves} times in a row (last time step {self.time_step})."
+                )
+        return None
+
+    def on_timeout(self) -> str:
+        if self.converged_steps:
+            return "success"
+        return f"The simulation did not converge a single time step within {self.timeout} seconds."
+
+
+def kill_tree(process: subprocess.Popen, posix: bool = os.name == "posix"):
+    """Kill mpiexec together with its ranks."""
+    try:
+        if posix:
+            # mpiexec and its ranks are in their own process group
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)], capture_output=True)
+    except (ProcessLookupError, OSError):
+        pass
+    if process.poll() is None:
+        process.kill()
+
+
+def run_with_watchdog(
+    command: List[str],
+    watchdog: Watchdog,
+    cwd: str = None,
+    grace_period: float = 2.0,
+    on_line: Callable[[str], None] = None,
+) -> subprocess.CompletedProcess:
+    """Run MOOSE and stop it as soon as the watchdog reaches a verdict. ``on_line`` is called with every output line.
+
+    A run stopped as a success gets an empty stderr and a note of the converged time steps in stdout. A run stopped as
+    an error gets the reason and the last lines of stdout (e.g. the residual history) appended to stderr. A run which
+    exits on its own (e.g. within the grace period after an error) keeps the output of MOOSE as it is.
+    """
+    posix = os.name == "posix"
+    process = subprocess.Popen(
+        command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, cwd=cwd, start_new_session=posix
+    )
+    lines: "queue.Queue" = queue.Queue()
+    stdout, stderr = [], []
+
+    def follow(stream, output):
+        for line in stream:
+            output.append(line)
+            lines.put(line)
+        lines.put(None)
+
+    readers = [
+        threading.Thread(target=follow, args=(process.stdout, stdout), daemon=True),
+        threading.Thread(target=follow, args=(process.stderr, stderr), daemon=True),
+    ]
+    for reader in readers:
+        reader.start()
+    start_time = time.perf_counter()
+    verdict, open_streams, deadline = None, 2, None
+    while open_streams:
+        now = time.perf_counter()
+        if deadline is not None and now >= deadline:
+            break
+        try:
+            line = lines.get(timeout=1 if deadline is None else deadline - now)
+        except queue.Empty:
+            line = ""
+        if line is None:
+            open_streams -= 1
+        elif line and on_line is not None:
+            on_line(line)
+        if line and verdict is None:
+            verdict = watchdog.feed(line)
+            if verdict is not None and not watchdog.fatal:
+                break
+            if verdict is not None:
+                # keep the following lines for a moment, they explain the error
+                deadline = time.perf_counter() + grace_period
+        if verdict is None and watchdog.timeout and time.perf_counter() - start_time > watchdog.timeout:
+            verdict = watchdog.on_timeout()
+            break
+    if deadline is not None:
+        # the output streams may close before MOOSE exits on its own, give it the rest of the grace period
+        try:
+            process.wait(timeout=max(0.0, deadline - time.perf_counter()))
+        except subprocess.TimeoutExpired:
+            pass
+    killed = verdict is not None and process.poll() is None
+    if killed:
+        kill_tree(process, posix)
+    returncode = process.wait()
+    for reader in readers:
+        reader.join(timeout=5)
+    stdout, stderr = "".join(stdout), "".join(stderr)
+    if not killed:
+        return subprocess.CompletedProcess(command, returncode, stdout, stderr)
+    if verdict == "success":
+        stdout += f"\nRan {watchdog.converged_steps} time steps successfully, stopped by the watchdog.\n"
+        return subprocess.CompletedProcess(command, 0, stdout, "")
+    tail = "".join(stdout.splitlines(keepends=True)[-30:])
+    stderr += f"\nStopped by the watchdog: {verdict}\nThe last output of MOOSE:\n{tail}"
+    return subprocess.CompletedProcess(command, returncode or 1, stdout, stderr)
+
+
+def run_progress(result: subprocess.CompletedProcess) -> Tuple[int, int]:
+    """How far a MOOSE run got, comparable between the versions of the input cards.
+
+    Returns:
+        tuple: ``(3, steps)`` for a success, ``(2, steps)`` for a run which failed after it started to solve,
+        ``(1, 0)`` for a run which failed during the setup. ``steps`` is the number of converged solves. Cards which
+        already fail the checks before the run get ``(0, 0)``.
+    """
+    output = _ANSI.sub("", result.stdout + result.stderr)
+    steps = output.count("Solve Converged!")
+    if result.stderr == "":
+        return (3, steps)
+    if steps or any(_TIME_STEP.match(line) for line in output.splitlines()):
+        return (2, steps)
+    return (1, 0)
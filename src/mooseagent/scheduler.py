@@ -0,0 +1,169 @@
+"""Share the CPU cores of the host between the MOOSE runs of all graph threads and processes."""
+
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+from mooseagent.events import log
+from mooseagent.file_lock import lock_file, unlock_file
+from mooseagent.hit import parse
+
+_MESH_PARAMS = ("nx", "ny", "nz", "dim", "uniform_refine")
+
+
+def estimate_elements(inpcard: str) -> Optional[int]:
+    """Estimate the number of elements from the ``[Mesh]`` block of an input card.
+
+    Only generated meshes (``nx``, ``ny``, ``nz`` and ``uniform_refine``) can be estimated.
+
+    Returns:
+        int: The estimated number of elements, None if the mesh size is unknown (e.g. a mesh file).
+    """
+    doc = parse(inpcard)
+    mesh = doc.find("Mesh")
+    if doc.errors or mesh is None:
+        return None
+    params: Dict[str, int] = {}
+    for block in mesh.walk():
+        for param in block.params:
+            if param.name in _MESH_PARAMS and param.value.isdigit():
+                params[param.name] = max(params.get(param.name, 0), int(param.value))
+    sizes = [params[name] for name in ("nx", "ny", "nz") if params.get(name)]
+    if not sizes:
+        return None
+    dim = params.get("dim", len(sizes))
+    return math.prod(sizes) * (2**dim) ** params.get("uniform_refine", 0)
+
+
+class ResourceScheduler:
+    """Queue simulation jobs so that the MOOSE runs on one host never use more ranks than it has cores.
+
+    Every core is a lock file in ``lock_dir``. A job holds one file lock per MPI rank while it runs, so jobs of
+    different processes (e.g. parallel experiment runs) are coordinated as well as jobs of different graph threads.
+    The locks are released by the kernel if a process dies.
+
+    The jobs wait in line: the jobs of one process get a ticket each and are served in the order they were submitted,
+    and only the first job of all processes (the holder of ``queue.lock``) collects free cores, keeping them until it
+    has all it needs. A large job is therefore never starved by smaller jobs which keep taking the cores it waits for.
+
+    Args:
+        lock_dir (str): Directory of the lock files, shared by all processes on the host.
+        total_cores (int): Cores available for simulations, defaults to all cores of the host.
+        metrics_path (str): JSONL file to append the queue time and run time of every job to.
+    """
+
+    def __init__(self, lock_dir: str, total_cores: int = 0, metrics_path: str = "", poll_interval: float = 0.5):
+        self.lock_dir = lock_dir
+        self.total_cores = total_cores or os.cpu_count() or 1
+        self.metrics_path = metrics_path
+        self.poll_interval = poll_interval
+        self.metrics: List[Dict] = []
+        self.lock = threading.Lock()
+        self.turn = threading.Condition()
+        self.next_ticket = 0
+        self.serving = 0
+        os.makedirs(lock_dir, exist_ok=True)
+
+    def clamp(self, ranks: int) -> int:
+        """The number of ranks a job really runs on, at least one and at most all cores."""
+        return max(1, min(ranks, self.total_cores))
+
+    def ranks_for(self, inpcard: str, default: int, elements_per_rank: int) -> int:
+        """Choose the number of MPI ranks from the mesh size of an input card."""
+        elements = estimate_elements(inpcard)
+        if elements is None:
+            return self.clamp(default)
+        return self.clamp(math.ceil(elements / elements_per_rank))
+
+    def try_acquire(self, ranks: int, held: Dict[int, object]):
+        """Lock free cores which are not in ``held`` and add them to it, until it has ``ranks`` cores."""
+        for core in range(self.total_cores):
+            if len(held) == ranks:
+                return
+            if core in held:
+                continue
+            handle = open(os.path.join(self.lock_dir, f"core_{core}.lock"), "w")
+            if lock_file(handle, blocking=False):
+                held[core] = handle
+            else:
+                handle.close()
+
+    @staticmethod
+    def release(handles: List):
+        for handle in handles:
+            unlock_file(handle)
+            handle.close()
+
+    @contextmanager
+    def first_in_line(self):
+        """Wait for the turn of this job, first among the jobs of this process, then among all processes."""
+        with self.turn:
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            self.turn.wait_for(lambda: self.serving == ticket)
+        try:
+            with open(os.path.join(self.lock_dir, "queue.lock"), "w") as handle:
+                lock_file(handle)
+                try:
+                    yield
+                finally:
+                    unlock_file(handle)
+        finally:
+            with self.turn:
+                self.serving += 1
+                self.turn.notify_all()
+
+    @contextmanager
+    def acquire(self, ranks: int, label: str = ""):
+        """Wait in line until ``ranks`` cores are free and hold them while the job runs.
+
+        Yields:
+            int: The number of cores held, ``ranks`` clamped by ``clamp``.
+        """
+        ranks = self.clamp(ranks)
+        submit_time = time.perf_counter()
+        held: Dict[int, object] = {}
+        try:
+            with self.first_in_line():
+                self.try_acquire(ranks, held)
+                while len(held) < ranks:
+                    time.sleep(self.poll_interval)
+                    self.try_acquire(ranks, held)
+        except BaseException:
+            self.release(list(held.values()))
+            raise
+        start_time = time.perf_counter()
+        try:
+            yield ranks
+        finally:
+            self.release(list(held.values()))
+            self.record(
+                {
+                    "label": label,
+                    "ranks": ranks,
+                    "queue_time": round(start_time - submit_time, 3),
+                    "run_time": round(time.perf_counter() - start_time, 3),
+                    "time": time.time(),
+                }
+            )
+
+    def record(self, metric: Dict):
+        with self.lock:
+            self.metrics.append(metric)
+            if self.metrics_path:
+                with open(self.metrics_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(metric) + "\n")
+        log(
+            f"---{metric['label']} ran on {metric['ranks']} ranks, "
+            f"queued {metric['queue_time']}s, ran {metric['run_time']}s---"
+        )
+
+
+@lru_cache(maxsize=None)
+def get_scheduler(lock_dir: str, total_cores: int = 0, metrics_path: str = "") -> ResourceScheduler:
+    return ResourceScheduler(lock_dir, total_cores, metrics_path)
@@ -0,0 +1,314 @@
+"""A local service running the agent graph for several clients at once.
+
+Every request gets its own ``save_dir`` and thread id, so concurrent requests do not overwrite each other's input
+cards. Requests wait in a bounded admission queue: when it is full ``submit`` raises ``ServerBusy`` instead of piling
+up work (backpressure). At most ``workers`` requests run at the same time, the LLM calls of all requests are limited
+per provider, and the MOOSE runs share ``moose_slots`` cores through the ``ResourceScheduler``.
+
+Usage::
+
+    service = GraphService(workers=4, max_queue=16, provider_limits={"openai": 8})
+    await service.start()
+    request_id = await service.submit("Simulate the heat conduction in a 2D plate ...")
+    async for event in service.events(request_id):  # see events.py
+        render(event)
+    state = await service.result(request_id)
+    await service.close()
+"""
+
+import asyncio
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import AsyncCallbackHandler
+
+from mooseagent.configuration import Configuration
+from mooseagent.events import TokenEventHandler, run_log
+from mooseagent.workspace import release_workspace
+
+
+class ServerBusy(RuntimeError):
+    """The admission queue is full, retry later."""
+
+
+class ProviderLimiter(AsyncCallbackHandler):
+    """Limit the number of LLM calls running at the same time for each provider (``ls_provider`` of the model).
+
+    The limits are shared by all requests of the service. It works for the sync calls of nodes running in threads as
+    well as for async calls, and waits without blocking the event loop.
+    """
+
+    run_inline = True
+
+    def __init__(self, limits: Dict[str, int] = None, default_limit: int = 8, poll_interval: float = 0.05):
+        self.limits = limits or {}
+        self.default_limit = default_limit
+        self.poll_interval = poll_interval
+        self.semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self.held: Dict[Any, Tuple[str, threading.BoundedSemaphore]] = {}
+        self.active: Dict[str, int] = {}
+        self.peak: Dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def semaphore(self, provider: str) -> threading.BoundedSemaphore:
+        with self.lock:
+            if provider not in self.semaphores:
+                limit = self.limits.get(provider, self.default_limit)
+                self.semaphores[provider] = threading.BoundedSemaphore(limit)
+            return self.semaphores[provider]
+
+    async def acquire(self, run_id, metadata: Optional[Dict]):
+        provider = (metadata or {}).get("ls_provider", "default")
+        semaphore = self.semaphore(provider)
+        while not semaphore.acquire(blocking=False):
+            await asyncio.sleep(self.poll_interval)
+        with self.lock:
+            self.held[run_id] = (provider, semaphore)
+            self.active[provider] = self.active.get(provider, 0) + 1
+            self.peak[provider] = max(self.peak.get(provider, 0), self.active[provider])
+
+    async def release(self, run_id):
+        with self.lock:
+            held = self.held.pop(run_id, None)
+            if held is None:
+                return
+            provider, semaphore = held
+            self.active[provider] -= 1
+        semaphore.release()
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id, metadata=None, **kwargs):
+        await self.acquire(run_id, metadata)
+
+    async def on_llm_start(self, serialized, prompts, *, run_id, metadata=None, **kwargs):
+        await self.acquire(run_id, metadata)
+
+    async def on_llm_end(self, response, *, run_id, **kwargs):
+        await self.release(run_id)
+
+    async def on_llm_error(self, error, *, run_id, **kwargs):
+        await self.release(run_id)
+
+
+class ServiceRequest:
+    """One request of a client and its progress."""
+
+    def __init__(self, request_id: str, inputs: Dict, configurable: Dict, save_dir: str):
+        self.request_id = request_id
+        self.inputs = inputs
+        self.configurable = configurable
+        self.save_dir = save_dir
+        self.status = "queued"  # queued, running, done, failed, cancelled
+        self.submit_time = time.perf_counter()
+        self.start_time = None
+        self.end_time = None
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.result: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.task: Optional[asyncio.Task] = None
+
+
+class GraphService:
+    """Run the compiled graph for many requests with bounded queueing and concurrency.
+
+    Args:
+        graph: The compiled graph, defaults to ``mooseagent.graph.graph`` (loaded on start).
+        work_root (str): Each request runs in ``work_root/<request id>``.
+        workers (int): The number of requests running at the same time.
+        max_queue (int): The number of requests waiting to run before ``submit`` raises ``ServerBusy``.
+        provider_limits (dict): The number of LLM calls running at the same time per provider, e.g. ``{"openai": 8}``.
+        default_provider_limit (int): The limit of the providers not in ``provider_limits``.
+        moose_slots (int): The cores shared by the MOOSE runs of all requests, 0 for the ``max_cores`` setting.
+        configurable (dict): Configuration shared by all requests, overridden by the one of each request. The helper,
+            its vector stores and the online index follow the configuration of each request.
+    """
+
+    def __init__(
+        self,
+        graph=None,
+        work_root: str = os.path.join(tempfile.gettempdir(), "mooseagent_requests"),
+        workers: int = 4,
+        max_queue: int = 16,
+        provider_limits: Dict[str, int] = None,
+        default_provider_limit: int = 8,
+        moose_slots: int = 0,
+        configurable: Dict = None,
+    ):
+        self.graph = graph
+        self.work_root = work_root
+        self.workers = workers
+        self.max_queue = max_queue
+        self.limiter = ProviderLimiter(provider_limits, default_provider_limit)
+        self.moose_slots = moose_slots
+        self.configurable = configurable or {}
+        self.requests: Dict[str, ServiceRequest] = {}
+        self.queue: asyncio.Queue = None
+        self.worker_tasks: List[asyncio.Task] = []
+        self.dp_jsons: Dict[str, Dict] = {}
+        self.counts = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0, "cancelled": 0}
+
+    async def start(self):
+        if self.graph is None:
+            from mooseagent.graph import graph
+
+            self.graph = graph
+        os.makedirs(self.work_root, exist_ok=True)
+        self.queue = asyncio.Queue(maxsize=self.max_queue)
+        self.worker_tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+
+    async def close(self):
+        for request in self.requests.values():
+            self.cancel(request.request_id)
+        await asyncio.gather(*(r.task for r in self.requests.values() if r.task), return_exceptions=True)
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+
+    def load_dp_json(self, configurable: Dict) -> Dict:
+        """The documentation of the MOOSE objects at the ``dp_json_path`` of a request, loaded once per path."""
+        path = Configuration.from_runnable_config({"configurable": configurable}).dp_json_path
+        if path not in self.dp_jsons:
+            if os.path.exists(path):
+                with open(path, "r", encoding="utf-8") as f:
+                    self.dp_jsons[path] = json.load(f)
+            else:
+                self.dp_jsons[path] = {}
+        return self.dp_jsons[path]
+
+    async def submit(self, requirement: str, dp_json: Dict = None, configurable: Dict = None) -> str:
+        """Queue a request.
+        Returns:
+            str: The id of the request.
+        Raises:
+            ServerBusy: If the admission queue is full.
+        """
+        request_id = uuid.uuid4().hex[:12]
+        save_dir = os.path.join(self.work_root, request_id)
+        configurable = {**self.configurable, **(configurable or {}), "save_dir": save_dir, "thread_id": request_id}
+        if self.moose_slots:
+            configurable["max_cores"] = self.moose_slots
+        dp_json = dp_json if dp_json is not None else self.load_dp_json(configurable)
+        inputs = {"requirement": requirement, "dp_json": dp_json}
+        request = ServiceRequest(request_id, inputs, configurable, save_dir)
+        try:
+            self.queue.put_nowait(request)
+        except asyncio.QueueFull:
+            self.counts["rejected"] += 1
+            raise ServerBusy(f"{self.queue.qsize()} requests are waiting, retry later.")
+        self.requests[request_id] = request
+        self.counts["submitted"] += 1
+        return request_id
+
+    async def work(self):
+        while True:
+            request = await self.queue.get()
+            try:
+                if request.status == "cancelled":
+                    continue
+                request.task = asyncio.create_task(self.run(request))
+                # wait() does not raise when the request (and not the worker) is cancelled
+                await asyncio.wait([request.task])
+            finally:
+                self.queue.task_done()
+
+    async def run(self, request: ServiceRequest):
+        request.status = "running"
+        request.start_time = time.perf_counter()
+        os.makedirs(request.save_dir, exist_ok=True)
+        config = {
+            "configurable": request.configurable,
+            "callbacks": [self.limiter, TokenEventHandler()],
+            "recursion_limit": 10000,
+        }
+        state = None
+        try:
+            with run_log(os.path.join(request.save_dir, "run.log")):
+                async for mode, chunk in self.graph.astream(
+                    request.inputs, config=config, stream_mode=["custom", "values"]
+                ):
+                    if mode == "custom":
+                        request.events.put_nowait(chunk)
+                    else:
+                        state = chunk
+            request.status = "done"
+            request.result.set_result(state)
+        except asyncio.CancelledError:
+            request.status = "cancelled"
+            request.result.cancel()
+        except Exception as e:
+            request.status = "failed"
+            request.result.set_exception(e)
+        finally:
+            if state and state.get("run_id"):
+                # the versions of the cards stay on disk, only the in-memory workspace of the run is dropped
+                configuration = Configuration.from_runnable_config(config)
+                release_workspace(configuration.workspace_dir, state["run_id"], configuration.save_dir)
+            request.end_time = time.perf_counter()
+            self.counts[request.status] += 1
+            request.events.put_nowait(None)
+
+    def cancel(self, request_id: str) -> bool:
+        """Cancel a queued or running request. A node already running in a thread finishes its current step."""
+        request = self.requests.get(request_id)
+        if request is None or request.status in ("done", "failed", "cancelled"):
+            return False
+        if request.task is not None:
+            request.task.cancel()
+        else:
+            request.status = "cancelled"
+            self.counts["cancelled"] += 1
+            request.result.cancel()
+            request.events.put_nowait(None)
+        return True
+
+    async def events(self, request_id: str) -> AsyncIterator[Dict]:
+        """Iterate over the progress events of a request until it ends."""
+        request = self.requests[request_id]
+        while True:
+            event = await request.events.get()
+            if event is None:
+                return
+            yield event
+
+    async def result(self, request_id: str, timeout: float = None) -> Dict:
+        """Wait for the final state of a request."""
+        return await asyncio.wait_for(asyncio.shield(self.requests[request_id].result), timeout)
+
+    def status(self, request_id: str) -> str:
+        return self.requests[request_id].status
+
+    def stats(self) -> Dict:
+        return {**self.counts, "queued": self.queue.qsize(), "peak_llm_calls": dict(self.limiter.peak)}
+
+
+async def load_test(service: GraphService, requirements: List[str], retry_interval: float = 0.1) -> Dict:
+    """Submit all requirements as fast as the service admits them and measure the throughput.
+
+    Use a stub graph or stub models and a fake MOOSE executable to find the saturation throughput of a setting.
+    """
+    start_time = time.perf_counter()
+    request_ids = []
+    for requirement in requirements:
+        while True:
+            try:
+                request_ids.append(await service.submit(requirement))
+                break
+            except ServerBusy:
+                await asyncio.sleep(retry_interval)
+    await asyncio.gather(*(service.result(r) for r in request_ids), return_exceptions=True)
+    elapsed = time.perf_counter() - start_time
+    requests = [service.requests[r] for r in request_ids]
+    latencies = sorted(r.end_time - r.submit_time for r in requests)
+    waits = [r.start_time - r.submit_time for r in requests if r.start_time]
+    return {
+        **service.stats(),
+        "requests": len(requests),
+        "elapsed": round(elapsed, 3),
+        "throughput": len(requests) / elapsed if elapsed else 0.0,
+        "latency_p50": round(latencies[len(latencies) // 2], 3) if latencies else 0.0,
+        "latency_p95": round(latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)], 3) if latencies else 0.0,
+        "queue_wait_mean": round(sum(waits) / len(waits), 3) if waits else 0.0,
+    }
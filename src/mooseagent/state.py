@@ -24,6 +24,11 @@ class FlowState(TypedDict):
     review_count: int  # the number of reviews
     rearchitect_count: int
     history_error: str
+    modify_stats: list[dict]  # completion tokens and latency of each modify iteration
+    success: bool  # the input card runs without error
+    precheck: str  # errors found by checking each input card right after it is written
+    repairs: list[dict]  # the blocks changed by modify, saved to the repair memory if the run succeeds
+    run_id: str  # the versioned input cards of this run, see workspace.py
 
 
 class OneFileState(TypedDict):
@@ -84,6 +89,25 @@ class ModifyState(BaseModel):
     code: str = Field(description="The modified code of the input card.")
 
 
+class BlockPatchState(BaseModel):
+    block: str = Field(description="The path of the modified block, e.g. BCs/left or Executioner.")
+    content: str = Field(
+        description="The complete new content of the block including its header and terminator []. Empty to delete the block."
+    )
+
+
+class ModifyPatchState(BaseModel):
+    """
+    The output state of the modify agent in patch mode.
+    """
+
+    filename: str = Field(description="The file name of the input card which has error.")
+    error: str = Field(
+        description="Provide the original error message, explain the reason for the error and the method of modification."
+    )
+    patches: list[BlockPatchState] = Field(description="The modified blocks of the input card.")
+
+
 class QueryState(BaseModel):
     query: str = Field(description="The query to search for relevant information.")
 
@@ -14,7 +14,9 @@ load_dotenv()
 run_path = os.getenv("RUN_PATH")
 sys.path.append(run_path)
 from mooseagent.graph1 import architect_builder, MemorySaver
-from mooseagent.utils import Logger
+from mooseagent.events import log, run_log
+from mooseagent.configuration import Configuration
+from mooseagent.workspace import get_workspace, release_workspace
 
 save_dir: str = "/home/zt/workspace/MooseAgent/run_path"
 
@@ -22,33 +24,54 @@ save_dir: str = "/home/zt/workspace/MooseAgent/run_path"
 class ExperimentStats:
     def __init__(self):
         self.success_count = 0
+        self.first_run_success_count = 0  # success without any modify or re-architecture
         self.total_tokens = []
         self.completion_tokens = []
         self.prompt_tokens = []
         self.code_lengths = []
         self.iteration_counts = []
-
-    def add_run(self, success: bool, tokens: Dict, code_length: int, iterations: int):
+        self.modify_stats = []  # completion tokens and latency of every modify iteration
+
+    def add_run(
+        self,
+        success: bool,
+        tokens: Dict,
+        code_length: int,
+        iterations: int,
+        modify_stats: List[Dict] = None,
+        first_run: bool = False,
+    ):
         if success:
             self.success_count += 1
+            if first_run:
+                self.first_run_success_count += 1
         self.total_tokens.append(tokens["total_tokens"])
         self.completion_tokens.append(tokens["completion_tokens"])
         self.prompt_tokens.append(tokens["prompt_tokens"])
         self.code_lengths.append(code_length)
         self.iteration_counts.append(iterations)
+        self.modify_stats.extend(modify_stats or [])
 
     def get_stats(self, total_runs: int):
+        n_modify = max(len(self.modify_stats), 1)
         return {
             "success_rate": self.success_count / total_runs,
+            "first_run_success_rate": self.first_run_success_count / total_runs,
             "avg_total_tokens": sum(self.total_tokens) / len(self.total_tokens),
             "avg_completion_tokens": sum(self.completion_tokens) / len(self.completion_tokens),
             "avg_prompt_tokens": sum(self.prompt_tokens) / len(self.prompt_tokens),
             "avg_code_length": sum(self.code_lengths) / len(self.code_lengths),
             "avg_iterations": sum(self.iteration_counts) / len(self.iteration_counts),
+            "avg_modify_completion_tokens": sum(m["completion_tokens"] for m in self.modify_stats) / n_modify,
+            "avg_modify_latency": sum(m["latency"] for m in self.modify_stats) / n_modify,
+            "modify_patch_ratio": sum(m["mode"] == "patch" for m in self.modify_stats) / n_modify,
+            "avg_helper_rounds": sum(m.get("helper_rounds", 0) for m in self.modify_stats) / n_modify,
+            "modify_memory_ratio": sum(m["mode"] == "memory" for m in self.modify_stats) / n_modify,
+            "avg_repair_hits": sum(m.get("repair_hits", 0) for m in self.modify_stats) / n_modify,
         }
 
 
-async def run_experiment(topic: str, n_runs: int = 5):
+async def run_experiment(topic: str, n_runs: int = 5, configurable: Dict = None):
     stats = ExperimentStats()
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
 
@@ -56,31 +79,33 @@ async def run_experiment(topic: str, n_runs: int = 5):
     experiment_dir = os.path.join(run_path, f"experiments/{timestamp}")
     os.makedirs(experiment_dir, exist_ok=True)
 
-    config = {"configurable": {"thread_id": "1"}, "recursion_limit": 10000}
+    # every run gets its own directory save_dir/<run_id>, see workspace.py
+    config = {
+        "configurable": {"thread_id": "1", "save_dir": save_dir, **(configurable or {})},
+        "recursion_limit": 10000,
+    }
+    configuration = Configuration.from_runnable_config(config)
     dp_json_path = "database/dp.json"
     with open(os.path.join(run_path, dp_json_path), "r", encoding="utf-8") as file:
         dp_json = json.load(file)
     for i in range(n_runs):
-        subprocess.run(["rm", "-r", os.path.join(save_dir)])
         # 为每次运行创建单独的日志文件
-        run_log = os.path.join(experiment_dir, f"run_{i+1}.log")
-        sys.stdout = Logger(run_log)
-        print(f"\nStarting run {i+1}/{n_runs}")
+        log_path = os.path.join(experiment_dir, f"run_{i+1}.log")
         # memory = MemorySaver()
         graph = architect_builder.compile()
         try:
-            with get_openai_callback() as cb:
+            with get_openai_callback() as cb, run_log(log_path, echo=True):
+                log(f"\nStarting run {i+1}/{n_runs}")
                 result = await graph.ainvoke({"requirement": topic, "dp_json": dp_json}, config=config)
 
                 # 计算代码总长度
-                code_length = 0
-                for file in result["file_list"]:
-                    with open(os.path.join(save_dir, file.file_name), "r") as f:
-                        code_length += len(f.read())
+                workspace = get_workspace(configuration.workspace_dir, result["run_id"], configuration.save_dir)
+                code_length = sum(len(workspace.read(file.file_name)) for file in result["file_list"])
+                release_workspace(configuration.workspace_dir, result["run_id"], configuration.save_dir)
 
                 # 收集统计数据
                 stats.add_run(
-                    success=(result.get("run_result") == "success"),
+                    success=result.get("success", False),
                     tokens={
                         "total_tokens": cb.total_tokens,
                         "completion_tokens": cb.completion_tokens,
@@ -88,13 +113,13 @@ async def run_experiment(topic: str, n_runs: int = 5):
                     },
                     code_length=code_length,
                     iterations=result.get("review_count", 0),
+                    modify_stats=result.get("modify_stats", []),
+                    first_run=result.get("review_count", 0) == 0 and result.get("rearchitect_count", 1) == 1,
                 )
 
         except Exception as e:
             print(f"Error in run {i+1}: {str(e)}")
             continue
-        finally:
-            sys.stdout = sys.__stdout__
 
     # 计算并保存统计结果
     results = stats.get_stats(n_runs)
@@ -112,6 +137,9 @@ async def run_experiment(topic: str, n_runs: int = 5):
 if __name__ == "__main__":
     for i in range(7, 9):
         with open(os.path.join(run_path, "database/cases", f"case{i+1}.txt"), "r") as f:
-            topic = f.read() + "\n" + "You can make the settings a bit rougher to speed up the simulation."
+            # the quick check (reduced_fidelity) finds the errors fast, the card keeps the resolution of the case
+            topic = f.read()
             print("current topic: \n", topic)
-            asyncio.run(run_experiment(topic, n_runs=5))
+            # plain top-k retrieval vs. over-fetch and rerank
+            for rerank in (False, True):
+                asyncio.run(run_experiment(topic, n_runs=5, configurable={"rerank": rerank}))
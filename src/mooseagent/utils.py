@@ -1,29 +1,23 @@
 """Utility & helper functions."""
 
 import re
-from langchain.chat_models import init_chat_model
-from langchain_core.language_models import BaseChatModel
-from langchain_core.messages import BaseMessage
-from typing import Dict, List
+from typing import TYPE_CHECKING, Dict, List
 from datetime import datetime
-import requests
 import os, sys
 import ast
-from langchain_openai import ChatOpenAI
-from langchain_deepseek import ChatDeepSeek
-from typing import List
 import warnings
 
-try:
-    import torch
-    from transformers import AutoTokenizer, AutoModel
-except:
-    warnings.warn("Please install torch and transformers to use BGE_M3_EmbeddingFunction in local.", UserWarning)
-# from langchain_core.embeddings import Embeddings
-from langchain.embeddings.base import Embeddings
+from langchain_core.embeddings import Embeddings
 
+# 模型供应商和本地推理后端在第一次使用时才导入，只需要 check_app 等工具函数时不必加载它们
+if TYPE_CHECKING:
+    from langchain_core.language_models import BaseChatModel
+    from langchain_core.messages import BaseMessage
 
-def get_message_text(msg: BaseMessage) -> str:
+from mooseagent.hit import object_types, parse
+
+
+def get_message_text(msg: "BaseMessage") -> str:
     """Get the text content of a message."""
     content = msg.content
     if isinstance(content, str):
@@ -35,7 +29,7 @@ def get_message_text(msg: BaseMessage) -> str:
         return "".join(txts).strip()
 
 
-def load_chat_model(fully_specified_name: str, temperature: float = 0.01) -> BaseChatModel:
+def load_chat_model(fully_specified_name: str, temperature: float = 0.01) -> "BaseChatModel":
     """Load a chat model from a fully specified name.
 
     Args:
@@ -43,6 +37,8 @@ def load_chat_model(fully_specified_name: str, temperature: float = 0.01) -> Bas
     """
     provider, model = fully_specified_name.split("/", maxsplit=1)
     if provider == "siliconflow":
+        from langchain_openai import ChatOpenAI
+
         try:
             llm = ChatOpenAI(
                 model=model,  # 或者换成你对应的模型
@@ -54,6 +50,8 @@ def load_chat_model(fully_specified_name: str, temperature: float = 0.01) -> Bas
         except Exception as e:
             raise ValueError(f"SILICONFLOW_API_KEY 错误，请检查 .env 文件。{e}")
     elif provider == "huoshan":
+        from langchain_deepseek import ChatDeepSeek
+
         try:
             llm = ChatDeepSeek(
                 model=model,  # 或者换成你对应的模型
@@ -65,6 +63,8 @@ def load_chat_model(fully_specified_name: str, temperature: float = 0.01) -> Bas
         except Exception as e:
             raise ValueError(f"HUOSHAN_API_KEY 错误，请检查 .env 文件。{e}")
     else:
+        from langchain.chat_models import init_chat_model
+
         return init_chat_model(model, model_provider=provider, temperature=temperature)
 
 
@@ -97,7 +97,7 @@ def combine_code_with_description(description: str, code: str) -> str:
     返回:
         str: 合并后的字符串，描述在前，代码在后。
     """
-    if "Created by: MooseAgent" not in code:
+    if not any("Created by: MooseAgent" in line for line in parse(code).leading_comments()):
         # 创建创作者信息
         current_date = datetime.now().strftime("%Y-%m-%d")
         creator_info = f"# Created by: MooseAgent\n# Date: {current_date}\n"
@@ -210,10 +210,17 @@ class BGE_M3_EmbeddingFunction(Embeddings):
         self,
         use_local_model: bool = True,
         local_model_name_or_path: str = "BAAI/bge-m3",  # 根据你实际需要的模型名称/路径调整
+        max_items: int = 64,
+        max_tokens: int = 8000,
+        concurrency: int = 4,
+        max_retries: int = 5,
+        timeout: float = 60,
     ):
         """
         :param use_local_model: 是否使用本地模型。True 时将使用本地模型，False 时走远程 API
         :param local_model_name_or_path: 本地模型的 Hugging Face repo 名或本地路径
+        :param max_items, max_tokens: 远程 API 每个请求的最大文本数和 token 数，超出时拆分为多个请求
+        :param concurrency, max_retries, timeout: 同时发送的请求数，429/5xx 的重试次数，请求超时（秒）
         """
 
         self.use_local_model = use_local_model
@@ -221,12 +228,21 @@ class BGE_M3_EmbeddingFunction(Embeddings):
         if self.use_local_model:
             try:
                 # 如果在本地推理，这里加载本地模型
+                import torch
+                from transformers import AutoTokenizer, AutoModel
+
                 self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
                 # 根据 BGE 模型加载对应的 tokenizer、model
                 self.tokenizer = AutoTokenizer.from_pretrained(local_model_name_or_path)
                 self.model = AutoModel.from_pretrained(local_model_name_or_path)
                 self.model.to(self.device)
                 self.model.eval()
+            except ImportError:
+                self.use_local_model = False
+                warnings.warn(
+                    "Please install torch and transformers to use BGE_M3_EmbeddingFunction in local. Using remote.",
+                    UserWarning,
+                )
             except:
                 self.use_local_model = False
                 warnings.warn("Local BGE-M3 is not supported. Using remote instead.", UserWarning)
@@ -239,6 +255,18 @@ class BGE_M3_EmbeddingFunction(Embeddings):
             self.model_name = os.getenv("EMBEDDING_MODEL")
             if not self.model_name:
                 raise ValueError("未能获取到 EMBEDDING_MODEL 环境变量，请检查 .env 文件。")
+            from mooseagent.embedding_client import EmbeddingClient
+
+            self.client = EmbeddingClient(
+                self.api_url,
+                self.api_key,
+                self.model_name,
+                max_items=max_items,
+                max_tokens=max_tokens,
+                concurrency=concurrency,
+                max_retries=max_retries,
+                timeout=timeout,
+            )
 
     def embed_documents(self, texts: List[str]) -> List[List[float]]:
         if self.use_local_model:
@@ -254,6 +282,8 @@ class BGE_M3_EmbeddingFunction(Embeddings):
         """
         使用本地模型把单条文本转为向量
         """
+        import torch
+
         inputs = self.tokenizer(text, padding=True, truncation=True, return_tensors="pt").to(self.device)
 
         with torch.no_grad():
@@ -277,17 +307,28 @@ class BGE_M3_EmbeddingFunction(Embeddings):
 
     def _embed_remote(self, texts: List[str]) -> List[List[float]]:
         """
-        走远程服务，把文本发给 API 并返回 embedding
+        走远程服务，把文本分块并发发给 API 并按原顺序返回 embedding
         """
-        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
-        data = {"model": self.model_name, "input": texts, "encoding_format": "float"}
-        response = requests.post(self.api_url, json=data, headers=headers)
-        response.raise_for_status()
+        return self.client.embed(texts)
+
 
-        # 取 data 字段再取 embedding
-        embeddings = response.json()["data"]
-        embeddings = [item["embedding"] for item in embeddings]
-        return embeddings
+def load_embedding_function(configuration) -> Embeddings:
+    """Create the embedding function chosen by ``Configuration.embedding_function``."""
+    if configuration.embedding_function == "OPENAI":
+        from langchain_openai import OpenAIEmbeddings
+
+        return OpenAIEmbeddings()
+    if configuration.embedding_function == "BGE_M3_ONNX":
+        from mooseagent.onnx_embedding import ONNXEmbeddingFunction
+
+        return ONNXEmbeddingFunction(configuration.onnx_model_dir)
+    return BGE_M3_EmbeddingFunction(
+        max_items=configuration.embedding_max_items,
+        max_tokens=configuration.embedding_max_tokens,
+        concurrency=configuration.embedding_concurrency,
+        max_retries=configuration.embedding_max_retries,
+        timeout=configuration.embedding_timeout,
+    )
 
 
 def check_app(inpcard: str, dp_json: dict):
@@ -299,16 +340,8 @@ def check_app(inpcard: str, dp_json: dict):
     """
     # 检查inpcard中是否存在app
     # find the documentation of the app used in the input card
-    app_list = []
-    lines = inpcard.splitlines()
-    for line in lines:
-        line = line.replace(" type=", " type =")
-        if " type =" in line:
-            # 提取app名称，假设格式为 type = <appname>
-            app_name = line.split(" type =")[-1].strip().split()[0]
-            app_list.append(app_name)
     feedback = ""
-    for app in app_list:
+    for app in object_types(inpcard):
         doc = dp_json.get(app)
         if doc is None:
             feedback += f"type = {app} is not found in the documentation, please change another application.\n"
@@ -0,0 +1,221 @@
+"""A local service which validates input cards with ``--check-input`` on a pool of warm MOOSE slots.
+
+Starting a large MOOSE application spends most of its time loading the executable and its shared libraries before
+the input card is even parsed. The service keeps those files mapped and resident in the page cache, and serves
+``--check-input`` requests from several graph threads or processes over a unix socket, at most ``pool_size`` at once.
+
+Usage:
+    python validation_server.py <moose executable> <socket path> [pool size]
+
+Protocol: one JSON line per connection ``{"files": {"name.i": "content", ...}, "main": "name.i", "directory": "..."}``,
+answered by one JSON line ``{"returncode": 0, "stdout": "...", "stderr": "...", "elapsed": 0.1}``. The optional
+``directory`` is the run directory of the cards on the same host, its other files (meshes, data files) are linked into
+the slot, so the cards find them by their relative paths.
+"""
+
+import asyncio
+import json
+import mmap
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+
+def shared_libraries(executable: str) -> List[str]:
+    """List the executable and the shared libraries it loads (from ``ldd``, if available)."""
+    files = [os.path.realpath(executable)]
+    try:
+        output = subprocess.run(["ldd", executable], capture_output=True, text=True, timeout=30).stdout
+    except (OSError, subprocess.TimeoutExpired):
+        return files
+    for line in output.splitlines():
+        parts = line.split("=>")
+        path = (parts[1] if len(parts) > 1 else parts[0]).strip().split(" (")[0].strip()
+        if path.startswith("/") and os.path.exists(path):
+            files.append(os.path.realpath(path))
+    return files
+
+
+def link_or_copy(source: str, target: str):
+    """Symlink a file or directory, or copy it where symlinks are not allowed."""
+    try:
+        os.symlink(source, target, target_is_directory=os.path.isdir(source))
+    except OSError:
+        if os.path.isdir(source):
+            shutil.copytree(source, target)
+        else:
+            shutil.copy2(source, target)
+
+
+class ValidationServer:
+    """Validate input cards with ``<executable> --check-input`` on a pool of warm slots.
+
+    Args:
+        executable (str): The MOOSE executable (any executable accepting ``-i <file> --check-input``).
+        socket_path (str): The unix socket to listen on.
+        pool_size (int): The number of checks running at the same time.
+        timeout (float): Seconds before a check is killed.
+        launcher (list): Prefix of the command, e.g. ``["mpiexec", "-n", "1"]``.
+    """
+
+    def __init__(
+        self,
+        executable: str,
+        socket_path: str,
+        pool_size: int = 2,
+        timeout: float = 120,
+        launcher: List[str] = (),
+        refresh_interval: float = 60,
+    ):
+        self.executable = executable
+        self.socket_path = socket_path
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.launcher = list(launcher)
+        self.refresh_interval = refresh_interval
+        self.work_dir = tempfile.mkdtemp(prefix="moose_validation_")
+        self.slots: asyncio.Queue = None
+        self.mapped: List[mmap.mmap] = []
+        self.server = None
+        self.refresher = None
+        self.n_checks = 0
+
+    def warm_up(self):
+        """Map the executable and its libraries and ask the kernel to keep them in the page cache."""
+        for path in shared_libraries(self.executable):
+            try:
+                with open(path, "rb") as f:
+                    mapped = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+            except (OSError, ValueError):
+                continue
+            if hasattr(mapped, "madvise"):
+                mapped.madvise(mmap.MADV_WILLNEED)
+            self.mapped.append(mapped)
+        self.touch()
+
+    def touch(self):
+        """Read one byte per page so that the mapped files stay resident."""
+        for mapped in self.mapped:
+            for offset in range(0, len(mapped), mmap.PAGESIZE):
+                mapped[offset]
+
+    async def keep_warm(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            await asyncio.to_thread(self.touch)
+
+    async def start(self):
+        await asyncio.to_thread(self.warm_up)
+        self.slots = asyncio.Queue()
+        for n in range(self.pool_size):
+            os.makedirs(os.path.join(self.work_dir, f"slot_{n}"), exist_ok=True)
+            self.slots.put_nowait(n)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self.server = await asyncio.start_unix_server(self.handle, path=self.socket_path, limit=2**24)
+        self.refresher = asyncio.create_task(self.keep_warm())
+
+    async def close(self):
+        if self.refresher is not None:
+            self.refresher.cancel()
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for mapped in self.mapped:
+            mapped.close()
+        self.mapped = []
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    async def serve_forever(self):
+        await self.start()
+        print(f"Validation server of {self.executable} listening on {self.socket_path} with {self.pool_size} slots")
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = json.loads(await reader.readline())
+            response = await self.check(request["files"], request["main"], request.get("directory", ""))
+        except Exception as e:
+            response = {"returncode": -1, "stdout": "", "stderr": f"Validation server error: {e}", "elapsed": 0.0}
+        writer.write((json.dumps(response) + "\n").encode("utf-8"))
+        await writer.drain()
+        writer.close()
+
+    async def check(self, files: Dict[str, str], main: str, directory: str = "") -> Dict:
+        slot = await self.slots.get()
+        start_time = time.perf_counter()
+        try:
+            slot_dir = os.path.join(self.work_dir, f"slot_{slot}")
+            for name in os.listdir(slot_dir):
+                path = os.path.join(slot_dir, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            cards = {os.path.basename(name) for name in files}
+            if directory and os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    if name not in cards:
+                        link_or_copy(os.path.join(directory, name), os.path.join(slot_dir, name))
+            for name, content in files.items():
+                with open(os.path.join(slot_dir, os.path.basename(name)), "w", encoding="utf-8") as f:
+                    f.write(content)
+            process = await asyncio.create_subprocess_exec(
+                *self.launcher,
+                self.executable,
+                "-i",
+                os.path.basename(main),
+                "--check-input",
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                cwd=slot_dir,
+            )
+            try:
+                stdout, stderr = await asyncio.wait_for(process.communicate(), self.timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+                stdout, stderr = await process.communicate()
+                stderr += f"\n--check-input did not finish within {self.timeout} seconds.".encode("utf-8")
+            self.n_checks += 1
+            return {
+                "returncode": process.returncode,
+                "stdout": stdout.decode("utf-8", errors="replace"),
+                "stderr": stderr.decode("utf-8", errors="replace"),
+                "elapsed": time.perf_counter() - start_time,
+            }
+        finally:
+            self.slots.put_nowait(slot)
+
+
+class ValidationClient:
+    """Send input cards to a running ``ValidationServer``. One client can be shared by all graph threads."""
+
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+
+    async def check(self, files: Dict[str, str], main: str, directory: str = "") -> Dict:
+        reader, writer = await asyncio.open_unix_connection(self.socket_path, limit=2**24)
+        request = {"files": files, "main": main, "directory": os.path.abspath(directory) if directory else ""}
+        writer.write((json.dumps(request) + "\n").encode("utf-8"))
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        writer.close()
+        await writer.wait_closed()
+        return response
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    pool_size = int(sys.argv[3]) if len(sys.argv) > 3 else 2
+    asyncio.run(ValidationServer(sys.argv[1], sys.argv[2], pool_size).serve_forever())
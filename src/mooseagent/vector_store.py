@@ -0,0 +1,320 @@
+"""Open, grow and compact the Chroma/FAISS vector stores of the cases and the documentation.
+
+``HashIndex`` is the content hash dedup of the indexed documents (``hashes.json`` in the store directory), shared by
+the batch indexing of ``load_vector_database.py`` and the online index. ``OnlineIndex`` adds the input cards of
+successful runs, with their requirement, to the case store that the running graph searches, without a rebuild.
+Every ``compact_every`` added cards a background compaction removes duplicated documents and the documents of learned
+cards which are no longer in the JSONL file of the learned cards, resyncs the hashes with the store and compacts the
+JSONL file.
+"""
+
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List
+
+from mooseagent.corpus import append_record, compact, read_records, record_document
+from mooseagent.events import emit, log
+from mooseagent.file_lock import lock_file, unlock_file
+from mooseagent.retrieval import content_hash
+
+HASHES_FILE = "hashes.json"
+
+
+def store_documents(vectordb) -> Dict[str, str]:
+    """The ids and page contents of all documents of a Chroma or FAISS store."""
+    if hasattr(vectordb, "_collection"):
+        data = vectordb.get(include=["documents"])
+        return dict(zip(data["ids"], data["documents"]))
+    return {doc_id: doc.page_content for doc_id, doc in vectordb.docstore._dict.items()}
+
+
+def store_metadatas(vectordb) -> Dict[str, Dict]:
+    """The ids and metadata of all documents of a Chroma or FAISS store."""
+    if hasattr(vectordb, "_collection"):
+        data = vectordb.get(include=["metadatas"])
+        return {doc_id: metadata or {} for doc_id, metadata in zip(data["ids"], data["metadatas"])}
+    return {doc_id: doc.metadata for doc_id, doc in vectordb.docstore._dict.items()}
+
+
+class HashIndex:
+    """The content hashes of the documents in a vector store, saved as ``hashes.json`` next to it.
+
+    If the file is missing, the hashes are computed from the documents of ``vectordb``.
+    """
+
+    def __init__(self, directory: str, vectordb=None):
+        self.path = os.path.join(directory, HASHES_FILE)
+        self.hashes = set()
+        if not self.load() and vectordb is not None:
+            self.hashes = {content_hash(text) for text in store_documents(vectordb).values()}
+
+    def load(self) -> bool:
+        """Read the hashes saved by any process, False if there is no file yet."""
+        if not os.path.exists(self.path):
+            return False
+        with open(self.path, "r") as f:
+            self.hashes = set(json.load(f))
+        return True
+
+    def new(self, docs: Iterable) -> List:
+        """The documents which are not in the store yet, each content once."""
+        new, hashes = [], set()
+        for doc in docs:
+            doc_hash = content_hash(doc.page_content)
+            if doc_hash not in self.hashes and doc_hash not in hashes:
+                new.append(doc)
+                hashes.add(doc_hash)
+        return new
+
+    def add(self, docs: Iterable):
+        self.hashes.update(content_hash(doc.page_content) for doc in docs)
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(list(self.hashes), f)
+        os.replace(tmp_path, self.path)
+
+
+def open_store(vector_type: str, directory: str, embedding_function):
+    """Open the store in ``directory``, or None if it does not exist yet."""
+    if vector_type.lower() == "chroma":
+        if not os.path.exists(directory):
+            return None
+        from langchain_community.vectorstores import Chroma
+
+        return Chroma(persist_directory=directory, embedding_function=embedding_function)
+    if not os.path.exists(os.path.join(directory, "index.faiss")):
+        return None
+    from langchain_community.vectorstores import FAISS
+
+    return FAISS.load_local(directory, embedding_function, allow_dangerous_deserialization=True)
+
+
+def create_store(vector_type: str, directory: str, embedding_function, docs: List):
+    if vector_type.lower() == "chroma":
+        from langchain_community.vectorstores import Chroma
+
+        return Chroma.from_documents(documents=docs, embedding=embedding_function, persist_directory=directory)
+    from langchain_community.vectorstores import FAISS
+
+    return FAISS.from_documents(documents=docs, embedding=embedding_function)
+
+
+def save_store(vectordb, directory: str):
+    if hasattr(vectordb, "_collection"):
+        if hasattr(vectordb, "persist"):
+            vectordb.persist()  # Chroma特有的持久化方法, 新版本的 Chroma 自动持久化
+    else:
+        vectordb.save_local(directory)
+
+
+@contextmanager
+def store_lock(directory: str):
+    """Hold an exclusive lock of the store for all processes on this host while it is written."""
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, ".lock"), "w") as handle:
+        lock_file(handle)
+        try:
+            yield
+        finally:
+            unlock_file(handle)
+
+
+class OnlineIndex:
+    """Add the input cards of successful runs to the case store which the graph searches.
+
+    Args:
+        vectordb: The loaded case store, which is updated in place, so later queries of this process see the cards.
+        directory (str): The directory of the store.
+        learned_path (str): The learned cards are also appended to this JSONL file, so a rebuild keeps them.
+        chunk_mode (str): ``"card"`` or ``"block"``, the same as the store was indexed with.
+        compact_every (int): The number of added cards between two background compactions, 0 for never.
+    """
+
+    def __init__(
+        self, vectordb, directory: str, learned_path: str, chunk_mode: str = "card", compact_every: int = 20
+    ):
+        self.vectordb = vectordb
+        self.directory = directory
+        self.learned_path = learned_path
+        self.chunk_mode = chunk_mode
+        self.compact_every = compact_every
+        self.hashes = HashIndex(directory, vectordb)
+        self.lock = threading.Lock()
+        self.added_since_compaction = 0
+        self.compaction = None
+        self.saved_at = self.mtime()
+
+    def mtime(self) -> float:
+        path = os.path.join(self.directory, "index.faiss")
+        return os.path.getmtime(path) if os.path.exists(path) else 0.0
+
+    def refresh(self):
+        """Catch up with the cards other processes added, before this process writes the store (with the lock).
+
+        Chroma reads and writes the same database, a FAISS store is loaded again if it was saved by another process.
+        """
+        self.hashes.load()
+        if hasattr(self.vectordb, "_collection") or self.mtime() == self.saved_at:
+            return
+        fresh = open_store("faiss", self.directory, self.vectordb.embedding_function)
+        self.vectordb.index = fresh.index
+        self.vectordb.docstore = fresh.docstore
+        self.vectordb.index_to_docstore_id = fresh.index_to_docstore_id
+        self.saved_at = self.mtime()
+
+    def save(self):
+        save_store(self.vectordb, self.directory)
+        self.saved_at = self.mtime()
+
+    def records(self, requirement: str, files: Dict[str, str], descriptions: Dict[str, str]) -> List[Dict]:
+        """The records of the cards of one run, in the format of comment.jsonl, annotated with the requirement.
+
+        A record is named by the hash of its description and card, so a later record of the same name (which replaces
+        it in the learned cards file and the parent store) has the same contents.
+        """
+        from mooseagent.moose_modules import infer_modules
+
+        modules = infer_modules(requirement)
+        records = []
+        for file_name, code in files.items():
+            description = f"{requirement.strip()}\n\n{descriptions.get(file_name, '')}".strip()
+            records.append(
+                {
+                    "input_card_name": f"learned_{content_hash(description + code)[:12]}_{file_name}",
+                    "overall_description": description,
+                    "annotated_input_card": code,
+                    "module": modules[0] if modules else "",
+                }
+            )
+        return records
+
+    def documents(self, records: List[Dict]) -> List:
+        if self.chunk_mode == "block":
+            from mooseagent.chunking import chunk_record, get_parent_store
+            from mooseagent.moose_modules import tag_record
+
+            parents = get_parent_store(self.directory)
+            docs = []
+            for record in records:
+                parents.add(record)
+                docs += chunk_record(record, {"source": self.learned_path, **tag_record(record)})
+            return docs
+        return [record_document(record, self.learned_path) for record in records]
+
+    def learn(self, requirement: str, files: Dict[str, str], descriptions: Dict[str, str] = None) -> int:
+        """Add the verified input cards of a run.
+        Returns:
+            int: The number of new documents, 0 if the same cards were learned before.
+        """
+        records = self.records(requirement, files, descriptions or {})
+        with self.lock, store_lock(self.directory):
+            self.refresh()
+            docs = self.hashes.new(self.documents(records))
+            if not docs:
+                return 0
+            for record in records:
+                append_record(self.learned_path, record)
+            self.vectordb.add_documents(docs)
+            self.save()
+            if self.chunk_mode == "block":
+                from mooseagent.chunking import get_parent_store
+
+                get_parent_store(self.directory).save()
+            self.hashes.add(docs)
+            self.hashes.save()
+            self.added_since_compaction += len(records)
+            compact_now = self.compact_every and self.added_since_compaction >= self.compact_every
+        emit("index_growth", cards=len(records), documents=len(docs))
+        if compact_now:
+            self.compact_in_background()
+        return len(docs)
+
+    def superseded(self, text: str, metadata: Dict, learned: Dict[str, Dict]) -> bool:
+        """Whether a document is of a learned card which is not in the learned cards file (by name) any more."""
+        if metadata.get("source") != self.learned_path:
+            return False
+        if "parent_id" in metadata:
+            return metadata["parent_id"] not in learned
+        try:
+            record = json.loads(text)
+        except ValueError:
+            return False
+        return learned.get(record.get("input_card_name")) != record
+
+    def compact(self) -> Dict:
+        """Compact the learned cards file, remove superseded and duplicated documents and resync the hashes.
+
+        A document is superseded if its learned card is not in the compacted file any more, e.g. replaced by a later
+        record of the same name or removed by hand.
+        """
+        with self.lock, store_lock(self.directory):
+            self.refresh()
+            learned = {}
+            if os.path.exists(self.learned_path):
+                compact(self.learned_path)
+                learned = {record.get("input_card_name"): record for record in read_records(self.learned_path)}
+            metadatas = store_metadatas(self.vectordb)
+            seen, duplicates, superseded = set(), [], []
+            for doc_id, text in store_documents(self.vectordb).items():
+                if self.superseded(text, metadatas.get(doc_id, {}), learned):
+                    superseded.append(doc_id)
+                    continue
+                doc_hash = content_hash(text)
+                if doc_hash in seen:
+                    duplicates.append(doc_id)
+                seen.add(doc_hash)
+            if duplicates or superseded:
+                self.vectordb.delete(duplicates + superseded)
+                self.save()
+            self.hashes.hashes = seen
+            self.hashes.save()
+            self.added_since_compaction = 0
+        stats = {
+            "documents": len(seen),
+            "removed_duplicates": len(duplicates),
+            "removed_superseded": len(superseded),
+            "learned_cards": len(learned),
+        }
+        log(f"Case store compacted: {stats}")
+        return stats
+
+    def compact_in_background(self) -> threading.Thread:
+        """Compact in a daemon thread, unless a compaction is already running."""
+        if self.compaction is None or not self.compaction.is_alive():
+            self.compaction = threading.Thread(target=self.compact, name="compact-case-store", daemon=True)
+            self.compaction.start()
+        return self.compaction
+
+
+_online_indexes: Dict[tuple, OnlineIndex] = {}
+_online_indexes_lock = threading.Lock()
+
+
+def get_online_index(configuration) -> OnlineIndex:
+    """The online index of the case store of ``configuration``, one per store and learned cards file in a process.
+
+    It grows the same store object as the helper of a request with this configuration searches.
+    """
+    from mooseagent.helper import load_vector_databases, store_key
+
+    key = (
+        store_key(configuration),
+        configuration.learned_cases_path,
+        configuration.chunk_mode,
+        configuration.online_compact_every,
+    )
+    with _online_indexes_lock:
+        if key not in _online_indexes:
+            _online_indexes[key] = OnlineIndex(
+                load_vector_databases(configuration)[0],
+                configuration.input_database_path,
+                configuration.learned_cases_path,
+                configuration.chunk_mode,
+                configuration.online_compact_every,
+            )
+        return _online_indexes[key]
@@ -0,0 +1,207 @@
+"""Versioned input cards of every run, kept in a content-addressed store.
+
+The nodes of the graph read and write the input cards of a run in memory through its ``Workspace``. Every architect
+and modify commits a version: the contents go to ``objects/`` of the workspace directory (addressed by their hash,
+shared by all runs), and the manifest of the version (file names to hashes) is appended to
+``runs/<run_id>/versions.jsonl``. MOOSE only sees the cards when they are materialised into ``<save_dir>/<run_id>``,
+so concurrent and consecutive runs never overwrite each other's files.
+
+Every run of the cards records the progress of the version (see ``runner.run_progress``). When a modify makes the run
+fail earlier than a previous version of the same architecture, the workspace rolls back to the version with the
+furthest progress, so the next modify starts from there instead of from the regression.
+"""
+
+import hashlib
+import os
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from mooseagent.corpus import append_record, read_records
+
+VERSIONS_FILE = "versions.jsonl"
+
+
+def new_run_id() -> str:
+    return f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:6]}"
+
+
+class ObjectStore:
+    """File contents by their sha256, one file per content, written once."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def put(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        path = self.path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        return digest
+
+    def get(self, digest: str) -> str:
+        with open(self.path(digest), "r", encoding="utf-8") as f:
+            return f.read()
+
+
+class Workspace:
+    """The input cards of one run, their versions and their materialised directory.
+
+    Args:
+        root (str): The workspace directory with the object store and the version manifests of all runs.
+        run_id (str): The id of the run, the versions of an interrupted run are loaded again.
+        save_dir (str): The cards are materialised into ``save_dir/run_id`` for MOOSE.
+    """
+
+    def __init__(self, root: str, run_id: str, save_dir: str):
+        self.run_id = run_id
+        self.objects = ObjectStore(os.path.join(root, "objects"))
+        self.manifest_path = os.path.join(root, "runs", run_id, VERSIONS_FILE)
+        self.directory = os.path.join(save_dir, run_id)
+        self.files: Dict[str, str] = {}
+        self.versions: List[Dict] = []
+        self.lock = threading.Lock()
+        self._materialised: Dict[str, str] = {}  # file name -> hash on disk
+        if os.path.exists(self.manifest_path):
+            for record in read_records(self.manifest_path):
+                if "files" in record:
+                    self.versions.append(record)
+                else:
+                    self.versions[record["version"]].update(record)
+            if self.versions:
+                self.checkout(self.versions[-1]["version"])
+
+    @property
+    def version(self) -> Optional[int]:
+        """The last committed version, None before the first commit."""
+        return self.versions[-1]["version"] if self.versions else None
+
+    def read(self, name: str) -> str:
+        try:
+            return self.files[name]
+        except KeyError:
+            raise FileNotFoundError(f"{name} does not exist in the workspace of run {self.run_id}.")
+
+    def write(self, name: str, text: str):
+        with self.lock:
+            self.files[name] = text
+
+    def reset(self):
+        """Start a new architecture without cards, the cards of the earlier versions stay in their versions."""
+        with self.lock:
+            self.files = {}
+
+    def _append(self, record: Dict):
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        append_record(self.manifest_path, record)
+
+    def commit(self, stage: str, iteration: int, rearchitect: int = 0) -> int:
+        """Store the current cards as a new version, unless they are the same as the last version.
+
+        Args:
+            stage (str): The node which wrote the cards, e.g. ``architect`` or ``modify``.
+            iteration (int): The modify iteration, 0 for the architect.
+            rearchitect (int): The architecture the cards belong to, versions only roll back to the same one.
+        Returns:
+            int: The version of the cards.
+        """
+        with self.lock:
+            files = {name: self.objects.put(text) for name, text in self.files.items()}
+            last = self.versions[-1] if self.versions else {}
+            if last.get("files") == files and last.get("rearchitect") == rearchitect:
+                return last["version"]
+            record = {
+                "version": len(self.versions),
+                "stage": stage,
+                "iteration": iteration,
+                "rearchitect": rearchitect,
+                "files": files,
+                "time": datetime.now().isoformat(timespec="seconds"),
+            }
+            self.versions.append(record)
+            self._append(record)
+            return record["version"]
+
+    def checkout(self, version: int):
+        """Make a version the current cards."""
+        with self.lock:
+            self.files = {name: self.objects.get(digest) for name, digest in self.versions[version]["files"].items()}
+
+    def materialise(self) -> str:
+        """Write the current cards into the run directory, skipping the files which did not change.
+
+        The cards materialised earlier which are no longer in the workspace (e.g. of an earlier architecture) are
+        removed, the other files of the run directory (e.g. the outputs of MOOSE) are kept.
+
+        Returns:
+            str: The run directory.
+        """
+        with self.lock:
+            os.makedirs(self.directory, exist_ok=True)
+            for name in [name for name in self._materialised if name not in self.files]:
+                path = os.path.join(self.directory, name)
+                if os.path.exists(path):
+                    os.remove(path)
+                del self._materialised[name]
+            for name, text in self.files.items():
+                digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+                path = os.path.join(self.directory, name)
+                if self._materialised.get(name) == digest and os.path.exists(path):
+                    continue
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(text)
+                self._materialised[name] = digest
+            return self.directory
+
+    def set_progress(self, version: int, progress, error: str = ""):
+        """Record how far the run of a version got (see ``runner.run_progress``) and its error."""
+        record = {"version": version, "progress": list(progress), "error": error}
+        with self.lock:
+            self.versions[version].update(record)
+            self._append(record)
+
+    def best(self, rearchitect: int) -> Optional[Dict]:
+        """The version of an architecture which got furthest, the latest of equally far versions."""
+        ran = [v for v in self.versions if v["rearchitect"] == rearchitect and v.get("progress") is not None]
+        return max(ran, key=lambda v: (v["progress"], v["version"]), default=None)
+
+    def rollback(self, rearchitect: int) -> Optional[Dict]:
+        """Go back to the best version of the architecture if the last version got less far.
+
+        Returns:
+            dict: The version rolled back to, None if the last version is the best one.
+        """
+        best = self.best(rearchitect)
+        last = self.versions[-1] if self.versions else None
+        if best is None or last.get("progress") is None or best["progress"] <= last["progress"]:
+            return None
+        self.checkout(best["version"])
+        self.materialise()
+        return best
+
+
+_workspaces: Dict[tuple, Workspace] = {}
+_workspaces_lock = threading.Lock()
+
+
+def get_workspace(root: str, run_id: str, save_dir: str) -> Workspace:
+    """The workspace of a run, kept in memory for the whole run."""
+    key = (root, run_id, save_dir)
+    with _workspaces_lock:
+        if key not in _workspaces:
+            _workspaces[key] = Workspace(root, run_id, save_dir)
+        return _workspaces[key]
+
+
+def release_workspace(root: str, run_id: str, save_dir: str):
+    """Drop the workspace of a finished run from memory, its versions stay on disk."""
+    with _workspaces_lock:
+        _workspaces.pop((root, run_id, save_dir), None)
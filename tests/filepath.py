@@ -1 +1,3 @@
-ABSOLUTE_PATH = "E:/vscode/python/Agent/langgraph_learning/mooseagent/src"
+import os
+
+ABSOLUTE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
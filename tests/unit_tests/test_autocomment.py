@@ -0,0 +1,41 @@
+from tests.filepath import ABSOLUTE_PATH
+import asyncio
+import os
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+os.environ.setdefault("RUN_PATH", ABSOLUTE_PATH)  # autocomment adds it to sys.path
+from mooseagent import autocomment
+from mooseagent.autocomment import WorkQueue, batch_comment
+from mooseagent.corpus import read_records
+
+
+def test_batch_comment_retries_and_resumes(tmp_path, monkeypatch) -> None:
+    cards = []
+    for name, lines in [("a.i", 20), ("b.i", 20), ("short.i", 3), ("c.i", 20)]:
+        path = tmp_path / name
+        path.write_text("[Mesh]\n[]\n" * (lines // 2))
+        cards.append(str(path))
+    (tmp_path / "comment").mkdir()
+    monkeypatch.setattr(autocomment, "COMMENT_PATH", str(tmp_path / "comment.jsonl"))
+    monkeypatch.setattr(autocomment, "done_path", str(tmp_path / "done.txt"))
+    calls = {}
+
+    def rag(state, config):
+        calls[state["input_card_name"]] = calls.get(state["input_card_name"], 0) + 1
+        if state["input_card_name"].endswith("b.i") and calls[state["input_card_name"]] == 1:
+            raise RuntimeError("rate limited")
+        if state["input_card_name"].endswith("c.i"):
+            raise RuntimeError("always fails")
+        return {"rag_info": ""}
+
+    monkeypatch.setattr(autocomment, "rag", rag)
+    monkeypatch.setattr(
+        autocomment, "writer", lambda state, config: {"overall_description": "d", "annotated_input_card": "# c"}
+    )
+    config = {"configurable": {"comment_concurrency": 2, "comment_max_retries": 1, "comment_retry_delay": 0.01}}
+    results = asyncio.run(batch_comment(cards, {}, config))
+    assert results == ["done", "done", "skipped", "failed"]
+    assert len(list(read_records(str(tmp_path / "comment.jsonl")))) == 2
+    # the failed card is the only one left for the next run
+    assert WorkQueue(cards, str(tmp_path / "done.txt")).pending() == [cards[3]]
@@ -0,0 +1,36 @@
+from tests.filepath import ABSOLUTE_PATH
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from mooseagent.retrieval import batch_search, search
+
+FAISS = pytest.importorskip("langchain_community.vectorstores").FAISS
+pytest.importorskip("faiss")
+
+
+class CountingEmbedding(DeterministicFakeEmbedding):
+    calls: int = 0
+
+    def embed_documents(self, texts):
+        self.calls += 1
+        return super().embed_documents(texts)
+
+
+def test_batch_search_matches_per_query_search() -> None:
+    modules = ["phase_field", "heat_transfer", "framework", "solid_mechanics", ""] * 4
+    docs = [Document(page_content=f"case {i}", metadata={"module": m}) for i, m in enumerate(modules)]
+    embedding = CountingEmbedding(size=16)
+    vectordb = FAISS.from_documents(docs, embedding)
+    queries = ["parent app", "sub app", "parent app", "heat"]
+    query_modules = [["phase_field"], ["solid_mechanics", "contact"], ["phase_field"], []]
+    embedding.calls = 0
+    results = batch_search(vectordb, queries, 3, query_modules)
+    assert embedding.calls == 1
+    for query, m, docs in zip(queries, query_modules, results):
+        assert [d.page_content for d in docs] == [d.page_content for d in search(vectordb, query, 3, m)]
+    # the same query of two files shares its hits
+    assert results[0][0] is results[2][0]
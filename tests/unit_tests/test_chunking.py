@@ -0,0 +1,49 @@
+from tests.filepath import ABSOLUTE_PATH
+import json
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+from mooseagent.chunking import ParentStore, chunk_record
+
+CARD = """# heat conduction
+[Mesh]
+  type = GeneratedMesh
+  dim = 2
+  nx = 10
+[]
+[Kernels]
+  [diff]
+    # the heat conduction term
+    type = Diffusion
+    variable = u
+  []
+[]
+[BCs]
+  [left]
+    type = DirichletBC
+    variable = u
+    boundary = left
+    value = 0
+  []
+[]
+"""
+RECORD = {"input_card_name": "heat.i", "overall_description": "Heat conduction in a plate.", "annotated_input_card": CARD}
+
+
+def test_chunks_are_retrieved_as_trimmed_parent_cards() -> None:
+    chunks = chunk_record(RECORD, {"source": "comment.jsonl", "seq_num": 1})
+    assert [c.metadata["block"] for c in chunks] == ["Mesh", "Kernels", "BCs"]
+    assert all(c.page_content.startswith("Input card: heat.i\nDescription: Heat conduction") for c in chunks)
+    other = chunk_record({"name": "Diffusion", "doc": "..."}, {"seq_num": 2})
+    assert len(other) == 1 and "parent_id" not in other[0].metadata
+
+    store = ParentStore()
+    store.add(RECORD)
+    # two chunks of the same card and a whole document, in the order they were retrieved
+    docs = store.parents([chunks[2], other[0], chunks[1]], k=2)
+    assert len(docs) == 2 and docs[1] is other[0]
+    assert docs[0].metadata["blocks"] == ["BCs", "Kernels"]
+    card = json.loads(docs[0].page_content)["annotated_input_card"]
+    assert "boundary = left" in card and "variable = u" in card and "# the heat conduction term" in card
+    assert "nx = 10" not in card and "type = GeneratedMesh" in card and "# heat conduction" in card
+    assert len(store.parents(chunks, k=1)) == 1
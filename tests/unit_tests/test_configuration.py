@@ -1,5 +1,50 @@
-from react_agent.configuration import Configuration
+from tests.filepath import ABSOLUTE_PATH
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+import pytest
+from mooseagent.configuration import Configuration, store_name
+
+SWITCHES = [
+    "run_cache",
+    "watchdog",
+    "prefetch_docs",
+    "filter_by_module",
+    "batch_retrieval",
+    "repair_memory",
+    "repair_memory_apply",
+    "rollback",
+    "reduced_fidelity",
+]
 
 
 def test_configuration_empty() -> None:
     Configuration.from_runnable_config({})
+
+
+@pytest.mark.parametrize("switch", SWITCHES)
+def test_switch_can_be_turned_off(switch, monkeypatch) -> None:
+    configuration = Configuration.from_runnable_config({"configurable": {switch: False}})
+    assert getattr(configuration, switch) is False
+    for value in ("false", "0", "off"):
+        monkeypatch.setenv(switch.upper(), value)
+        assert getattr(Configuration.from_runnable_config({"configurable": {switch: True}}), switch) is False
+    monkeypatch.setenv(switch.upper(), "true")
+    assert getattr(Configuration.from_runnable_config({}), switch) is True
+
+
+def test_environment_values_get_the_type_of_their_field(monkeypatch) -> None:
+    monkeypatch.setenv("MPI", "4")
+    monkeypatch.setenv("WATCHDOG_TIMEOUT", "0")
+    monkeypatch.setenv("WATCHDOG_DIVERGENCE_FACTOR", "1e6")
+    configuration = Configuration.from_runnable_config({"configurable": {"watchdog_timeout": 60.0}})
+    assert configuration.mpi == 4 and configuration.watchdog_timeout == 0.0
+    assert configuration.watchdog_divergence_factor == 1e6
+    monkeypatch.setenv("ROLLBACK", "maybe")
+    with pytest.raises(ValueError):
+        Configuration.from_runnable_config({})
+
+
+def test_the_onnx_embeddings_search_the_bge_m3_stores() -> None:
+    assert store_name("BGE_M3_ONNX") == store_name("BGE_M3_EmbeddingFunction") == "BGE_M3_EmbeddingFunction"
+    assert store_name("OPENAI") == "OPENAI"
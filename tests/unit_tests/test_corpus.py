@@ -0,0 +1,29 @@
+from tests.filepath import ABSOLUTE_PATH
+import json
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+from mooseagent.corpus import append_record, compact, convert_json_to_jsonl, read_records
+
+
+def test_append_read_compact_and_convert(tmp_path) -> None:
+    path = str(tmp_path / "comment.jsonl")
+    append_record(path, {"input_card_name": "a.i", "annotated_input_card": "v1"})
+    # a crash tore the last append
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"input_card_name": "b.i", "annot')
+    append_record(path, {"input_card_name": "c.i", "annotated_input_card": "中文"})
+    append_record(path, {"input_card_name": "a.i", "annotated_input_card": "v2"})
+    assert [r["input_card_name"] for r in read_records(path)] == ["a.i", "c.i", "a.i"]
+
+    assert compact(path) == 2
+    assert [(r["input_card_name"], r["annotated_input_card"]) for r in read_records(path)] == [
+        ("c.i", "中文"),
+        ("a.i", "v2"),
+    ]
+
+    json_path = tmp_path / "comment.json"
+    json_path.write_text(json.dumps([{"input_card_name": "x.i"}, {"input_card_name": "y.i"}]))
+    jsonl_path = convert_json_to_jsonl(str(json_path))
+    assert jsonl_path == str(tmp_path / "comment.jsonl")
+    assert [r["input_card_name"] for r in read_records(jsonl_path)] == ["x.i", "y.i"]
@@ -0,0 +1,23 @@
+from tests.filepath import ABSOLUTE_PATH
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+from mooseagent.docstore import DocStore
+
+DP_JSON = {
+    "DirichletBC": "# DirichletBC\n\nImposes a fixed value on a boundary.\n\n"
+    + "x" * 1600
+    + "\n\n- `value`: The value of the variable on the boundary.\n\n- `preset`: Whether to preset the value.",
+    "Diffusion": "# Diffusion\n\nThe Laplacian operator.",
+}
+
+
+def test_lookup_card_documents_objects_and_their_parameters() -> None:
+    store = DocStore(DP_JSON)
+    inpcard = "[BCs]\n  [left]\n    type = DirichletBC\n    value = 1\n  []\n[]\n[Kernels]\n  [a]\n    type = Foo\n  []\n[]\n"
+    text = store.lookup_card(inpcard)
+    assert "Imposes a fixed value" in text
+    assert "## Parameter value of DirichletBC" in text
+    assert "preset" not in text
+    assert "No documentation is found for: Foo." in text
+    assert "Laplacian" in store.lookup(["Diffusion"])
@@ -0,0 +1,60 @@
+from tests.filepath import ABSOLUTE_PATH
+import json
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(ABSOLUTE_PATH)
+import pytest
+
+from mooseagent.embedding_client import EmbeddingClient, EmbeddingError
+
+
+class StubEmbeddingHandler(BaseHTTPRequestHandler):
+    """Embeds a text as [len(text)]. Every second request is rate limited, batches of more than 3 texts fail."""
+
+    calls = []
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        with self.lock:
+            self.calls.append(body["input"])
+            n = len(self.calls)
+        if "fail" in body["input"]:
+            status, payload = 503, {"error": "unavailable"}
+        elif len(body["input"]) > 3:
+            status, payload = 413, {"error": "too many inputs"}
+        elif n % 2 == 0:
+            status, payload = 429, {"error": "rate limited"}
+        else:
+            # out of order, the client sorts by index
+            data = [{"index": i, "embedding": [float(len(t))]} for i, t in enumerate(body["input"])]
+            status, payload = 200, {"data": data[::-1]}
+        encoded = json.dumps(payload).encode()
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.send_header("Content-Length", str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_embedding_client_chunks_retries_and_keeps_order() -> None:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubEmbeddingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/v1/embeddings"
+    try:
+        client = EmbeddingClient(url, "key", "bge-m3", max_items=3, max_tokens=20, concurrency=4, backoff=0.01)
+        texts = ["a" * n for n in range(1, 12)]
+        assert all(len(chunk) <= 3 for _, chunk in client.chunks(texts))
+        assert client.embed(texts) == [[float(n)] for n in range(1, 12)]
+        stats = client.throughput()
+        assert stats["texts"] == 11 and stats["retries"] > 0 and stats["texts_per_second"] > 0
+        with pytest.raises(EmbeddingError):
+            EmbeddingClient(url, "key", "bge-m3", max_retries=1, backoff=0.01).embed(["fail"])
+    finally:
+        server.shutdown()
@@ -0,0 +1,71 @@
+from tests.filepath import ABSOLUTE_PATH
+import asyncio
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+from typing_extensions import TypedDict
+from langgraph.graph import StateGraph, START, END
+
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.runnables import RunnableConfig
+
+from mooseagent.events import TokenEventHandler, emit, log, run_log, traced
+
+
+class State(TypedDict):
+    name: str
+
+
+async def work(state: State):
+    for n in range(3):
+        log(f"{state['name']} step {n}")
+        await asyncio.sleep(0)
+    emit("simulation_result", success=True, cached=False)
+    return {}
+
+
+def build_graph():
+    builder = StateGraph(State)
+    builder.add_node("simulate", traced("simulate", work))
+    builder.add_edge(START, "simulate")
+    builder.add_edge("simulate", END)
+    return builder.compile()
+
+
+def test_events_are_streamed_and_logged_per_run(tmp_path) -> None:
+    graph = build_graph()
+
+    async def run(name):
+        with run_log(str(tmp_path / f"{name}.log")):
+            return [chunk async for chunk in graph.astream({"name": name}, stream_mode="custom")]
+
+    async def main():
+        return await asyncio.gather(run("a"), run("b"))
+
+    events_a, _ = asyncio.run(main())
+    assert [e["event"] for e in events_a] == ["node_start", "log", "log", "log", "simulation_result", "node_end"]
+    assert events_a[0]["node"] == events_a[-1]["node"] == "simulate"
+    log_a = (tmp_path / "a.log").read_text()
+    assert "a step 2" in log_a and "b step" not in log_a
+    assert "---SIMULATION SUCCEEDED---" in (tmp_path / "b.log").read_text()
+
+
+async def answer(state: State, config: RunnableConfig):
+    reply = await FakeListChatModel(responses=["[Mesh]\n[]\n"]).ainvoke(state["name"], config)
+    return {"name": reply.content}
+
+
+def test_tokens_of_the_models_are_streamed() -> None:
+    builder = StateGraph(State)
+    builder.add_node("architect", traced("architect", answer))
+    builder.add_edge(START, "architect")
+    builder.add_edge("architect", END)
+    graph = builder.compile()
+
+    async def main():
+        config = {"callbacks": [TokenEventHandler()]}
+        return [chunk async for chunk in graph.astream({"name": "a"}, config, stream_mode="custom")]
+
+    events = asyncio.run(main())
+    tokens = [e["text"] for e in events if e["event"] == "token"]
+    assert len(tokens) > 1 and "".join(tokens) == "[Mesh]\n[]\n"
@@ -0,0 +1,180 @@
+from tests.filepath import ABSOLUTE_PATH
+import dataclasses
+import os
+import sys
+import threading
+import time
+from contextvars import ContextVar
+
+os.environ.setdefault("RUN_PATH", ABSOLUTE_PATH)
+sys.path.append(ABSOLUTE_PATH)
+from langchain_core.messages import AIMessage, ToolMessage
+from langchain_core.tools import tool
+from mooseagent import helper
+from mooseagent.helper import Helper
+
+running, peak, calls = [0], [0], []
+lock = threading.Lock()
+request = ContextVar("request", default="")
+
+
+@tool
+def slow_search(query: str) -> str:
+    """Search slowly."""
+    with lock:
+        calls.append(f"{query}@{request.get()}" if request.get() else query)
+        running[0] += 1
+        peak[0] = max(peak[0], running[0])
+    time.sleep(0.2)
+    with lock:
+        running[0] -= 1
+    return f"{query} found"
+
+
+class ScriptedModel:
+    """Answers with the next scripted message and records the tool binding of every call."""
+
+    def __init__(self, replies, supports_none: bool = True):
+        self.replies = list(replies)
+        self.bindings = []
+        self.prompts = []
+        self.supports_none = supports_none
+
+    def bind_tools(self, tools, **kwargs):
+        if kwargs.get("tool_choice") == "none" and not self.supports_none:
+            raise ValueError("tool_choice must be auto, any or a tool name")
+        self.bindings.append(([t.name for t in tools], kwargs))
+        return self
+
+    def invoke(self, messages):
+        self.prompts.append(messages)
+        return self.replies.pop(0)
+
+
+class ScriptedHelper(Helper):
+    def __init__(self, model, **kwargs):
+        super().__init__("openai/scripted", **kwargs)
+        self.model_instance = model
+
+    @property
+    def tools(self) -> dict:
+        return {"slow_search": slow_search}
+
+    def chat_model(self):
+        return self.model_instance
+
+
+def search_call(query: str, n: int) -> dict:
+    return {"name": "slow_search", "args": {"query": query}, "id": f"call_{n}", "type": "tool_call"}
+
+
+def test_tool_calls_run_in_parallel_once_per_session() -> None:
+    calls.clear()
+    peak[0] = 0
+    model = ScriptedModel(
+        [
+            AIMessage(content="", tool_calls=[search_call("heat", 1), search_call("flow", 2), search_call("heat", 3)]),
+            AIMessage(content="", tool_calls=[search_call("flow", 4)]),
+            AIMessage(content="Use HeatConduction."),
+        ]
+    )
+    answer = ScriptedHelper(model, concurrency=4).invoke({"messages": [("user", "heat?")]})
+    assert answer["messages"][-1].content == "Use HeatConduction."
+    assert sorted(calls) == ["flow", "heat"]
+    tool_messages = [m for m in answer["messages"] if isinstance(m, ToolMessage)]
+    assert [m.tool_call_id for m in tool_messages] == ["call_1", "call_2", "call_3", "call_4"]
+    assert peak[0] == 2
+    assert tool_messages[2].content == tool_messages[0].content
+    stats = answer["stats"]
+    assert (stats["rounds"], stats["tool_calls"], stats["cached_tool_calls"], stats["stopped"]) == (2, 2, 2, "")
+
+
+def test_budget_ends_with_an_answer_without_tool_calls() -> None:
+    calls.clear()
+    model = ScriptedModel(
+        [
+            AIMessage(content="", tool_calls=[search_call("heat", 1)]),
+            AIMessage(content="", tool_calls=[search_call("flow", 2)]),
+            AIMessage(content="Use HeatConduction."),
+        ]
+    )
+    answer = ScriptedHelper(model, max_rounds=1).invoke({"messages": [("user", "heat?")]})
+    assert calls == ["heat"]
+    assert answer["stats"]["stopped"] == "rounds" and answer["stats"]["rounds"] == 1
+    assert "budget is used up" in answer["messages"][-2].content
+    assert answer["messages"][-1].content == "Use HeatConduction."
+    # the tools stay bound for the final answer, which may not call them
+    assert model.bindings == [(["slow_search"], {}), (["slow_search"], {"tool_choice": "none"})]
+
+
+def test_final_answer_without_tools_if_the_provider_does_not_support_none() -> None:
+    calls.clear()
+    model = ScriptedModel(
+        [AIMessage(content="", tool_calls=[search_call("heat", 1)]), AIMessage(content="Use HeatConduction.")],
+        supports_none=False,
+    )
+    answer = ScriptedHelper(model, max_rounds=0).invoke({"messages": [("user", "heat?")]})
+    assert answer["messages"][-1].content == "Use HeatConduction."
+    assert model.bindings == [(["slow_search"], {})]
+    prompt = model.prompts[-1]
+    assert [type(m).__name__ for m in prompt[1:]] == ["HumanMessage", "AIMessage", "HumanMessage"]
+    assert prompt[2].content == 'Calling the tools:\nslow_search({"query": "heat"})'
+    assert prompt[3].content.startswith("Result of the tool slow_search:\nThe tool budget is used up")
+
+
+def test_tools_run_in_the_context_of_the_caller() -> None:
+    calls.clear()
+    model = ScriptedModel(
+        [AIMessage(content="", tool_calls=[search_call("heat", 1), search_call("flow", 2)]), AIMessage(content="ok")]
+    )
+    token = request.set("run-1")
+    try:
+        ScriptedHelper(model).invoke({"messages": [("user", "heat?")]})
+    finally:
+        request.reset(token)
+    assert sorted(calls) == ["flow@run-1", "heat@run-1"]
+
+
+def test_tools_are_loaded_again_after_a_failure(monkeypatch) -> None:
+    loads = []
+
+    def load_vector_databases(configuration=None):
+        loads.append(1)
+        if len(loads) == 1:
+            raise OSError("the vector database is not built yet")
+        return None, None
+
+    monkeypatch.setattr(helper, "load_vector_databases", load_vector_databases)
+    monkeypatch.setattr(helper, "_tools", {})
+    assert [t.name for t in helper.get_tools()] == ["lookup_moose_objects"]
+    names = ["lookup_moose_objects", "retrieve_moose_case", "retrieve_moose_dp"]
+    assert [t.name for t in helper.get_tools()] == names
+    assert [t.name for t in helper.get_tools()] == names and len(loads) == 2
+
+
+def test_tools_search_the_stores_of_the_configuration_of_the_helper(monkeypatch) -> None:
+    loaded, searched = [], []
+
+    def load(configuration):
+        loaded.append(configuration.input_database_path)
+        return configuration.input_database_path, configuration.dp_database_path
+
+    def search(vectordb, query, k, modules):
+        searched.append((vectordb, k))
+        return []
+
+    monkeypatch.setattr(helper, "_load_vector_databases", load)
+    monkeypatch.setattr(helper, "_vector_databases", {})
+    monkeypatch.setattr(helper, "_tools", {})
+    monkeypatch.setattr(helper, "search", search)
+    request = dataclasses.replace(helper.configuration, input_database_path="/stores/request", top_k=7)
+    request_helper = Helper("openai/scripted", configuration=request)
+    request_helper.run_tool({"name": "retrieve_moose_case", "args": {"query": "heat"}})
+    Helper("openai/scripted").run_tool({"name": "retrieve_moose_case", "args": {"query": "heat"}})
+    request_helper.run_tool({"name": "retrieve_moose_case", "args": {"query": "flow"}})
+    assert loaded == ["/stores/request", helper.configuration.input_database_path]
+    assert searched == [
+        ("/stores/request", 7),
+        (helper.configuration.input_database_path, helper.configuration.top_k),
+        ("/stores/request", 7),
+    ]
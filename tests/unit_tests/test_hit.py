@@ -0,0 +1,89 @@
+from tests.filepath import ABSOLUTE_PATH
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+import pytest
+
+from mooseagent.hit import HitError, block_spans, object_types, parse, replace_block
+
+INPCARD = """# Created by: MooseAgent
+rho = 8000 # top-level parameter
+
+[Mesh]
+  type = GeneratedMesh
+  dim = 2
+  nx = 10
+  ny = 20
+[]
+
+[BCs]
+  [./left]
+    type = DirichletBC # comment with ] and [
+    variable = u
+    boundary = 'left'
+    value = 0
+  [../]
+  [right]
+    type = NeumannBC
+    boundary = "right
+                top"
+  []
+[]
+"""
+
+
+def test_round_trip_and_structure() -> None:
+    doc = parse(INPCARD)
+    assert str(doc) == INPCARD
+    assert doc.errors == []
+    assert [p.name for p in doc.params] == ["rho"]
+    assert doc.leading_comments() == ["# Created by: MooseAgent"]
+    assert doc.find("BCs/left").get("boundary") == "left"
+    assert doc.find("BCs/right").get("boundary").split() == ["right", "top"]
+    assert object_types(INPCARD) == ["GeneratedMesh", "DirichletBC", "NeumannBC"]
+    spans = block_spans(INPCARD)
+    assert spans["Mesh"] == (3, 8)
+    assert spans["BCs/left"] == (11, 16)
+    assert spans["BCs"] == (10, 22)
+
+
+def test_unchanged_blocks_are_reused() -> None:
+    doc = parse(INPCARD)
+    patched = replace_block(INPCARD, "BCs/left", "[left]\n  type = DirichletBC\n  value = 1\n[]")
+    new_doc = parse(patched)
+    assert new_doc.blocks[0] is doc.blocks[0]
+    assert new_doc.find("BCs/left").get("value") == "1"
+    assert str(new_doc) == patched
+
+
+def test_unbalanced_card() -> None:
+    broken = "[Mesh]\n  type = GeneratedMesh\n[Kernels]\n  [diff]\n    type = Diffusion\n  []\n[]\n"
+    assert parse(broken).errors
+    assert object_types(broken) == ["GeneratedMesh", "Diffusion"]
+    with pytest.raises(HitError):
+        block_spans(broken)
+
+
+def test_replace_insert_and_delete_blocks() -> None:
+    # nested patches keep the indentation of the replaced block
+    patched = replace_block(INPCARD, "BCs/right", "[right]\n  type = NeumannBC\n  value = 2\n[]")
+    assert "  [right]\n    type = NeumannBC\n    value = 2\n  []" in patched
+    assert parse(patched).find("BCs/left").get("value") == "0"
+    # a missing block is inserted into its parent, a top-level block at the end
+    patched = replace_block(INPCARD, "BCs/top", "[top]\n  type = DirichletBC\n[]")
+    assert block_spans(patched)["BCs/top"][1] < block_spans(patched)["BCs"][1]
+    patched = replace_block(INPCARD, "Executioner", "[Executioner]\n  type = Steady\n[]")
+    assert parse(patched).blocks[-1].path == "Executioner"
+    # an empty patch deletes the block
+    patched = replace_block(INPCARD, "Mesh", "")
+    assert "Mesh" not in block_spans(patched) and "BCs/left" in block_spans(patched)
+
+    for path, content in [
+        ("BCs/left", "[right]\n[]"),  # another block
+        ("BCs/left", "[left]\n  type = DirichletBC\n"),  # unbalanced
+        ("BCs/left", "[left]\n[]\n[right]\n[]"),  # two blocks
+        ("Kernels/diff", "[diff]\n[]"),  # the parent does not exist
+        ("Kernels", ""),  # nothing to delete
+    ]:
+        with pytest.raises(HitError):
+            replace_block(INPCARD, path, content)
@@ -0,0 +1,20 @@
+from tests.filepath import ABSOLUTE_PATH
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+import pytest
+
+from mooseagent.import_report import DEFERRED_MODULES, import_time
+
+# the modules which must not be in sys.modules after the import, the wall time depends too much on the machine
+DEFERRED = {
+    "mooseagent.hit": DEFERRED_MODULES + ["langchain_core", "langgraph"],
+    "mooseagent.utils": DEFERRED_MODULES,
+    "mooseagent.graph": DEFERRED_MODULES,
+}
+
+
+@pytest.mark.parametrize("module", list(DEFERRED))
+def test_heavy_modules_are_imported_on_first_use(module) -> None:
+    result = import_time(module, DEFERRED[module])
+    assert result["deferred"] == [], f"{module} imports {result['deferred']} at import time"
@@ -0,0 +1,42 @@
+from tests.filepath import ABSOLUTE_PATH
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+from langchain_core.documents import Document
+
+from mooseagent.moose_modules import infer_modules, tag_record
+from mooseagent.retrieval import search
+
+
+class MetadataStore:
+    """Ranks the documents in order and applies a ``{"module": {"$in": [...]}}`` filter like Chroma and FAISS."""
+
+    def __init__(self, docs):
+        self.docs = docs
+
+    def similarity_search(self, query, k, filter=None):
+        allowed = filter["module"]["$in"] if filter else None
+        return [d for d in self.docs if allowed is None or d.metadata.get("module") in allowed][:k]
+
+
+def test_documents_are_tagged_and_searched_by_module() -> None:
+    card = "[Kernels]\n  [ac]\n    type = AllenCahn\n  []\n[]\n"
+    record = {"input_card_name": "phase_field_solidification.i", "annotated_input_card": card}
+    assert tag_record(record) == {"module": "phase_field", "physics": "phase field", "objects": "AllenCahn"}
+    record["source_path"] = "E:/vscode/moose\\modules\\heat_transfer\\test\\tests\\a.i"
+    assert tag_record(record)["module"] == "heat_transfer"
+    framework_record = {"input_card_name": "kernels_simple_diffusion.i", "annotated_input_card": card}
+    assert tag_record(framework_record)["module"] == "framework"
+    assert infer_modules("Simulate the solidification of a pure metal with a phase field model.") == ["phase_field"]
+    assert infer_modules("Solve a Poisson equation.") == []
+
+    store = MetadataStore(
+        [
+            Document(page_content="mechanics", metadata={"module": "solid_mechanics"}),
+            Document(page_content="phase field", metadata={"module": "phase_field"}),
+            Document(page_content="diffusion", metadata={"module": "framework"}),
+        ]
+    )
+    assert [d.page_content for d in search(store, "q", 2, ["phase_field"])] == ["phase field", "diffusion"]
+    # too few hits in the module, filled up with unfiltered hits
+    assert [d.page_content for d in search(store, "q", 3, ["phase_field"])] == ["phase field", "diffusion", "mechanics"]
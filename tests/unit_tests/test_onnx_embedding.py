@@ -0,0 +1,30 @@
+from tests.filepath import ABSOLUTE_PATH
+import os
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+import pytest
+
+# the parity check needs the fp32 model and an exported int8 model, e.g. BGE_M3_ONNX_DIR=database/bge-m3-onnx
+np = pytest.importorskip("numpy")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("tokenizers")
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+ONNX_DIR = os.getenv("BGE_M3_ONNX_DIR", "")
+if not os.path.exists(os.path.join(ONNX_DIR, "model_int8.onnx")):
+    pytest.skip("Set BGE_M3_ONNX_DIR to the output of onnx_embedding.py export.", allow_module_level=True)
+
+from mooseagent.onnx_embedding import BENCHMARK_TEXTS, ONNXEmbeddingFunction
+
+
+def test_int8_embeddings_agree_with_fp32() -> None:
+    texts = BENCHMARK_TEXTS[:5]
+    tokenizer = transformers.AutoTokenizer.from_pretrained(os.getenv("BGE_M3_MODEL", "BAAI/bge-m3"))
+    model = transformers.AutoModel.from_pretrained(os.getenv("BGE_M3_MODEL", "BAAI/bge-m3")).eval()
+    with torch.no_grad():
+        inputs = tokenizer(texts, padding=True, truncation=True, return_tensors="pt")
+        fp32 = model(**inputs).last_hidden_state[:, 0, :].numpy()
+    int8 = np.array(ONNXEmbeddingFunction(ONNX_DIR).embed_documents(texts))
+    cosine = (fp32 * int8).sum(axis=1) / (np.linalg.norm(fp32, axis=1) * np.linalg.norm(int8, axis=1))
+    assert cosine.min() > 0.98
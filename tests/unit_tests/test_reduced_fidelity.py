@@ -0,0 +1,62 @@
+from tests.filepath import ABSOLUTE_PATH
+import subprocess
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+from mooseagent.runner import override_error, quick_check_failed, reduced_fidelity_args, reduces_the_run
+
+CARD = """[Mesh]
+  type = GeneratedMesh
+  dim = 2
+  nx = 100
+  ny = 2
+  uniform_refine = 1
+[]
+[Executioner]
+  type = Transient
+  end_time = 100
+[]
+[Outputs]
+  exodus = true
+  [csv]
+    type = CSV
+  []
+  [screen]
+    type = Console
+  []
+[]
+"""
+
+
+def test_reduced_fidelity_overrides_leave_the_card_unchanged() -> None:
+    args = reduced_fidelity_args(CARD)
+    assert args == [
+        "Executioner/num_steps=2",
+        "Mesh/nx=25",
+        "Mesh/uniform_refine=0",
+        "Outputs/exodus=false",
+        "Outputs/csv/execute_on=none",
+    ]
+    steady = CARD.replace("Transient", "Steady").replace("GeneratedMesh", "FileMesh").replace("exodus = true", "")
+    assert reduced_fidelity_args(steady) == ["Mesh/uniform_refine=0", "Outputs/csv/execute_on=none"]
+    # the steady card would be solved about in full by the quick check, it is skipped
+    assert reduces_the_run(args) and not reduces_the_run(reduced_fidelity_args(steady))
+    assert reduces_the_run(reduced_fidelity_args(CARD.replace("Transient", "Steady")))
+    assert reduced_fidelity_args("[Mesh]\n  nx = 10\n") == []  # unbalanced
+
+    assert override_error("*** ERROR ***\nThe parameter 'num_steps' is not valid.", args)
+    assert not override_error("*** ERROR ***\nA 'Foo' is not a registered object.", args)
+
+
+def test_only_setup_errors_of_the_quick_check_skip_the_full_run() -> None:
+    args = reduced_fidelity_args(CARD)
+
+    def run(stdout: str, stderr: str = "") -> subprocess.CompletedProcess:
+        return subprocess.CompletedProcess([], 1 if stderr else 0, stdout, stderr)
+
+    assert quick_check_failed(run("Setting up", "*** ERROR ***\nA 'Foo' is not a registered object."), args)
+    assert not quick_check_failed(run("Setting up", "*** ERROR ***\nThe parameter 'num_steps' is not valid."), args)
+    # the coarse mesh may not converge where the full mesh does
+    solving = "Time Step 1\n 0 Nonlinear |R| = 1e-1\n Solve Did NOT Converge!\n"
+    assert not quick_check_failed(run(solving, "*** ERROR ***\nSolve failed, the time step is too small."), args)
+    assert not quick_check_failed(run("Time Step 1\n Solve Converged!\n"), args)
@@ -0,0 +1,51 @@
+from tests.filepath import ABSOLUTE_PATH
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+from mooseagent.repair_memory import RepairMemory, changed_blocks, error_message, error_signature
+
+BROKEN = """[Mesh]
+  type = GeneratedMesh
+  dim = 2
+[]
+[Kernels]
+  [diff]
+    type = HeatDiffusion
+    variable = T
+  []
+[]
+"""
+FIXED = BROKEN.replace("HeatDiffusion", "HeatConduction")
+ERROR = """*** ERROR ***
+/home/run_path/main.i:7.5: A 'HeatDiffusion' is not a registered object.
+
+Stack frames: 12
+"""
+
+
+def test_repairs_are_found_by_signature_and_applied(tmp_path) -> None:
+    assert error_signature(ERROR) == "<file>: A '<name>' is not a registered object."
+    assert error_signature(ERROR.replace("main.i:7.5", "sub.i:21.3")) == error_signature(ERROR)
+    assert "Kernels/*/variable" in error_signature("The following required parameters are missing:\nKernels/diff/variable")
+    blocks = changed_blocks(BROKEN, FIXED)
+    assert [b["block"] for b in blocks] == ["Kernels"]
+
+    path = str(tmp_path / "repairs.jsonl")
+    repair = {
+        "signature": error_signature(ERROR),
+        "error": error_message(ERROR),
+        "file": "main.i",
+        "blocks": blocks,
+        "explanation": "HeatConduction is the kernel of the heat transfer module.",
+    }
+    RepairMemory(path).add(repair)
+    memory = RepairMemory(path)
+    hits = memory.lookup(ERROR, {"heat.i": "# another run\n" + BROKEN})
+    assert len(hits) == 1 and hits[0]["exact"]
+    assert memory.apply(hits[0], {"heat.i": "# another run\n" + BROKEN}) == ("heat.i", "# another run\n" + FIXED)
+    # the block was changed since, the repair is only a hint
+    assert memory.apply(hits[0], {"heat.i": FIXED.replace("variable = T", "variable = u")}) is None
+
+    similar = memory.lookup("*** ERROR ***\nmain.i:4.1: The Kernel 'Foo' is not a registered object.", {})
+    assert len(similar) == 1 and not similar[0]["exact"]
+    assert memory.lookup("The solve did not converge 3 times (last time step 4).", {"heat.i": BROKEN}) == []
@@ -0,0 +1,42 @@
+from tests.filepath import ABSOLUTE_PATH
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+from langchain_core.documents import Document
+from mooseagent.retrieval import Reranker
+
+
+def reranker(path: str, scored: list, max_entries: int = 50000) -> Reranker:
+    reranker = Reranker("openai/fake", path, max_entries=max_entries)
+
+    def score(query, texts):
+        scored.extend(texts)
+        return [float(len(text)) for text in texts]
+
+    reranker.score = score
+    return reranker
+
+
+def test_scores_are_cached_appended_and_evicted(tmp_path) -> None:
+    path = str(tmp_path / "rerank_cache.jsonl")
+    docs = [Document(page_content=text) for text in ("a", "ccc", "bb")]
+    scored = []
+    first = reranker(path, scored)
+    assert [d.page_content for d in first.rerank("heat", docs, 2)] == ["ccc", "bb"]
+    assert [d.page_content for d in first.rerank("heat", docs, 3)] == ["ccc", "bb", "a"]
+    assert scored == ["a", "ccc", "bb"]  # the second query is cached
+    first.rerank("flow", docs[:1], 1)
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 2  # one line per query, the file is not rewritten
+
+    # a new process loads the scores, compacts the file and evicts the least recently used scores beyond the cap
+    scored = []
+    second = reranker(path, scored, max_entries=2)
+    assert len(second.cache) == 2
+    with open(path, encoding="utf-8") as f:
+        assert len(f.readlines()) == 1
+    assert [d.page_content for d in second.rerank("flow", docs[:1], 1)] == ["a"]
+    assert scored == []
+    assert [d.page_content for d in second.rerank("heat", docs, 3)] == ["ccc", "bb", "a"]
+    assert scored == ["a", "ccc"]
+    assert len(second.cache) == 2
@@ -0,0 +1,55 @@
+from tests.filepath import ABSOLUTE_PATH
+import asyncio
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+from langchain_core.documents import Document
+from mooseagent.retrieval import QueryCache, extract_keywords, keyword_retrieve, lexical_score
+
+DESCRIPTION = "Heat conduction in a 2D plate with a heat source, transient heat conduction."
+
+
+class ScoredStore:
+    """A vector store which returns fixed relevance scores and records the filter of the search."""
+
+    def __init__(self, results):
+        self.results = results
+        self.kwargs = None
+
+    async def asimilarity_search_with_relevance_scores(self, query, k, **kwargs):
+        self.kwargs = kwargs
+        return self.results[:k]
+
+
+def test_query_cache_is_keyed_by_description_model_and_prompt(tmp_path) -> None:
+    path = str(tmp_path / "query_cache.json")
+    cache = QueryCache(path)
+    cache.set(" heat plate\n", "heat conduction plate", "openai/gpt-4o", "Prompt {requirements}")
+    assert cache.get("heat plate", "openai/gpt-4o", "Prompt {requirements}") == "heat conduction plate"
+    assert cache.get("heat plate", "openai/gpt-4o-mini", "Prompt {requirements}") is None
+    assert cache.get("heat plate", "openai/gpt-4o", "New prompt {requirements}") is None
+    assert QueryCache(path).get("heat plate", "openai/gpt-4o", "Prompt {requirements}") == "heat conduction plate"
+
+
+def test_keywords_and_lexical_score() -> None:
+    assert extract_keywords(DESCRIPTION) == ["heat", "conduction", "plate", "source", "transient"]
+    assert extract_keywords(DESCRIPTION, max_keywords=2) == ["heat", "conduction"]
+    assert extract_keywords("the simulation of a case") == []
+    assert lexical_score(["heat", "conduction"], "[Kernels]\n  type = HeatConduction\n") == 1.0
+    assert lexical_score(["heat", "plate"], "type = HeatConduction") == 0.5
+    assert lexical_score([], "heat") == 0.0
+
+
+def test_keyword_retrieve_skips_the_query_generation_only_on_a_confident_hit() -> None:
+    hit = Document(page_content="heat conduction of a plate with a heat source, transient")
+    store = ScoredStore([(hit, 0.8), (Document(page_content="other"), 0.3)])
+    query, docs = asyncio.run(keyword_retrieve(store, DESCRIPTION, 2, 0.85, modules=["heat_transfer"]))
+    assert query == "heat conduction plate source transient"
+    assert docs == [hit, store.results[1][0]]
+    assert "filter" in store.kwargs
+    # 0.5 * 0.6 + 0.5 * 1.0 stays below the threshold
+    store = ScoredStore([(hit, 0.6)])
+    assert asyncio.run(keyword_retrieve(store, DESCRIPTION, 2, 0.85)) == (None, None)
+    assert store.kwargs == {}
+    assert asyncio.run(keyword_retrieve(ScoredStore([]), DESCRIPTION, 2, 0.5)) == (None, None)
+    assert asyncio.run(keyword_retrieve(store, "the simulation", 2, 0.5)) == (None, None)
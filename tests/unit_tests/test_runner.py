@@ -0,0 +1,115 @@
+from tests.filepath import ABSOLUTE_PATH
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+sys.path.append(ABSOLUTE_PATH)
+from mooseagent.configuration import Configuration
+from mooseagent.runner import RunCache, Watchdog, app_advice, check_card, run_with_watchdog
+
+CARD = """[Kernels]
+  [diff]
+    type = HeatConduction
+    variable = T
+  []
+  [custom]
+    type = MyAppKernel
+    variable = T
+  []
+[]
+"""
+
+
+def test_documentation_check_is_only_advice(tmp_path) -> None:
+    dp_json = {"HeatConduction": "doc"}
+    advice = app_advice({"main.i": CARD, "sub.i": CARD.replace("MyAppKernel", "HeatConduction")}, dp_json)
+    assert advice.startswith("Advice") and advice.count("MyAppKernel") == 1
+    assert app_advice({"sub.i": CARD.replace("MyAppKernel", "HeatConduction")}, dp_json) == ""
+
+    # without MOOSE the card passes --check-input, the missing type does not fail it
+    configuration = Configuration(MOOSE_DIR=str(tmp_path / "moose-opt"), validation_socket="", save_dir=str(tmp_path))
+    errors, advice = asyncio.run(check_card(configuration, "main.i", {"main.i": CARD}, dp_json))
+    assert errors == "" and "MyAppKernel" in advice
+
+
+def completed(stdout: str, stderr: str = "", returncode: int = None) -> subprocess.CompletedProcess:
+    if returncode is None:
+        returncode = 1 if stderr else 0
+    return subprocess.CompletedProcess(["mpiexec"], returncode, stdout, stderr)
+
+
+def test_run_cache_keeps_only_deterministic_results(tmp_path) -> None:
+    executable = tmp_path / "moose-opt"
+    executable.write_text("binary")
+    files = {"main.i": "[Mesh]\n[]\n", "sub.i": "[Mesh]\n[]\n"}
+    key = RunCache.key(files, str(executable), 1)
+    assert key == RunCache.key(dict(reversed(files.items())), str(executable), 1)
+    assert key != RunCache.key({**files, "sub.i": "[Mesh]\n  dim = 2\n[]\n"}, str(executable), 1)
+    assert key != RunCache.key(files, str(executable), 2)
+    assert key != RunCache.key(files, str(executable), 1, ["Executioner/num_steps=2"])
+    executable.write_text("rebuilt binary")
+    assert key != RunCache.key(files, str(executable), 1)
+
+    cache = RunCache(str(tmp_path / "cache"), max_entries=2)
+    setup_error = completed("Setting up", "*** ERROR ***\nA 'Foo' is not a registered object.")
+    assert cache.put("setup", setup_error)
+    assert cache.get("setup").stderr == setup_error.stderr and cache.get("setup").returncode == 1
+    solve_error = completed("Time Step 1\n 0 Nonlinear |R| = 1e-1\n", "*** ERROR ***\nSolve failed.")
+    assert not cache.put("solve", solve_error)
+    assert not cache.put("mpi", completed("", "mpiexec: command not found", 127))
+    # a success is only reused if the run writes no output files
+    assert not cache.put("full", completed("Solve Converged!"))
+    assert cache.put("quick", completed("Solve Converged!"), writes_outputs=False)
+    assert cache.get("solve") is None and cache.get("full") is None
+
+    # the least recently used entry is evicted
+    os.utime(os.path.join(cache.cache_dir, "setup.json"), (1, 1))
+    assert cache.put("other", setup_error)
+    assert cache.get("setup") is None
+    assert cache.get("quick").stdout == "Solve Converged!" and cache.get("other") is not None
+
+
+def test_watchdog_stops_only_runs_which_keep_failing() -> None:
+    watchdog = Watchdog(max_failed_solves=2, divergence_factor=1e3)
+    log = ["Time Step 1", " 0 Nonlinear |R| = 1.0e-01", " 1 Nonlinear |R| = 5.0e+01", " Solve Did NOT Converge!"]
+    log += ["Time Step 1", " 0 Nonlinear |R| = 1.0e-01", " Solve Converged!"]
+    log += ["Time Step 2", " Solve Did NOT Converge!", "Time Step 2", " Solve Converged!", "Time Step 3"]
+    # a failed solve followed by a converged one is a time step cut, not a failure
+    assert [watchdog.feed(line) for line in log] == [None] * len(log)
+    assert watchdog.converged_steps == 2 and watchdog.failed_solves == 0 and watchdog.time_step == 3
+    assert watchdog.feed(" Solve Did NOT Converge!") is None
+    assert "2 times in a row (last time step 3)" in watchdog.feed(" Solve Did NOT Converge!")
+
+    diverging = Watchdog(divergence_factor=1e3)
+    assert diverging.feed(" 0 Nonlinear |R| = 1e-2") is None
+    assert "diverging" in diverging.feed(" 3 Nonlinear |R| = 1e+2")
+    assert "became nan" in Watchdog().feed(" 2 Nonlinear |R| = nan")
+    fatal = Watchdog()
+    assert "fatal error" in fatal.feed("\x1b[31m*** ERROR ***\x1b[0m") and fatal.fatal
+
+    succeeding = Watchdog(success_steps=2, timeout=5)
+    assert succeeding.on_timeout().startswith("The simulation did not converge")
+    assert succeeding.feed("Solve Converged!") is None
+    assert succeeding.feed("Solve Converged!") == "success"
+    assert succeeding.on_timeout() == "success"
+
+
+def test_run_with_watchdog_stops_the_process_early(tmp_path) -> None:
+    script = "import time\nfor step in range(1000):\n    print('Solve Converged!', flush=True)\n    time.sleep(0.01)\n"
+    start_time = time.perf_counter()
+    result = run_with_watchdog([sys.executable, "-c", script], Watchdog(success_steps=3), cwd=str(tmp_path))
+    assert time.perf_counter() - start_time < 5
+    assert result.returncode == 0 and result.stderr == ""
+    assert "Ran 3 time steps successfully" in result.stdout
+
+    # MOOSE exits on its own after the error, the error is not the watchdog's
+    script = "import sys\nprint('Time Step 1', flush=True)\nsys.exit('*** ERROR ***\\nunknown parameter foo')\n"
+    result = run_with_watchdog([sys.executable, "-c", script], Watchdog(), grace_period=2)
+    assert result.returncode == 1 and result.stderr == "*** ERROR ***\nunknown parameter foo\n"
+
+    script = "import time\nprint('Time Step 1')\nprint('*** ERROR ***', flush=True)\ntime.sleep(30)\n"
+    result = run_with_watchdog([sys.executable, "-c", script], Watchdog(), grace_period=0.5)
+    assert result.returncode != 0 and "Stopped by the watchdog: MOOSE reported a fatal error" in result.stderr
+    assert "Time Step 1" in result.stderr
@@ -0,0 +1,63 @@
+from tests.filepath import ABSOLUTE_PATH
+import sys
+import threading
+import time
+
+sys.path.append(ABSOLUTE_PATH)
+from mooseagent.scheduler import ResourceScheduler, estimate_elements
+
+CARD = """[Mesh]
+  [gen]
+    type = GeneratedMeshGenerator
+    dim = 2
+    nx = 100
+    ny = 50
+  []
+  uniform_refine = 1
+[]
+"""
+
+
+def test_estimate_elements_and_ranks(tmp_path) -> None:
+    assert estimate_elements(CARD) == 100 * 50 * 4
+    assert estimate_elements(CARD.replace("  uniform_refine = 1\n", "")) == 5000
+    assert estimate_elements("[Mesh]\n  type = FileMesh\n  file = plate.e\n[]\n") is None
+    assert estimate_elements("[Mesh]\n  nx = 10\n") is None  # unbalanced
+
+    scheduler = ResourceScheduler(str(tmp_path), total_cores=4)
+    assert scheduler.ranks_for(CARD, 1, 5000) == 4
+    assert scheduler.ranks_for(CARD, 1, 1000000) == 1
+    assert scheduler.ranks_for("[Mesh]\n  file = plate.e\n[]\n", 8, 5000) == 4
+    assert scheduler.clamp(0) == 1 and scheduler.clamp(16) == 4
+
+
+def test_jobs_are_served_in_order_and_never_oversubscribe(tmp_path) -> None:
+    scheduler = ResourceScheduler(str(tmp_path), total_cores=2, poll_interval=0.01)
+    started, running, peak = [], [0], [0]
+    lock = threading.Lock()
+
+    def job(name: str, ranks: int, duration: float):
+        with scheduler.acquire(ranks, label=name) as granted:
+            with lock:
+                started.append(name)
+                running[0] += granted
+                peak[0] = max(peak[0], running[0])
+            time.sleep(duration)
+            with lock:
+                running[0] -= granted
+
+    first = threading.Thread(target=job, args=("first", 1, 0.2))
+    first.start()
+    time.sleep(0.05)
+    # the large job waits for the core of the first job, the small job behind it does not overtake it
+    threads = [threading.Thread(target=job, args=("large", 8, 0.05))]
+    threads[0].start()
+    time.sleep(0.05)
+    threads.append(threading.Thread(target=job, args=("small", 1, 0.05)))
+    threads[1].start()
+    for thread in [first] + threads:
+        thread.join()
+    assert started == ["first", "large", "small"]
+    assert peak[0] == 2
+    assert [m["ranks"] for m in scheduler.metrics] == [1, 2, 1]
+    assert scheduler.metrics[1]["queue_time"] > 0.05
@@ -0,0 +1,100 @@
+from tests.filepath import ABSOLUTE_PATH
+import asyncio
+import os
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+from typing_extensions import TypedDict
+from langchain_core.language_models.fake_chat_models import FakeListChatModel
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import StateGraph, START, END
+
+from mooseagent.events import log
+from mooseagent.server import GraphService, ServerBusy, load_test
+
+
+class SlowFakeModel(FakeListChatModel):
+    async def _agenerate(self, *args, **kwargs):
+        await asyncio.sleep(0.05)
+        return await super()._agenerate(*args, **kwargs)
+
+
+class State(TypedDict):
+    requirement: str
+    dp_json: dict
+    answer: str
+
+
+async def stub_architect(state: State, config: RunnableConfig):
+    model = SlowFakeModel(responses=["[Mesh]\n[]\n"])
+    answer = (await model.ainvoke(state["requirement"])).content
+    save_dir = config["configurable"]["save_dir"]
+    with open(os.path.join(save_dir, "main.i"), "w") as f:
+        f.write(state["requirement"])
+    log(f"wrote {save_dir}")
+    if state["requirement"] == "slow":
+        await asyncio.sleep(10)
+    return {"answer": answer}
+
+
+def stub_graph():
+    builder = StateGraph(State)
+    builder.add_node("architect", stub_architect)
+    builder.add_edge(START, "architect")
+    builder.add_edge("architect", END)
+    return builder.compile()
+
+
+def test_service_queueing_limits_and_cancellation(tmp_path) -> None:
+    async def main():
+        service = GraphService(
+            stub_graph(), work_root=str(tmp_path), workers=4, max_queue=2, default_provider_limit=2
+        )
+        await service.start()
+        try:
+            report = await load_test(service, [f"case {n}" for n in range(12)], retry_interval=0.01)
+            slow = await service.submit("slow", dp_json={})
+            while service.status(slow) != "running":
+                await asyncio.sleep(0.01)
+            assert service.cancel(slow)
+            await asyncio.sleep(0.05)
+            status = service.status(slow)
+            for _ in range(2):
+                await service.submit("case", dp_json={})
+            try:
+                for _ in range(10):
+                    await service.submit("case", dp_json={})
+                busy = False
+            except ServerBusy:
+                busy = True
+            return report, status, busy, service
+        finally:
+            await service.close()
+
+    report, status, busy, service = asyncio.run(main())
+    assert report["done"] == 12 and report["failed"] == 0
+    assert report["peak_llm_calls"] and max(report["peak_llm_calls"].values()) <= 2
+    assert report["rejected"] > 0 and busy
+    assert status == "cancelled"
+    request = next(r for r in service.requests.values() if r.inputs["requirement"] == "case 3")
+    with open(os.path.join(request.save_dir, "main.i")) as f:
+        assert f.read() == "case 3"
+    assert "wrote" in open(os.path.join(request.save_dir, "run.log")).read()
+
+
+def test_documentation_follows_the_configuration_of_the_request(tmp_path) -> None:
+    for name in ("a", "b"):
+        (tmp_path / f"{name}.json").write_text(f'{{"{name}": "doc"}}')
+
+    async def main():
+        configurable = {"dp_json_path": str(tmp_path / "a.json")}
+        service = GraphService(stub_graph(), work_root=str(tmp_path), configurable=configurable)
+        await service.start()
+        try:
+            first = await service.submit("case")
+            second = await service.submit("case", configurable={"dp_json_path": str(tmp_path / "b.json")})
+            return service.requests[first].inputs["dp_json"], service.requests[second].inputs["dp_json"]
+        finally:
+            await service.close()
+
+    assert asyncio.run(main()) == ({"a": "doc"}, {"b": "doc"})
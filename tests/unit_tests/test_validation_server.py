@@ -0,0 +1,73 @@
+from tests.filepath import ABSOLUTE_PATH
+import asyncio
+import os
+import stat
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+from mooseagent.configuration import Configuration
+from mooseagent.runner import check_input
+from mooseagent.validation_server import ValidationClient, ValidationServer
+
+STUB_MOOSE = f"""#!{sys.executable}
+import os, sys
+card = open(sys.argv[sys.argv.index("-i") + 1]).read()
+assert "--check-input" in sys.argv
+for line in card.splitlines():
+    if "input_files" in line and not os.path.exists(line.split("=")[1].strip(" '")):
+        sys.exit("*** ERROR ***\\nsub-app input file is missing")
+    if line.strip().startswith("file =") and not os.path.exists(line.split("=")[1].strip(" '")):
+        sys.exit("*** ERROR ***\\nmesh file is missing")
+if "bad" in card:
+    sys.exit("*** ERROR ***\\nunknown parameter bad")
+print("Input check finished")
+"""
+
+
+def test_validation_server_with_stub_executable(tmp_path) -> None:
+    executable = tmp_path / "stub-opt"
+    executable.write_text(STUB_MOOSE)
+    executable.chmod(executable.stat().st_mode | stat.S_IEXEC)
+    socket_path = str(tmp_path / "validation.sock")
+    run_dir = tmp_path / "run"
+    (run_dir / "meshes").mkdir(parents=True)
+    (run_dir / "meshes" / "plate.e").write_text("mesh")
+    mesh_card = "[Mesh]\n  file = meshes/plate.e\n[]\n"
+
+    async def main():
+        server = ValidationServer(str(executable), socket_path, pool_size=2)
+        await server.start()
+        try:
+            client = ValidationClient(socket_path)
+            master = "[MultiApps]\n  [sub]\n    input_files = 'sub.i'\n  []\n[]\n"
+            results = await asyncio.gather(
+                client.check({"good.i": "[Mesh]\n[]\n"}, "good.i"),
+                client.check({"bad.i": "bad = 1\n"}, "bad.i"),
+                client.check({"master.i": master, "sub.i": "[Mesh]\n[]\n"}, "master.i"),
+                client.check({"master.i": master}, "master.i"),
+                client.check({"mesh.i": mesh_card}, "mesh.i", str(run_dir)),
+                client.check({"mesh.i": mesh_card}, "mesh.i"),
+            )
+            return results, server.n_checks
+        finally:
+            await server.close()
+
+    results, n_checks = asyncio.run(main())
+    assert results[0]["returncode"] == 0 and results[0]["stderr"] == ""
+    assert "unknown parameter bad" in results[1]["stderr"]
+    assert results[2]["returncode"] == 0
+    assert "sub-app input file is missing" in results[3]["stderr"]
+    assert results[4]["returncode"] == 0
+    assert "mesh file is missing" in results[5]["stderr"]
+    assert n_checks == 6
+    assert not os.path.exists(socket_path)
+    assert (run_dir / "meshes" / "plate.e").read_text() == "mesh"  # the slot only linked it
+
+
+def test_check_input_falls_back_without_a_server(tmp_path) -> None:
+    socket_path = tmp_path / "stale.sock"
+    socket_path.write_text("")  # left behind by a stopped server
+    configuration = Configuration(
+        MOOSE_DIR=str(tmp_path / "moose-opt"), validation_socket=str(socket_path), save_dir=str(tmp_path)
+    )
+    assert asyncio.run(check_input(configuration, "main.i", {"main.i": "[Mesh]\n[]\n"})) == ""
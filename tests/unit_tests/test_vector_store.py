@@ -0,0 +1,85 @@
+from tests.filepath import ABSOLUTE_PATH
+import json
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+import pytest
+from langchain_core.documents import Document
+from langchain_core.embeddings import DeterministicFakeEmbedding
+
+from mooseagent.corpus import append_record, read_records, record_document
+from mooseagent.vector_store import OnlineIndex, open_store, store_documents
+
+FAISS = pytest.importorskip("langchain_community.vectorstores").FAISS
+pytest.importorskip("faiss")
+
+CARD = "[Kernels]\n  [diff]\n    type = Diffusion\n    variable = u\n  []\n[]\n"
+
+
+def test_online_index_grows_dedups_and_compacts(tmp_path) -> None:
+    directory, learned = str(tmp_path / "inpcard"), str(tmp_path / "learned.jsonl")
+    embedding = DeterministicFakeEmbedding(size=8)
+    FAISS.from_documents([Document(page_content="case 0")], embedding).save_local(directory)
+    index = OnlineIndex(open_store("faiss", directory, embedding), directory, learned, compact_every=0)
+    assert index.learn("Heat conduction in a plate.", {"main.i": CARD}, {"main.i": "The main app."}) == 1
+    assert index.learn("Heat conduction in a plate.", {"main.i": CARD}, {"main.i": "The main app."}) == 0
+    record = list(read_records(learned))[0]
+    assert record["module"] == "heat_transfer" and "The main app." in record["overall_description"]
+
+    # another process adds a card to the same store, this process catches up before it writes
+    other = OnlineIndex(open_store("faiss", directory, embedding), directory, learned, compact_every=0)
+    assert other.learn("Phase field solidification.", {"main.i": CARD}) == 1
+    assert index.learn("Porous flow.", {"main.i": CARD}) == 1
+    assert len(store_documents(open_store("faiss", directory, embedding))) == 4
+
+    index.vectordb.add_documents([Document(page_content="case 0")])
+    index.compact_every = 1
+    assert index.learn("Contact of two blocks.", {"main.i": CARD}) == 1
+    index.compaction.join()
+    assert len(store_documents(open_store("faiss", directory, embedding))) == 5
+    assert len(index.hashes.hashes) == 5
+
+
+def remove_learned(path: str, name: str):
+    records = [record for record in read_records(path) if record["input_card_name"] != name]
+    with open(path, "w", encoding="utf-8") as f:
+        f.writelines(json.dumps(record) + "\n" for record in records)
+
+
+@pytest.mark.parametrize("chunk_mode", ["card", "block"])
+def test_compaction_removes_the_documents_of_superseded_cards(tmp_path, chunk_mode) -> None:
+    directory, learned = str(tmp_path / "inpcard"), str(tmp_path / "learned.jsonl")
+    embedding = DeterministicFakeEmbedding(size=8)
+    FAISS.from_documents([Document(page_content="case 0")], embedding).save_local(directory)
+    index = OnlineIndex(open_store("faiss", directory, embedding), directory, learned, chunk_mode, compact_every=0)
+    other_card = CARD.replace("Diffusion", "HeatConduction")
+    assert index.learn("Heat conduction in a plate.", {"main.i": CARD}) == 1
+    # the same requirement with other cards is another record, the first one stays
+    assert index.learn("Heat conduction in a plate.", {"main.i": other_card}) == 1
+    first, second = [record["input_card_name"] for record in read_records(learned)]
+    assert first != second
+    assert index.compact()["removed_superseded"] == 0
+
+    remove_learned(learned, first)
+    stats = index.compact()
+    assert (stats["removed_superseded"], stats["learned_cards"], stats["documents"]) == (1, 1, 2)
+    assert "Diffusion" not in "".join(store_documents(open_store("faiss", directory, embedding)).values())
+
+
+def test_compaction_keeps_only_the_last_record_of_a_name(tmp_path) -> None:
+    directory, learned = str(tmp_path / "inpcard"), str(tmp_path / "learned.jsonl")
+    embedding = DeterministicFakeEmbedding(size=8)
+    FAISS.from_documents([Document(page_content="case 0")], embedding).save_local(directory)
+    index = OnlineIndex(open_store("faiss", directory, embedding), directory, learned, compact_every=0)
+    # records named by the requirement only, as learned before the names had the hash of the card
+    for card in (CARD, CARD.replace("Diffusion", "HeatConduction")):
+        record = {
+            "input_card_name": "learned_0a1b2c3d_main.i",
+            "overall_description": "Heat.",
+            "annotated_input_card": card,
+        }
+        append_record(learned, record)
+        index.vectordb.add_documents([record_document(record, learned)])
+    stats = index.compact()
+    assert (stats["removed_superseded"], stats["learned_cards"], stats["documents"]) == (1, 1, 2)
+    assert "HeatConduction" in "".join(store_documents(index.vectordb).values())
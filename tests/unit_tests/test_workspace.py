@@ -0,0 +1,65 @@
+from tests.filepath import ABSOLUTE_PATH
+import os
+import subprocess
+import sys
+
+sys.path.append(ABSOLUTE_PATH)
+from mooseagent.runner import run_progress
+from mooseagent.workspace import Workspace, get_workspace, release_workspace
+
+
+def run(stdout: str, stderr: str = "") -> subprocess.CompletedProcess:
+    return subprocess.CompletedProcess([], 1 if stderr else 0, stdout, stderr)
+
+
+def test_workspace_versions_and_rolls_back_to_the_furthest_version(tmp_path) -> None:
+    root, save_dir = str(tmp_path / "workspace"), str(tmp_path / "run_path")
+    solved = "Time Step 1\n 0 Nonlinear |R| = 1e-1\n Solve Converged!\nTime Step 2\n"
+    assert run_progress(run(solved, "*** ERROR ***\nsolve failed")) == (2, 1)
+    assert run_progress(run("Setting up", "*** ERROR ***\nunknown object")) == (1, 0)
+    assert run_progress(run(solved)) == (3, 1)
+
+    workspace = Workspace(root, "run1", save_dir)
+    workspace.write("main.i", "[Mesh]\n[]\n")
+    assert workspace.commit("architect", 0, 1) == 0
+    assert workspace.commit("architect", 0, 1) == 0  # nothing changed
+    assert open(os.path.join(workspace.materialise(), "main.i")).read() == "[Mesh]\n[]\n"
+    workspace.set_progress(0, run_progress(run(solved, "diverged")), "diverged")
+
+    # a modify which makes the run fail during the setup is rolled back
+    workspace.write("main.i", "[Mesh]\n  foo = 1\n[]\n")
+    assert workspace.commit("modify", 1, 1) == 1
+    workspace.set_progress(1, (1, 0), "unknown parameter foo")
+    best = workspace.rollback(1)
+    assert best["version"] == 0 and best["error"] == "diverged"
+    assert open(os.path.join(save_dir, "run1", "main.i")).read() == "[Mesh]\n[]\n"
+    assert workspace.rollback(2) is None  # another architecture
+
+    # the versions survive the process, another run does not see them
+    again = Workspace(root, "run1", save_dir)
+    assert [v["progress"] for v in again.versions] == [[2, 1], [1, 0]]
+    assert again.files == {"main.i": "[Mesh]\n  foo = 1\n[]\n"}
+    assert Workspace(root, "run2", save_dir).versions == []
+
+
+def test_new_architecture_replaces_the_cards_and_a_finished_run_is_released(tmp_path) -> None:
+    root, save_dir = str(tmp_path / "workspace"), str(tmp_path / "run_path")
+    workspace = get_workspace(root, "run1", save_dir)
+    assert get_workspace(root, "run1", save_dir) is workspace
+    workspace.write("main.i", "[Mesh]\n[]\n")
+    workspace.write("sub.i", "[Mesh]\n[]\n")
+    workspace.commit("architect", 0, 1)
+    directory = workspace.materialise()
+    open(os.path.join(directory, "main_out.csv"), "w").close()
+
+    workspace.reset()
+    workspace.write("main.i", "[Mesh]\n  dim = 2\n[]\n")
+    assert workspace.commit("architect", 0, 2) == 1
+    workspace.materialise()
+    assert sorted(os.listdir(directory)) == ["main.i", "main_out.csv"]  # the old sub-app card is gone
+    assert workspace.versions[0]["files"].keys() == {"main.i", "sub.i"}
+
+    release_workspace(root, "run1", save_dir)
+    again = get_workspace(root, "run1", save_dir)
+    assert again is not workspace and again.files == {"main.i": "[Mesh]\n  dim = 2\n[]\n"}
+    release_workspace(root, "run1", save_dir)